@@ -0,0 +1,19 @@
+"""
+Benchmarks de los scripts del gestor de autónomos.
+
+Genera exportaciones sintéticas (Substack, Stripe, facturas emitidas y
+recibidas) del tamaño pedido y mide cada script en un proceso aparte:
+segundos, filas por segundo y memoria máxima (RSS). El resultado es un JSON
+que se puede comparar con el de otra versión para detectar regresiones.
+    
+    python3 scripts/benchmark --tamaños 10k,1m --salida bench.json
+    python3 scripts/benchmark --tamaños 10k,1m --comparar bench.json
+"""
+
+import os
+import sys
+
+# Los scripts se importan como módulos sueltos (igual que entre ellos)
+DIRECTORIO_SCRIPTS = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if DIRECTORIO_SCRIPTS not in sys.path:
+    sys.path.insert(0, DIRECTORIO_SCRIPTS)
@@ -0,0 +1,138 @@
+"""
+Ejecuta el benchmark: cada caso en un proceso nuevo, para que la memoria
+máxima (RSS) sea la suya y no la acumulada de los casos anteriores.
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Dict, List, Optional
+
+if not __package__:
+    # python3 scripts/benchmark: el paquete no está en sys.path
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmark import DIRECTORIO_SCRIPTS
+from benchmark.casos import CASOS, ejecutar_caso
+from benchmark.generadores import preparar_datos
+
+SUFIJOS = {'k': 1_000, 'm': 1_000_000}
+
+def parsear_tamaño(texto: str) -> int:
+    """'10k' → 10000, '1m' → 1000000, '2500' → 2500."""
+    texto = texto.strip().lower()
+    if texto and texto[-1] in SUFIJOS:
+        return int(texto[:-1]) * SUFIJOS[texto[-1]]
+    return int(texto)
+
+def medir(caso: str, rutas: Dict[str, str], filas: int, limite_memoria: Optional[int] = None) -> Dict:
+    """Ejecuta un caso en un proceso nuevo (spawn). Un fallo se anota, no aborta el resto."""
+    resultado = {'caso': caso, 'tamaño': filas}
+    contexto = multiprocessing.get_context('spawn')
+    try:
+        with ProcessPoolExecutor(max_workers=1, mp_context=contexto) as pool:
+            resultado.update(pool.submit(ejecutar_caso, caso, rutas, filas, limite_memoria).result())
+        resultado['error'] = None
+    except Exception as e:
+        resultado['error'] = f'{type(e).__name__}: {e}'
+    return resultado
+
+def commit_actual() -> Optional[str]:
+    try:
+        salida = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=DIRECTORIO_SCRIPTS,
+                                capture_output=True, text=True, timeout=5)
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return salida.stdout.strip() or None
+
+def version_numpy() -> Optional[str]:
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy.__version__
+
+def comparar(actual: List[Dict], anterior: List[Dict], tolerancia: float) -> List[Dict]:
+    """
+    Casos cuyo rendimiento (filas/s) cae, o cuya memoria máxima crece, más de
+    `tolerancia` (0.10 = 10 %) respecto a una ejecución anterior.
+    """
+    previos = {(r['caso'], r['tamaño']): r for r in anterior if not r.get('error')}
+    regresiones = []
+    for r in actual:
+        previo = previos.get((r['caso'], r['tamaño']))
+        if previo is None or r.get('error'):
+            continue
+        if previo['filas_por_segundo'] and r['filas_por_segundo'] < previo['filas_por_segundo'] * (1 - tolerancia):
+            regresiones.append({'caso': r['caso'], 'tamaño': r['tamaño'], 'metrica': 'filas_por_segundo',
+                                'anterior': previo['filas_por_segundo'], 'actual': r['filas_por_segundo']})
+        if previo['rss_pico_mb'] and r['rss_pico_mb'] and r['rss_pico_mb'] > previo['rss_pico_mb'] * (1 + tolerancia):
+            regresiones.append({'caso': r['caso'], 'tamaño': r['tamaño'], 'metrica': 'rss_pico_mb',
+                                'anterior': previo['rss_pico_mb'], 'actual': r['rss_pico_mb']})
+    return regresiones
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark de los scripts del gestor de autónomos')
+    parser.add_argument('--tamaños', default='10k', help='Filas por archivo, separadas por comas (10k,1m,10m)')
+    parser.add_argument('--casos', help=f"Casos a ejecutar, separados por comas (defecto: todos): {','.join(CASOS)}")
+    parser.add_argument('--datos', default=os.path.join(tempfile.gettempdir(), 'gestor_benchmark'),
+                        help='Directorio de los datos sintéticos (se reutilizan entre ejecuciones)')
+    parser.add_argument('--limite-memoria', type=int, metavar='MB', help='Límite de memoria virtual de cada caso')
+    parser.add_argument('--salida', help='Guardar el resultado en este JSON')
+    parser.add_argument('--comparar', metavar='JSON', help='Resultado anterior con el que comparar')
+    parser.add_argument('--tolerancia', type=float, default=0.10,
+                        help='Empeoramiento admitido al comparar (0.10 = 10%%)')
+    args = parser.parse_args()
+    
+    tamaños = [parsear_tamaño(t) for t in args.tamaños.split(',')]
+    casos = args.casos.split(',') if args.casos else list(CASOS)
+    desconocidos = [c for c in casos if c not in CASOS]
+    if desconocidos:
+        parser.error(f"Casos desconocidos: {', '.join(desconocidos)}")
+    
+    resultados = []
+    for filas in tamaños:
+        print(f"Preparando datos de {filas} filas en {args.datos}...", file=sys.stderr)
+        rutas = preparar_datos(args.datos, filas)
+        for caso in casos:
+            resultado = medir(caso, rutas, filas, args.limite_memoria)
+            resultados.append(resultado)
+            if resultado['error']:
+                print(f"  {caso:<30} ERROR {resultado['error']}", file=sys.stderr)
+            else:
+                print(f"  {caso:<30} {resultado['segundos']:>9.3f} s {resultado['filas_por_segundo']:>11} filas/s"
+                      f" {resultado['rss_pico_mb']} MB", file=sys.stderr)
+    
+    informe = {
+        'fecha': datetime.now().isoformat(),
+        'commit': commit_actual(),
+        'python': platform.python_version(),
+        'plataforma': platform.platform(),
+        'numpy': version_numpy(),
+        'resultados': resultados,
+    }
+    
+    regresiones = []
+    if args.comparar:
+        with open(args.comparar, 'r', encoding='utf-8') as f:
+            regresiones = comparar(resultados, json.load(f)['resultados'], args.tolerancia)
+        informe['regresiones'] = regresiones
+    
+    texto = json.dumps(informe, indent=2, ensure_ascii=False)
+    if args.salida:
+        with open(args.salida, 'w', encoding='utf-8') as f:
+            f.write(texto)
+    print(texto)
+    
+    if regresiones:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+"""
+Casos del benchmark.
+
+Cada caso recibe las rutas de preparar_datos() y el tamaño, prepara lo que
+no se quiere medir (imports, listas de entrada) y devuelve la función a
+cronometrar, que devuelve a su vez el número de filas procesadas.
+"""
+
+import os
+import sys
+import time
+from decimal import Decimal
+from typing import Callable, Dict, Optional
+
+from benchmark.generadores import generar_nifs
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Las calculadoras trabajan por llamada, no por fila: con 10M de filas
+# tardarían minutos sin medir nada nuevo
+LIMITE_CALCULOS = 1_000_000
+
+def _stripe_archivo(nombre: str, incluir_detalle: bool, motor: str = 'auto'):
+    def caso(rutas: Dict[str, str], filas: int) -> Callable[[], int]:
+        from procesar_stripe import procesar_archivo
+        
+        def ejecutar() -> int:
+            resultado = procesar_archivo(rutas[nombre], 'csv', 4, 2025, incluir_detalle, motor=motor)
+            return resultado['registros_leidos']
+        return ejecutar
+    return caso
+
+def caso_substack_dicts(rutas: Dict[str, str], filas: int) -> Callable[[], int]:
+    """procesar_substack_stripe sobre un iterador de dicts (la API pública)."""
+    from procesar_stripe import iterar_csv, procesar_substack_stripe
+    
+    def ejecutar() -> int:
+        resultado = procesar_substack_stripe(iterar_csv(rutas['substack']), 4, 2025, incluir_detalle=False)
+        return resultado['registros_leidos']
+    return ejecutar
+
+def _facturas_emitidas(incluir_detalle: bool):
+    def caso(rutas: Dict[str, str], filas: int) -> Callable[[], int]:
+        from procesar_facturas import procesar_csv
+        
+        def ejecutar() -> int:
+            resultado = procesar_csv(rutas['emitidas'], 'emitidas', incluir_detalle)
+            return resultado['num_facturas'] + resultado['num_errores']
+        return ejecutar
+    return caso
+
+def caso_libro(rutas: Dict[str, str], filas: int) -> Callable[[], int]:
+    from generar_libro import generar_libro
+    
+    def ejecutar() -> int:
+        generar_libro(4, 2025, rutas['emitidas'], rutas['recibidas'])
+        return 2 * filas
+    return ejecutar
+
+def caso_validar_nif(rutas: Dict[str, str], filas: int) -> Callable[[], int]:
+    from procesar_facturas import validar_nif
+    nifs = list(generar_nifs(filas))
+    
+    def ejecutar() -> int:
+        for nif in nifs:
+            validar_nif(nif)
+        return len(nifs)
+    return ejecutar
+
+def caso_validar_nif_lote(rutas: Dict[str, str], filas: int) -> Callable[[], int]:
+    from procesar_facturas import validar_lote
+    nifs = list(generar_nifs(filas))
+    
+    def ejecutar() -> int:
+        return len(validar_lote(nifs))
+    return ejecutar
+
+def caso_calcular_iva(rutas: Dict[str, str], filas: int) -> Callable[[], int]:
+    from calcular_iva import calcular_desde_bases, calcular_iva_trimestral
+    n = min(filas, LIMITE_CALCULOS)
+    importes = [Decimal(i % 100000).scaleb(-2) for i in range(n)]
+    tipos = [Decimal(t) for t in ('21', '10', '4')]
+    
+    def ejecutar() -> int:
+        for i, importe in enumerate(importes):
+            calcular_iva_trimestral(importe, importe / 3, importe / 7)
+            calcular_desde_bases(importe, tipos[i % 3], importe / 2, tipos[0])
+        return n
+    return ejecutar
+
+def caso_calcular_irpf(rutas: Dict[str, str], filas: int) -> Callable[[], int]:
+    from calcular_irpf import calcular_modelo_130
+    n = min(filas, LIMITE_CALCULOS)
+    importes = [Decimal(i % 1000000).scaleb(-2) for i in range(n)]
+    
+    def ejecutar() -> int:
+        for importe in importes:
+            calcular_modelo_130(importe, importe / 4, importe / 20, importe * 2, importe / 2)
+        return n
+    return ejecutar
+
+def caso_contabilidad(rutas: Dict[str, str], filas: int) -> Callable[[], int]:
+    """Los cuatro informes trimestrales desde SQLite (la importación, fuera de la medida, se reutiliza)."""
+    from contabilidad import abrir, importar_facturas, importar_pagos, informe
+    con = abrir(os.path.join(os.path.dirname(rutas['emitidas']), f'contabilidad_{filas}.sqlite'))
+    importar_facturas(con, rutas['emitidas'], 'emitidas')
+    importar_facturas(con, rutas['recibidas'], 'recibidas')
+    importar_pagos(con, rutas['substack'])
+    
+    def ejecutar() -> int:
+        for trimestre in range(1, 5):
+            informe(con, 2025, trimestre)
+        return 3 * filas
+    return ejecutar
+
+CASOS = {
+    'stripe_substack': _stripe_archivo('substack', incluir_detalle=False),
+    'stripe_substack_detalle': _stripe_archivo('substack', incluir_detalle=True),
+    'stripe_substack_python': _stripe_archivo('substack', incluir_detalle=False, motor='python'),
+    'stripe_stripe': _stripe_archivo('stripe', incluir_detalle=False),
+    'stripe_dicts': caso_substack_dicts,
+    'facturas_emitidas': _facturas_emitidas(incluir_detalle=True),
+    'facturas_emitidas_sin_detalle': _facturas_emitidas(incluir_detalle=False),
+    'generar_libro': caso_libro,
+    'contabilidad_informes': caso_contabilidad,
+    'validar_nif': caso_validar_nif,
+    'validar_nif_lote': caso_validar_nif_lote,
+    'calcular_iva': caso_calcular_iva,
+    'calcular_irpf': caso_calcular_irpf,
+}
+
+def rss_pico_mb() -> Optional[float]:
+    """Memoria máxima (RSS) del proceso actual en MB."""
+    if resource is None:
+        return None
+    pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux da KB y macOS bytes
+    return round(pico / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+def ejecutar_caso(caso: str, rutas: Dict[str, str], filas: int, limite_memoria: Optional[int]) -> Dict:
+    """Se ejecuta en el proceso hijo: prepara el caso, lo cronometra y mide la memoria."""
+    if limite_memoria and resource is not None:
+        limite = limite_memoria * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limite, limite))
+    ejecutar = CASOS[caso](rutas, filas)
+    rss_inicio = rss_pico_mb()
+    inicio = time.perf_counter()
+    procesadas = ejecutar()
+    segundos = time.perf_counter() - inicio
+    return {
+        'filas': procesadas,
+        'segundos': round(segundos, 4),
+        'filas_por_segundo': round(procesadas / segundos) if segundos else None,
+        'rss_inicio_mb': rss_inicio,
+        'rss_pico_mb': rss_pico_mb(),
+    }
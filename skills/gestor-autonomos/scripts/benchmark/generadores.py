@@ -0,0 +1,167 @@
+"""
+Generadores de datos sintéticos, deterministas (semilla fija) y en streaming:
+se escriben por bloques, así que 10M de filas no ocupan 10M de filas en memoria.
+"""
+
+import csv
+import os
+import random
+from datetime import date, timedelta
+from typing import Dict, Iterator, List
+
+BLOQUE = 100_000
+
+LETRAS_DNI = 'TRWAGMYFPDXBNJZSQVHLCKE'
+MESES_ABREV = ('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec')
+
+# País de facturación con peso: UE, no-UE y vacío (sin país)
+PAISES = ['ES', 'FR', 'DE', 'IT', 'PT', 'NL', 'IE', 'US', 'CA', 'GB', 'MX', 'CL', 'AR', 'CO', '']
+PESOS_PAISES = [30, 8, 8, 5, 4, 3, 2, 15, 4, 6, 4, 3, 2, 2, 4]
+
+# (moneda, símbolo, peso)
+MONEDAS_SUBSTACK = [('eur', '€', 55), ('usd', '$', 30), ('cad', 'CA$', 8), ('gbp', '£', 7)]
+MONEDAS_STRIPE = [('eur', 40), ('usd', 35), ('gbp', 8), ('chf', 5), ('mxn', 5), ('cad', 7)]
+PRECIOS = [5, 6, 8.5, 12.99, 50, 60, 85, 140]
+
+def _dias(año: int) -> List[date]:
+    inicio = date(año, 1, 1)
+    return [inicio + timedelta(days=i) for i in range((date(año + 1, 1, 1) - inicio).days)]
+
+def _bloques(filas: int) -> Iterator[range]:
+    for inicio in range(0, filas, BLOQUE):
+        yield range(inicio, min(inicio + BLOQUE, filas))
+
+def generar_substack(ruta: str, filas: int, año: int = 2025, semilla: int = 1) -> str:
+    """
+    Exportación de Substack: importes con símbolo (€60.00, CA$140.00, $5.00),
+    fechas 'DD-MMM-YY', países de IP y de facturación (a veces vacíos).
+    """
+    aleatorio = random.Random(semilla)
+    fechas = [f"{d.day:02d}-{MESES_ABREV[d.month - 1]}-{d.year % 100:02d}" for d in _dias(año)] + ['']
+    pesos_fechas = [1] * (len(fechas) - 1) + [len(fechas) // 50]
+    monedas = [(m, s) for m, s, _ in MONEDAS_SUBSTACK]
+    pesos_monedas = [p for _, _, p in MONEDAS_SUBSTACK]
+    
+    with open(ruta, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['email', 'date', 'currency', 'amount', 'Substack fee', 'Stripe fee',
+                         'plan', 'country (ip)', 'country (billing)'])
+        for bloque in _bloques(filas):
+            n = len(bloque)
+            columnas = zip(
+                bloque,
+                aleatorio.choices(fechas, pesos_fechas, k=n),
+                aleatorio.choices(monedas, pesos_monedas, k=n),
+                aleatorio.choices(PRECIOS, k=n),
+                aleatorio.choices(PAISES, PESOS_PAISES, k=n),
+                aleatorio.choices(PAISES, PESOS_PAISES, k=n),
+            )
+            writer.writerows(
+                [f'u{i}@mail.com', fecha, moneda, f'{simbolo}{precio:.2f}',
+                 f'{simbolo}{precio * 0.1:.2f}', f'{simbolo}{precio * 0.029 + 0.25:.2f}',
+                 'annual' if precio >= 50 else 'monthly', pais_ip, pais_facturacion]
+                for i, fecha, (moneda, simbolo), precio, pais_ip, pais_facturacion in columnas
+            )
+    return ruta
+
+def generar_stripe(ruta: str, filas: int, año: int = 2025, semilla: int = 2) -> str:
+    """
+    Exportación de Stripe: importe sin símbolo con columna Currency, fechas
+    ISO con hora, Card Country (a veces vacío) y algún reembolso negativo.
+    """
+    aleatorio = random.Random(semilla)
+    dias = [d.isoformat() for d in _dias(año)]
+    horas = [f' {h:02d}:{m:02d}:00' for h in range(24) for m in (0, 15, 30, 45)]
+    monedas = [m for m, _ in MONEDAS_STRIPE]
+    pesos_monedas = [p for _, p in MONEDAS_STRIPE]
+    importes = PRECIOS + [-5, -60]
+    pesos_importes = [10] * len(PRECIOS) + [1, 1]
+    
+    with open(ruta, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['id', 'Amount', 'Currency', 'Created (UTC)', 'Customer Email',
+                         'Card Country', 'Status', 'Stripe fee'])
+        for bloque in _bloques(filas):
+            n = len(bloque)
+            columnas = zip(
+                bloque,
+                aleatorio.choices(importes, pesos_importes, k=n),
+                aleatorio.choices(monedas, pesos_monedas, k=n),
+                aleatorio.choices(dias, k=n),
+                aleatorio.choices(horas, k=n),
+                aleatorio.choices(PAISES, PESOS_PAISES, k=n),
+            )
+            writer.writerows(
+                [f'ch_{i:08d}', f'{importe:.2f}', moneda, dia + hora, f'u{i}@x.com', pais,
+                 'succeeded' if importe > 0 else 'refunded', f'{abs(importe) * 0.029 + 0.25:.2f}']
+                for i, importe, moneda, dia, hora, pais in columnas
+            )
+    return ruta
+
+def generar_nifs(cantidad: int, semilla: int = 3) -> Iterator[str]:
+    """NIF, NIE y CIF con formato válido, con algún error de letra y basura."""
+    aleatorio = random.Random(semilla)
+    for _ in range(cantidad):
+        tipo = aleatorio.random()
+        if tipo < 0.6:
+            numero = aleatorio.randint(0, 99999999)
+            letra = LETRAS_DNI[numero % 23] if aleatorio.random() > 0.05 else 'A'
+            yield f'{numero:08d}{letra}'
+        elif tipo < 0.75:
+            prefijo = aleatorio.randint(0, 2)
+            numero = aleatorio.randint(0, 9999999)
+            yield f"{'XYZ'[prefijo]}{numero:07d}{LETRAS_DNI[(prefijo * 10_000_000 + numero) % 23]}"
+        elif tipo < 0.98:
+            yield f"{aleatorio.choice('ABEGHJ')}{aleatorio.randint(0, 9999999):07d}{aleatorio.randint(0, 9)}"
+        else:
+            yield aleatorio.choice(['', 'FOO', '1234'])
+
+def generar_facturas(ruta: str, filas: int, año: int = 2025, semilla: int = 4) -> str:
+    """
+    CSV de facturas (numero,fecha,nif,concepto,base_imponible,tipo_iva,
+    tipo_retencion) con bases de varios tamaños, alguna con coma decimal.
+    """
+    aleatorio = random.Random(semilla)
+    dias = [d.isoformat() for d in _dias(año)]
+    bases = ['1000', '250.50', '99.99', '1234.56', '10,5', '0.05', '333.33', '4800', '12.10']
+    nifs = generar_nifs(filas, semilla)
+    
+    with open(ruta, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['numero', 'fecha', 'nif', 'concepto', 'base_imponible', 'tipo_iva', 'tipo_retencion'])
+        for bloque in _bloques(filas):
+            n = len(bloque)
+            columnas = zip(
+                bloque,
+                aleatorio.choices(dias, k=n),
+                nifs,
+                aleatorio.choices(bases, k=n),
+                aleatorio.choices(['21', '10', '4', '0'], [70, 15, 10, 5], k=n),
+                aleatorio.choices(['0', '15', '7'], [40, 50, 10], k=n),
+            )
+            writer.writerows(
+                [f'F{año}-{i:08d}', dia, nif, 'Servicios profesionales', base, iva, retencion]
+                for i, dia, nif, base, iva, retencion in columnas
+            )
+    return ruta
+
+def preparar_datos(directorio: str, filas: int) -> Dict[str, str]:
+    """
+    Genera (o reutiliza, si ya existen) los archivos de un tamaño.
+    Returns: {'substack', 'stripe', 'emitidas', 'recibidas'} → ruta
+    """
+    os.makedirs(directorio, exist_ok=True)
+    generadores = {
+        'substack': generar_substack,
+        'stripe': generar_stripe,
+        'emitidas': lambda ruta, n: generar_facturas(ruta, n, semilla=4),
+        'recibidas': lambda ruta, n: generar_facturas(ruta, n, semilla=5),
+    }
+    rutas = {}
+    for nombre, generar in generadores.items():
+        ruta = os.path.join(directorio, f'{nombre}_{filas}.csv')
+        if not os.path.exists(ruta):
+            generar(ruta + '.tmp', filas)
+            os.replace(ruta + '.tmp', ruta)
+        rutas[nombre] = ruta
+    return rutas
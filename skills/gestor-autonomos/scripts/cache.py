@@ -0,0 +1,134 @@
+"""
+Caché en disco de los agregados parciales por archivo.
+
+Las carpetas de exportaciones solo crecen: los archivos de meses pasados no
+cambian. Cada script guarda lo que obtiene de un archivo (acumulados de
+pagos, apuntes del libro, totales de facturas) con una clave que combina:
+
+- el contenido del archivo (sha256),
+- los parámetros que cambian el resultado (trimestre, año, formato...),
+- el código de los scripts.
+
+Una segunda ejecución solo procesa los archivos nuevos o modificados y
+fusiona sus parciales con los de la caché. Solo se usa con --cache (sin él
+no se lee ni se escribe nada). Los parciales se guardan con pickle en
+GESTOR_CACHE (por defecto ~/.cache/gestor-autonomos, creada con permisos
+0700): cargar un pickle ejecuta código, así que la carpeta no debe ser
+compartida ni escribible por otros usuarios. Basta borrarla para vaciarla.
+Los resultados con 'error' no se guardan.
+"""
+
+import gc
+import hashlib
+import os
+import pickle
+import sys
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import Any, Callable, Optional
+
+DIRECTORIO_SCRIPTS = os.path.dirname(os.path.abspath(__file__))
+DIRECTORIO_DEFECTO = os.environ.get('GESTOR_CACHE') or os.path.join(
+    os.path.expanduser('~'), '.cache', 'gestor-autonomos'
+)
+BLOQUE_LECTURA = 1 << 20
+
+def huella_archivo(archivo: str, prefijo: str = '') -> str:
+    """sha256 de `prefijo` más el contenido del archivo."""
+    h = hashlib.sha256(prefijo.encode())
+    with open(archivo, 'rb') as f:
+        for bloque in iter(lambda: f.read(BLOQUE_LECTURA), b''):
+            h.update(bloque)
+    return h.hexdigest()
+
+@lru_cache(maxsize=1)
+def huella_codigo() -> str:
+    """sha256 de los scripts: cualquier cambio en el código invalida la caché."""
+    h = hashlib.sha256()
+    for nombre in sorted(os.listdir(DIRECTORIO_SCRIPTS)):
+        if nombre.endswith('.py'):
+            with open(os.path.join(DIRECTORIO_SCRIPTS, nombre), 'rb') as f:
+                h.update(nombre.encode() + b'\0' + f.read())
+    return h.hexdigest()
+
+@contextmanager
+def sin_gc():
+    """
+    Pausa el recolector de ciclos: pickle crea o recorre millones de
+    registros y cada pocos miles de objetos el recolector los revisaría todos.
+    """
+    activo = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if activo:
+            gc.enable()
+
+class Cache:
+    """Parciales por archivo en un directorio; cuenta aciertos y fallos."""
+    
+    def __init__(self, directorio: str = DIRECTORIO_DEFECTO):
+        self.directorio = directorio
+        self.aciertos = 0
+        self.fallos = 0
+    
+    def clave(self, archivo: str, *parametros) -> str:
+        """Clave de lo que `archivo` da con `parametros` (tuplas de str/int/bool/None)."""
+        prefijo = repr((huella_codigo(), parametros))
+        return huella_archivo(archivo, prefijo)
+    
+    def _ruta(self, clave: str) -> str:
+        return os.path.join(self.directorio, clave[:2], clave + '.pickle')
+    
+    def leer(self, clave: str) -> Optional[Any]:
+        """Parcial guardado, o None si no está (o no se puede leer)."""
+        try:
+            with open(self._ruta(clave), 'rb') as f, sin_gc():
+                valor = pickle.load(f)
+        except FileNotFoundError:
+            self.fallos += 1
+            return None
+        except Exception as e:
+            print(f"Advertencia: caché ilegible ({e}), se recalcula", file=sys.stderr)
+            self.fallos += 1
+            return None
+        self.aciertos += 1
+        return valor
+    
+    def guardar(self, clave: str, valor: Any):
+        """Escribe el parcial de forma atómica (archivo temporal + os.replace)."""
+        import tempfile  # arrastra shutil, random...: solo al escribir
+        ruta = self._ruta(clave)
+        os.makedirs(self.directorio, mode=0o700, exist_ok=True)
+        os.makedirs(os.path.dirname(ruta), exist_ok=True)
+        descriptor, temporal = tempfile.mkstemp(dir=os.path.dirname(ruta), suffix='.tmp')
+        try:
+            with os.fdopen(descriptor, 'wb') as f, sin_gc():
+                pickle.dump(valor, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temporal, ruta)
+        except BaseException:
+            os.unlink(temporal)
+            raise
+    
+    def obtener(self, archivo: str, parametros: tuple, calcular: Callable[[], Any]) -> Any:
+        """Parcial de `archivo` desde la caché, o calculado y guardado (salvo un {'error': ...})."""
+        clave = self.clave(archivo, *parametros)
+        valor = self.leer(clave)
+        if valor is None:
+            valor = calcular()
+            if not (isinstance(valor, dict) and 'error' in valor):
+                self.guardar(clave, valor)
+        return valor
+
+def añadir_argumento(parser):
+    """Añade --cache (y --no-cache, que es lo que se hace por defecto) a un ArgumentParser."""
+    import argparse
+    parser.add_argument('--cache', action='store_true',
+                        help=f'Guardar y reutilizar los parciales de cada archivo (pickle) en {DIRECTORIO_DEFECTO} '
+                             '(GESTOR_CACHE). Solo en una carpeta propia: leer un pickle ajeno ejecuta código')
+    parser.add_argument('--no-cache', action='store_true', help=argparse.SUPPRESS)
+
+def crear(activar: bool) -> Optional[Cache]:
+    """Cache en el directorio por defecto con --cache; None si no."""
+    return Cache() if activar else None
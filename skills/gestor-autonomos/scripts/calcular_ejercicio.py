@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+"""
+Modelos 303 y 130 de todos los trimestres del año en una pasada.
+
+calcular_iva_trimestral y calcular_modelo_130 calculan un trimestre suelto
+y necesitan que se les pase lo de los trimestres anteriores: la
+compensación de IVA pendiente, los ingresos, gastos y retenciones
+acumulados y los pagos del 130 ya hechos. Aquí se parte de las cifras de
+cada trimestre (un CSV/JSON o el almacén de contabilidad.py):
+
+- los acumulados son sumas de prefijos de las cifras trimestrales,
+- los pagos del 130 anteriores son la suma de los resultados ya calculados,
+- la compensación del 303 pasa al trimestre siguiente: lo pendiente sin
+  aplicar más las cuotas negativas.
+
+Cada trimestre se calcula con las mismas funciones, así que el resultado es
+el de encadenar las llamadas a mano. Corregir el 1T es volver a ejecutar.
+"""
+
+import argparse
+import csv
+import json
+import os
+import sys
+from datetime import datetime
+from decimal import Decimal
+from itertools import accumulate
+from typing import Dict, List, NamedTuple, Optional, Sequence
+
+from calcular_irpf import calcular_modelo_130
+from calcular_iva import calcular_iva_trimestral
+import perfilado
+
+class Cifras(NamedTuple):
+    """Cifras de un trimestre (sin IVA; Decimal)."""
+    ingresos: Decimal = Decimal('0')
+    gastos: Decimal = Decimal('0')
+    retenciones: Decimal = Decimal('0')
+    iva_repercutido: Decimal = Decimal('0')
+    iva_soportado: Decimal = Decimal('0')
+
+def sumar_cifras(a: Cifras, b: Cifras) -> Cifras:
+    return Cifras(*(x + y for x, y in zip(a, b)))
+
+def calcular_ejercicio(
+    trimestres: Sequence[Cifras],
+    compensacion_inicial: Decimal = Decimal('0'),
+    aplicar_reduccion_5_gastos: bool = True,
+    sin_fecha: Optional[Cifras] = None
+) -> Dict:
+    """
+    Calcula los modelos 303 y 130 de los trimestres del año, encadenados.
+    
+    Args:
+        trimestres: Cifras del 1T, 2T... (los que haya, en orden)
+        compensacion_inicial: IVA a compensar que viene del año anterior
+        aplicar_reduccion_5_gastos: Reducción del 7% en el 130 (ver calcular_modelo_130)
+        sin_fecha: Cifras sin trimestre (los pagos sin fecha de
+            procesar_stripe/contabilidad). Se declaran en el 4T, en el 303 y
+            en el 130, como en contabilidad.informe y el año completo de
+            procesar_stripe; con menos de 4 trimestres todavía no cuentan.
+    
+    Returns:
+        Diccionario con los modelos de cada trimestre y los saldos finales
+    """
+    if len(trimestres) > 4:
+        raise ValueError(f"Un año tiene 4 trimestres, no {len(trimestres)}")
+    
+    if sin_fecha is not None and len(trimestres) == 4:
+        trimestres = [*trimestres[:3], sumar_cifras(trimestres[3], sin_fecha)]
+    
+    # Acumulados anteriores de cada trimestre: sumas de prefijos (0 para el 1T)
+    anteriores = list(accumulate(trimestres[:-1], sumar_cifras, initial=Cifras()))
+    
+    resultados = []
+    compensacion = compensacion_inicial
+    pagos_anteriores = Decimal('0')
+    for numero, (cifras, previas) in enumerate(zip(trimestres, anteriores), 1):
+        modelo_303 = calcular_iva_trimestral(cifras.iva_repercutido, cifras.iva_soportado, compensacion)
+        modelo_130 = calcular_modelo_130(
+            cifras.ingresos, cifras.gastos, cifras.retenciones,
+            previas.ingresos, previas.gastos, previas.retenciones,
+            pagos_anteriores, aplicar_reduccion_5_gastos
+        )
+        
+        # Lo que pasa al trimestre siguiente
+        cuota = Decimal(modelo_303['cuota_resultado'])
+        compensacion = Decimal(modelo_303['compensacion_pendiente']) + max(-cuota, Decimal('0'))
+        pagos_anteriores += Decimal(modelo_130['resultado_a_ingresar'])
+        
+        resultados.append({
+            'trimestre': numero,
+            'modelo_303': modelo_303,
+            'modelo_130': modelo_130,
+            'compensacion_siguiente': str(compensacion),
+        })
+    
+    return {
+        'trimestres': resultados,
+        'resumen': {
+            'iva_a_ingresar': str(sum((max(Decimal(r['modelo_303']['cuota_resultado']), Decimal('0'))
+                                       for r in resultados), Decimal('0'))),
+            'compensacion_final': str(compensacion),
+            'pagos_130': str(pagos_anteriores),
+        },
+        'fecha_calculo': datetime.now().isoformat()
+    }
+
+def leer_cifras(archivo: str) -> List[Cifras]:
+    """
+    Cifras trimestrales de un CSV (cabecera: trimestre,ingresos,gastos,
+    retenciones,iva_repercutido,iva_soportado) o de un JSON (lista de
+    objetos con esas claves). Las columnas que falten valen 0; los
+    trimestres tienen que ser consecutivos desde el 1.
+    """
+    with open(archivo, 'r', encoding='utf-8') as f:
+        if os.path.splitext(archivo)[1].lower() == '.json':
+            filas = json.load(f)
+        else:
+            filas = list(csv.DictReader(f))
+    
+    por_trimestre = {}
+    for fila in filas:
+        trimestre = int(fila['trimestre'])
+        por_trimestre[trimestre] = Cifras(*(
+            Decimal(str(fila.get(campo) or '0').replace(',', '.')) for campo in Cifras._fields
+        ))
+    if sorted(por_trimestre) != list(range(1, len(por_trimestre) + 1)):
+        raise ValueError(f"Los trimestres deben ser consecutivos desde el 1 (hay {sorted(por_trimestre)})")
+    return [por_trimestre[t] for t in sorted(por_trimestre)]
+
+def imprimir_ejercicio(resultado: Dict, año: Optional[int]):
+    """Tabla de los trimestres en terminal."""
+    print("\n" + "="*82)
+    print(f"   MODELOS 303 Y 130 ENCADENADOS{f' - {año}' if año else ''}")
+    print("="*82)
+    print(f"\n   {'':<4}{'IVA deveng.':>13}{'IVA soport.':>13}{'303':>13}{'Compensar':>12}"
+          f"{'Rdto. acum.':>15}{'130':>12}")
+    print(f"   {'-'*78}")
+    for r in resultado['trimestres']:
+        m303 = r['modelo_303']
+        m130 = r['modelo_130']
+        print(f"   {str(r['trimestre']) + 'T':<4}{float(m303['iva_repercutido']):>13,.2f}"
+              f"{float(m303['iva_soportado']):>13,.2f}{float(m303['cuota_resultado']):>13,.2f}"
+              f"{float(r['compensacion_siguiente']):>12,.2f}{float(m130['calculo']['rendimiento_neto']):>15,.2f}"
+              f"{float(m130['resultado_a_ingresar']):>12,.2f}")
+    print(f"   {'-'*78}")
+    resumen = resultado['resumen']
+    print(f"   IVA a ingresar en el año:   {float(resumen['iva_a_ingresar']):>12,.2f} €")
+    print(f"   IVA pendiente de compensar: {float(resumen['compensacion_final']):>12,.2f} €")
+    print(f"   Pagos fraccionados (130):   {float(resumen['pagos_130']):>12,.2f} €")
+    print("="*82 + "\n")
+
+def instrumentar(perfil: perfilado.Perfil):
+    """Cronometra el cálculo (solo con --profile)."""
+    global calcular_ejercicio
+    calcular_ejercicio = perfil.cronometrar('calcular_ejercicio', calcular_ejercicio)
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Modelos 303 y 130 de todo el año en una pasada (acumulados y compensaciones automáticos)',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Ejemplos de uso:
+  # Cifras de cada trimestre en un CSV (o JSON):
+  #   trimestre,ingresos,gastos,retenciones,iva_repercutido,iva_soportado
+  #   1,12000,3000,1800,2520,630
+  #   2,9000,4000,1350,1890,840
+  python3 calcular_ejercicio.py --cifras trimestres.csv
+  
+  # Desde el almacén de contabilidad.py:
+  python3 calcular_ejercicio.py --db conta.sqlite --año 2025
+        """
+    )
+    origen = parser.add_mutually_exclusive_group(required=True)
+    origen.add_argument('--cifras', type=str, help='CSV o JSON con las cifras de cada trimestre')
+    origen.add_argument('--db', type=str, help='Almacén SQLite de contabilidad.py')
+    parser.add_argument('--año', type=int, help='Año (necesario con --db)')
+    parser.add_argument('--hasta-trimestre', type=int, choices=[1, 2, 3, 4], default=4,
+                        help='Con --db: calcular hasta este trimestre (default: 4)')
+    parser.add_argument('--compensacion', type=str, default='0', help='IVA a compensar del año anterior')
+    parser.add_argument('--sin-reduccion-gastos', action='store_true',
+                        help='No aplicar reducción 7%% gastos difícil justificación')
+    parser.add_argument('--json', action='store_true', help='Salida en formato JSON')
+    perfilado.añadir_argumento(parser)
+    
+    args = parser.parse_args()
+    
+    if args.db and args.año is None:
+        parser.error("--db necesita --año")
+    
+    perfil = perfilado.crear(args.profile)
+    if perfil is not None:
+        instrumentar(perfil)
+    
+    try:
+        sin_fecha = None
+        if args.db:
+            from contabilidad import abrir, cifras_ejercicio
+            with perfilado.etapa(perfil, 'consultas'):
+                trimestres, sin_fecha = cifras_ejercicio(abrir(args.db), args.año)
+            trimestres = trimestres[:args.hasta_trimestre]
+        else:
+            trimestres = leer_cifras(args.cifras)
+        
+        resultado = calcular_ejercicio(
+            trimestres,
+            compensacion_inicial=Decimal(args.compensacion),
+            aplicar_reduccion_5_gastos=not args.sin_reduccion_gastos,
+            sin_fecha=sin_fecha
+        )
+        resultado['año'] = args.año
+        
+        if args.json:
+            with perfilado.etapa(perfil, 'salida_json'):
+                print(json.dumps(resultado, indent=2, ensure_ascii=False))
+        else:
+            imprimir_ejercicio(resultado, args.año)
+    
+    except Exception as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
+    
+    finally:
+        if perfil is not None:
+            perfil.emitir(args.profile)
+
+if __name__ == "__main__":
+    main()
@@ -6,20 +6,20 @@ Usa Decimal para precisión monetaria exacta.
 """
 
 import argparse
-from decimal import Decimal, ROUND_HALF_UP
+from decimal import Decimal
 import json
 import sys
 from datetime import datetime
 
+from dinero import redondear as redondear_centimos, a_centimos, a_decimal, porcentaje_de
+import lotes
+import perfilado
+
 # Constantes fiscales 2024-2025
 PORCENTAJE_PAGO_FRACCIONADO = Decimal('20')  # 20% del rendimiento neto
 REDUCCION_GASTOS_DIFICIL_JUSTIFICACION = Decimal('7')  # 7% para estimación directa simplificada (máx 2000€)
 MAXIMO_REDUCCION_GASTOS = Decimal('2000')
 
-def redondear_centimos(valor: Decimal) -> Decimal:
-    """Redondea a 2 decimales según norma fiscal española."""
-    return valor.quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
-
 def calcular_modelo_130(
     ingresos_trimestre: Decimal,
     gastos_trimestre: Decimal,
@@ -60,9 +60,8 @@ def calcular_modelo_130(
     # Aplicar reducción por gastos de difícil justificación (7% de rendimiento neto, máx 2000€)
     reduccion_gastos = Decimal('0')
     if aplicar_reduccion_5_gastos and rendimiento_neto_previo > 0:
-        reduccion_gastos = rendimiento_neto_previo * REDUCCION_GASTOS_DIFICIL_JUSTIFICACION / Decimal('100')
-        reduccion_gastos = min(reduccion_gastos, MAXIMO_REDUCCION_GASTOS)
-        reduccion_gastos = redondear_centimos(reduccion_gastos)
+        reduccion_gastos = porcentaje_de(rendimiento_neto_previo, REDUCCION_GASTOS_DIFICIL_JUSTIFICACION)
+        reduccion_gastos = a_decimal(min(reduccion_gastos, a_centimos(MAXIMO_REDUCCION_GASTOS)))
     
     # Rendimiento neto
     rendimiento_neto = rendimiento_neto_previo - reduccion_gastos
@@ -71,8 +70,7 @@ def calcular_modelo_130(
     # Calcular 20% del rendimiento neto acumulado
     pago_20_por_ciento = Decimal('0')
     if rendimiento_neto > 0:
-        pago_20_por_ciento = rendimiento_neto * PORCENTAJE_PAGO_FRACCIONADO / Decimal('100')
-        pago_20_por_ciento = redondear_centimos(pago_20_por_ciento)
+        pago_20_por_ciento = a_decimal(porcentaje_de(rendimiento_neto, PORCENTAJE_PAGO_FRACCIONADO))
     
     # Deducir retenciones acumuladas
     resultado_tras_retenciones = pago_20_por_ciento - retenciones_acumuladas
@@ -116,6 +114,32 @@ def calcular_modelo_130(
         "fecha_calculo": datetime.now().isoformat()
     }
 
+def calcular_fila(fila: dict) -> dict:
+    """
+    Una fila del modo lote, como una llamada al CLI: ingresos y gastos,
+    y opcionalmente retenciones, ingresos_anteriores, gastos_anteriores,
+    retenciones_anteriores, pagos_anteriores y sin_reduccion_gastos (1/true/sí).
+    """
+    if not lotes.tiene_columnas(fila, 'ingresos', 'gastos'):
+        raise ValueError("Faltan ingresos y gastos")
+    sin_reduccion = str(fila.get('sin_reduccion_gastos') or '').strip().lower() in ('1', 'true', 'si', 'sí', 'x')
+    return calcular_modelo_130(
+        ingresos_trimestre=lotes.decimal_columna(fila, 'ingresos'),
+        gastos_trimestre=lotes.decimal_columna(fila, 'gastos'),
+        retenciones_trimestre=lotes.decimal_columna(fila, 'retenciones'),
+        ingresos_acumulados_anteriores=lotes.decimal_columna(fila, 'ingresos_anteriores'),
+        gastos_acumulados_anteriores=lotes.decimal_columna(fila, 'gastos_anteriores'),
+        retenciones_acumuladas_anteriores=lotes.decimal_columna(fila, 'retenciones_anteriores'),
+        pagos_fraccionados_anteriores=lotes.decimal_columna(fila, 'pagos_anteriores'),
+        aplicar_reduccion_5_gastos=not sin_reduccion
+    )
+
+def instrumentar(perfil: perfilado.Perfil):
+    """Cronometra el cálculo (solo con --profile)."""
+    global calcular_modelo_130, calcular_fila
+    calcular_modelo_130 = perfil.cronometrar('calcular_modelo_130', calcular_modelo_130, por_fila=True)
+    calcular_fila = perfil.cronometrar('calcular_fila', calcular_fila, por_fila=True)
+
 def main():
     parser = argparse.ArgumentParser(
         description='Calculador de Pago Fraccionado IRPF (Modelo 130)',
@@ -132,12 +156,15 @@ Ejemplos de uso:
   
   # Sin reducción por gastos de difícil justificación:
   python3 calcular_irpf.py --ingresos 5000 --gastos 1500 --sin-reduccion-gastos
+  
+  # Todos los clientes de una vez (CSV o NDJSON, un cliente por fila; salida NDJSON):
+  python3 calcular_irpf.py --lote clientes.csv > resultados.ndjson
         """
     )
     
     # Datos del trimestre actual
-    parser.add_argument('--ingresos', type=str, required=True, help='Ingresos del trimestre (sin IVA)')
-    parser.add_argument('--gastos', type=str, required=True, help='Gastos deducibles del trimestre (sin IVA)')
+    parser.add_argument('--ingresos', type=str, help='Ingresos del trimestre (sin IVA)')
+    parser.add_argument('--gastos', type=str, help='Gastos deducibles del trimestre (sin IVA)')
     parser.add_argument('--retenciones', type=str, default='0', help='Retenciones practicadas en el trimestre')
     
     # Acumulados de trimestres anteriores del año
@@ -149,10 +176,29 @@ Ejemplos de uso:
     # Opciones
     parser.add_argument('--sin-reduccion-gastos', action='store_true', help='No aplicar reducción 7%% gastos difícil justificación')
     parser.add_argument('--json', action='store_true', help='Salida en formato JSON')
+    lotes.añadir_argumentos(parser, 'cliente, ingresos, gastos, retenciones, ingresos_anteriores, '
+                                    'gastos_anteriores, retenciones_anteriores, pagos_anteriores, sin_reduccion_gastos')
+    perfilado.añadir_argumento(parser)
     
     args = parser.parse_args()
     
+    if not args.lote and (args.ingresos is None or args.gastos is None):
+        parser.error("Debe proporcionar --ingresos y --gastos (o --lote)")
+    
+    # Con --profile todo se ejecuta en este proceso, para poder medirlo
+    perfil = perfilado.crear(args.profile)
+    procesos = args.procesos
+    if perfil is not None:
+        instrumentar(perfil)
+        procesos = 1
+    
     try:
+        if args.lote:
+            with perfilado.etapa(perfil, 'lote'):
+                resumen = lotes.ejecutar_lote(args.lote, calcular_fila, procesos)
+            print(f"📋 {resumen['filas']} filas, {resumen['errores']} con error", file=sys.stderr)
+            return
+        
         resultado = calcular_modelo_130(
             ingresos_trimestre=Decimal(args.ingresos),
             gastos_trimestre=Decimal(args.gastos),
@@ -165,7 +211,8 @@ Ejemplos de uso:
         )
         
         if args.json:
-            print(json.dumps(resultado, indent=2, ensure_ascii=False))
+            with perfilado.etapa(perfil, 'salida_json'):
+                print(json.dumps(resultado, indent=2, ensure_ascii=False))
         else:
             print("\n" + "="*55)
             print("   PAGO FRACCIONADO IRPF (MODELO 130)")
@@ -199,10 +246,14 @@ Ejemplos de uso:
             else:
                 print(f"   ✅ SIN CUOTA:       {cuota:>12,.2f} €")
             print("="*55 + "\n")
-            
+    
     except Exception as e:
         print(f"Error: {e}", file=sys.stderr)
         sys.exit(1)
+    
+    finally:
+        if perfil is not None:
+            perfil.emitir(args.profile)
 
 if __name__ == "__main__":
     main()
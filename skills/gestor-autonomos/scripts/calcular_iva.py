@@ -5,14 +5,14 @@ Usa Decimal para precisión monetaria exacta.
 """
 
 import argparse
-from decimal import Decimal, ROUND_HALF_UP
+from decimal import Decimal
 import json
 import sys
 from datetime import datetime
 
-def redondear_centimos(valor: Decimal) -> Decimal:
-    """Redondea a 2 decimales (céntimos) según norma fiscal española."""
-    return valor.quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+from dinero import redondear as redondear_centimos, a_decimal, porcentaje_de
+import lotes
+import perfilado
 
 def calcular_iva_trimestral(
     iva_repercutido: Decimal,
@@ -73,8 +73,8 @@ def calcular_desde_bases(
     """
     Calcula IVA a partir de bases imponibles y tipos de IVA.
     """
-    iva_repercutido = redondear_centimos(base_imponible_emitidas * tipo_iva_emitidas / Decimal('100'))
-    iva_soportado = redondear_centimos(base_imponible_recibidas * tipo_iva_recibidas / Decimal('100'))
+    iva_repercutido = a_decimal(porcentaje_de(base_imponible_emitidas, tipo_iva_emitidas))
+    iva_soportado = a_decimal(porcentaje_de(base_imponible_recibidas, tipo_iva_recibidas))
     
     resultado = calcular_iva_trimestral(iva_repercutido, iva_soportado)
     resultado["base_imponible_emitidas"] = str(base_imponible_emitidas)
@@ -84,6 +84,37 @@ def calcular_desde_bases(
     
     return resultado
 
+def calcular_fila(fila: dict) -> dict:
+    """
+    Una fila del modo lote, como una llamada al CLI: iva_repercutido e
+    iva_soportado (más compensacion) o base_emitidas y base_recibidas (más
+    tipo_emitidas y tipo_recibidas, 21 por defecto).
+    """
+    compensacion = lotes.decimal_columna(fila, 'compensacion')
+    if lotes.tiene_columnas(fila, 'iva_repercutido', 'iva_soportado'):
+        return calcular_iva_trimestral(
+            lotes.decimal_columna(fila, 'iva_repercutido'),
+            lotes.decimal_columna(fila, 'iva_soportado'),
+            compensacion
+        )
+    if lotes.tiene_columnas(fila, 'base_emitidas', 'base_recibidas'):
+        resultado = calcular_desde_bases(
+            lotes.decimal_columna(fila, 'base_emitidas'),
+            lotes.decimal_columna(fila, 'tipo_emitidas', '21'),
+            lotes.decimal_columna(fila, 'base_recibidas'),
+            lotes.decimal_columna(fila, 'tipo_recibidas', '21')
+        )
+        resultado["compensacion_anterior"] = str(compensacion)
+        return resultado
+    raise ValueError("Faltan iva_repercutido e iva_soportado, o base_emitidas y base_recibidas")
+
+def instrumentar(perfil: perfilado.Perfil):
+    """Cronometra el cálculo (solo con --profile)."""
+    global calcular_iva_trimestral, calcular_desde_bases, calcular_fila
+    calcular_iva_trimestral = perfil.cronometrar('calcular_iva_trimestral', calcular_iva_trimestral, por_fila=True)
+    calcular_desde_bases = perfil.cronometrar('calcular_desde_bases', calcular_desde_bases, por_fila=True)
+    calcular_fila = perfil.cronometrar('calcular_fila', calcular_fila, por_fila=True)
+
 def main():
     parser = argparse.ArgumentParser(
         description='Calculador de IVA Trimestral (Modelo 303)',
@@ -98,6 +129,9 @@ Ejemplos de uso:
   
   # Con compensación de trimestres anteriores:
   python3 calcular_iva.py --iva-repercutido 500 --iva-soportado 200 --compensacion 150
+  
+  # Todos los clientes de una vez (CSV o NDJSON, un cliente por fila; salida NDJSON):
+  python3 calcular_iva.py --lote clientes.csv > resultados.ndjson
         """
     )
     
@@ -116,10 +150,26 @@ Ejemplos de uso:
     
     # Formato de salida
     parser.add_argument('--json', action='store_true', help='Salida en formato JSON')
+    lotes.añadir_argumentos(parser, 'cliente, iva_repercutido, iva_soportado, compensacion '
+                                    '(o base_emitidas, tipo_emitidas, base_recibidas, tipo_recibidas)')
+    perfilado.añadir_argumento(parser)
     
     args = parser.parse_args()
     
+    # Con --profile todo se ejecuta en este proceso, para poder medirlo
+    perfil = perfilado.crear(args.profile)
+    procesos = args.procesos
+    if perfil is not None:
+        instrumentar(perfil)
+        procesos = 1
+    
     try:
+        if args.lote:
+            with perfilado.etapa(perfil, 'lote'):
+                resumen = lotes.ejecutar_lote(args.lote, calcular_fila, procesos)
+            print(f"📋 {resumen['filas']} filas, {resumen['errores']} con error", file=sys.stderr)
+            return
+        
         compensacion = Decimal(args.compensacion)
         
         # Determinar modo de cálculo
@@ -141,7 +191,8 @@ Ejemplos de uso:
             parser.error("Debe proporcionar --iva-repercutido y --iva-soportado, o --base-emitidas y --base-recibidas")
         
         if args.json:
-            print(json.dumps(resultado, indent=2, ensure_ascii=False))
+            with perfilado.etapa(perfil, 'salida_json'):
+                print(json.dumps(resultado, indent=2, ensure_ascii=False))
         else:
             print("\n" + "="*50)
             print("   CÁLCULO IVA TRIMESTRAL (MODELO 303)")
@@ -171,10 +222,14 @@ Ejemplos de uso:
             else:
                 print(f"   💚 RESULTADO:       {cuota:>12,.2f} € ({resultado['resultado_tipo']})")
             print("="*50 + "\n")
-            
+    
     except Exception as e:
         print(f"Error: {e}", file=sys.stderr)
         sys.exit(1)
+    
+    finally:
+        if perfil is not None:
+            perfil.emitir(args.profile)
 
 if __name__ == "__main__":
     main()
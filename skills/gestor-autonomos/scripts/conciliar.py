@@ -0,0 +1,464 @@
+#!/usr/bin/env python3
+"""
+Conciliación de pagos de Stripe/Substack con facturas emitidas.
+
+Cada pago se empareja con la factura del mismo importe (total con IVA y
+retención, en EUR; con --tolerancia, aproximado) emitida dentro de una
+ventana de días alrededor de la fecha del cobro. Si el pago trae pista
+(email del cliente o NIF) y alguna candidata coincide, solo cuentan esas.
+
+Las facturas se indexan una vez por total (lista ordenada de totales y,
+para cada total, sus fechas ordenadas) y por total + pista, así que buscar
+las candidatas de un pago son unas bisecciones: O((n + m) log m) en lugar
+de comparar todos con todos. Después, en pasadas sucesivas, cada factura
+que es la única candidata libre de un solo pago queda conciliada con él.
+El informe separa:
+
+- conciliados: pago ↔ factura, con la pista que lo confirma si la hay,
+- ambiguos: pagos con varias candidatas (o una que reclaman varios pagos),
+- pagos sin factura y facturas sin pago.
+"""
+
+import argparse
+import csv
+import json
+import sys
+from bisect import bisect_left, bisect_right
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from itertools import groupby
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+from dinero import a_centimos, a_texto
+from fechas import crear_lector_fechas
+import perfilado
+from procesar_facturas import calcular_importes, normalizar_nif
+from procesar_stripe import (
+    COLUMNAS_ID, compilar_esquema, expandir_archivos, iterar_json, iterar_ndjson, leer_filas_csv, procesar_pago
+)
+from registros import codigo, tipo_decimal
+
+# Columnas de la exportación con el NIF del cliente (el id del cobro: COLUMNAS_ID)
+COLUMNAS_NIF = ('nif', 'NIF', 'tax_id', 'Tax ID', 'Customer Tax ID', 'customer_tax_id')
+# Candidatas que se guardan por pago; con más, el pago es ambiguo sin listarlas todas
+MAX_CANDIDATAS = 10
+
+class PagoCobrado(NamedTuple):
+    """Pago de una exportación (importes en céntimos; fecha None = sin fecha)."""
+    fila: int
+    id: str
+    fecha: Optional[date]
+    email: str
+    nif: str
+    importe: int
+    moneda: str
+    importe_eur: int
+    
+    def a_dict(self) -> Dict:
+        return {
+            'fila': self.fila,
+            'id': self.id,
+            'fecha': str(self.fecha) if self.fecha else None,
+            'email': self.email,
+            'nif': self.nif,
+            'importe': f"{a_texto(self.importe)} {self.moneda}",
+            'importe_eur': a_texto(self.importe_eur),
+        }
+
+class FacturaEmitida(NamedTuple):
+    """Factura de un CSV de emitidas con su total (base + IVA - retención, céntimos)."""
+    linea: int
+    numero: str
+    fecha: date
+    nif: str
+    email: str
+    total: int
+    
+    def a_dict(self) -> Dict:
+        return {'linea': self.linea, 'numero': self.numero, 'fecha': str(self.fecha),
+                'nif': self.nif, 'total': a_texto(self.total)}
+
+def _posicion(cabecera: List[str], candidatas: Tuple[str, ...]) -> Optional[int]:
+    posiciones = {nombre: i for i, nombre in enumerate(cabecera)}
+    return next((posiciones[c] for c in candidatas if c in posiciones), None)
+
+def leer_pagos(archivo: str, formato: str = 'csv', almacen=None, errores: Optional[List] = None) -> Iterator[PagoCobrado]:
+    """
+    Pagos de una exportación, con las mismas reglas que procesar_stripe
+    (importe, moneda, fecha, conversión a EUR). Los reembolsos e importes
+    nulos no se concilian; las filas que no se pueden leer van a `errores`.
+    """
+    if formato == 'csv':
+        filas = leer_filas_csv(archivo)
+        grupos = [(next(filas, []), filas)]
+        primera = 2
+    else:
+        lector = iterar_ndjson if formato == 'ndjson' else iterar_json
+        grupos = ((list(claves), (list(pago.values()) for pago in grupo))
+                  for claves, grupo in groupby(lector(archivo), key=tuple))
+        primera = 1
+    
+    numero = primera - 1
+    for cabecera, filas in grupos:
+        esquema = compilar_esquema(cabecera)
+        ancho = esquema.ancho
+        cola = list(esquema.cola)
+        i_id = _posicion(cabecera, COLUMNAS_ID)
+        i_nif = _posicion(cabecera, COLUMNAS_NIF)
+        for fila in filas:
+            numero += 1
+            if not fila:
+                continue
+            if len(fila) != ancho:
+                fila = (fila + [''] * ancho)[:ancho]
+            fila = [valor if isinstance(valor, str) else '' if valor is None else str(valor) for valor in fila] + cola
+            try:
+                pago = procesar_pago(fila, esquema, date.min, date.max, almacen)
+            except Exception as e:
+                if errores is not None:
+                    errores.append({'archivo': archivo, 'fila': numero, 'error': str(e)})
+                continue
+            if pago is None:
+                continue
+            fecha, email, importe, moneda, _, importe_eur = pago[:6]
+            yield PagoCobrado(
+                numero,
+                fila[i_id] if i_id is not None else '',
+                fecha,
+                email.strip().lower(),
+                normalizar_nif(fila[i_nif]) if i_nif is not None else '',
+                importe, moneda, importe_eur
+            )
+
+def leer_facturas(archivo: str, errores: Optional[List] = None) -> Iterator[FacturaEmitida]:
+    """
+    Facturas emitidas de un CSV (numero,fecha,nif,concepto,base_imponible,
+    tipo_iva,tipo_retencion y, si la hay, email). Las que no tienen fecha o
+    importes válidos van a `errores`: sin fecha no hay ventana que comparar.
+    """
+    leer_fecha = crear_lector_fechas()
+    with open(archivo, 'r', encoding='utf-8', newline='') as f:
+        for linea, fila in enumerate(csv.DictReader(f), start=2):
+            try:
+                fecha = leer_fecha((fila.get('fecha') or '').strip())
+                if fecha is None:
+                    raise ValueError(f"fecha no válida: '{fila.get('fecha')}'")
+                _, _, total = calcular_importes(
+                    Decimal((fila.get('base_imponible') or '0').replace(',', '.')),
+                    tipo_decimal(fila.get('tipo_iva') or '21'),
+                    tipo_decimal(fila.get('tipo_retencion') or '0')
+                )
+            except Exception as e:
+                if errores is not None:
+                    errores.append({'archivo': archivo, 'linea': linea, 'error': str(e)})
+                continue
+            yield FacturaEmitida(linea, fila.get('numero', ''), fecha, codigo(normalizar_nif(fila.get('nif') or '')),
+                                 (fila.get('email') or '').strip().lower(), total)
+
+class IndiceFacturas:
+    """
+    Facturas agrupadas por clave (el total, o el total y una pista) con sus
+    fechas ordenadas, y los totales distintos ordenados para buscar por
+    rango con --tolerancia.
+    """
+    
+    def __init__(self, facturas: List[FacturaEmitida]):
+        self.facturas = facturas
+        grupos: Dict[tuple, List[int]] = {}
+        for i, factura in enumerate(facturas):
+            grupos.setdefault((factura.total,), []).append(i)
+            if factura.email:
+                grupos.setdefault((factura.total, 'email', factura.email), []).append(i)
+            if factura.nif:
+                grupos.setdefault((factura.total, 'nif', factura.nif), []).append(i)
+        self.grupos = {}
+        for clave, indices in grupos.items():
+            indices.sort(key=lambda i: facturas[i].fecha)
+            self.grupos[clave] = ([facturas[i].fecha for i in indices], indices)
+        self.totales = sorted(clave[0] for clave in self.grupos if len(clave) == 1)
+    
+    def _ventana(self, clave: tuple, desde: date, hasta: date) -> Tuple[List[int], int, int]:
+        fechas, indices = self.grupos.get(clave, ((), ()))
+        inicio = bisect_left(fechas, desde) if desde else 0
+        fin = bisect_right(fechas, hasta) if hasta else len(fechas)
+        return indices, inicio, fin
+    
+    def candidatas(self, pago: PagoCobrado, dias: int, tolerancia: int) -> Tuple[List[int], int, Optional[str]]:
+        """
+        Facturas candidatas de un pago. Returns: (índices, hasta
+        MAX_CANDIDATAS + 1; cuántas hay en total; 'email'/'nif' si son las
+        que coinciden con la pista del pago, o None).
+        """
+        desde = hasta = None
+        if pago.fecha is not None:
+            desde, hasta = pago.fecha - timedelta(days=dias), pago.fecha + timedelta(days=dias)
+        totales = self.totales[bisect_left(self.totales, pago.importe_eur - tolerancia):
+                               bisect_right(self.totales, pago.importe_eur + tolerancia)]
+        
+        for pista, valor in (('email', pago.email), ('nif', pago.nif)):
+            if not valor:
+                continue
+            encontradas = []
+            for total in totales:
+                indices, inicio, fin = self._ventana((total, pista, valor), desde, hasta)
+                encontradas += indices[inicio:fin]
+            if encontradas:
+                return encontradas[:MAX_CANDIDATAS + 1], len(encontradas), pista
+        
+        encontradas = []
+        cuantas = 0
+        for total in totales:
+            indices, inicio, fin = self._ventana((total,), desde, hasta)
+            cuantas += fin - inicio
+            if len(encontradas) <= MAX_CANDIDATAS:
+                encontradas += indices[inicio:min(fin, inicio + MAX_CANDIDATAS + 1 - len(encontradas))]
+        return encontradas, cuantas, None
+
+def conciliar(
+    pagos: Iterable[PagoCobrado],
+    facturas: Iterable[FacturaEmitida],
+    dias: int = 7,
+    tolerancia: int = 0
+) -> Dict:
+    """
+    Concilia pagos con facturas emitidas.
+    
+    Args:
+        pagos: PagoCobrado (ver leer_pagos)
+        facturas: FacturaEmitida (ver leer_facturas)
+        dias: Ventana de días alrededor de la fecha del pago
+        tolerancia: Diferencia admitida entre importe y total, en céntimos
+    
+    Returns:
+        Informe con los conciliados, ambiguos, pagos sin factura y facturas
+        sin pago (cada pago y factura, como dict)
+    """
+    pagos = list(pagos)
+    indice = IndiceFacturas(list(facturas))
+    facturas = indice.facturas
+    
+    # Candidatas de cada pago; una lista completa solo si no pasa de MAX_CANDIDATAS
+    candidatas: List[List[int]] = []
+    totales: List[int] = []
+    pistas: List[Optional[str]] = []
+    for pago in pagos:
+        encontradas, cuantas, pista = indice.candidatas(pago, dias, tolerancia)
+        candidatas.append(encontradas)
+        totales.append(cuantas)
+        pistas.append(pista)
+    
+    # Pasadas: una factura que es la única candidata libre de un solo pago se le
+    # asigna. Solo se revisan de nuevo los pagos que tenían entre sus
+    # candidatas alguna factura recién asignada (pagos_de), no todos.
+    pagos_de: Dict[int, List[int]] = {}
+    revisar = [p for p in range(len(pagos)) if 0 < totales[p] <= MAX_CANDIDATAS]
+    for p in revisar:
+        for f in candidatas[p]:
+            pagos_de.setdefault(f, []).append(p)
+    asignada: Dict[int, int] = {}
+    factura_de: Dict[int, int] = {}
+    reclamantes: Dict[int, List[int]] = {}
+    while revisar:
+        reclamadas = {}
+        for p in revisar:
+            libres = candidatas[p] = [f for f in candidatas[p] if f not in asignada]
+            if len(libres) == 1:
+                reclamantes.setdefault(libres[0], []).append(p)
+                reclamadas[libres[0]] = None
+        siguientes = set()
+        for f in reclamadas:
+            if len(reclamantes[f]) == 1:
+                p = reclamantes[f][0]
+                asignada[f] = p
+                factura_de[p] = f
+                siguientes.update(pagos_de[f])
+        revisar = sorted(q for q in siguientes if q not in factura_de)
+    
+    conciliados, ambiguos, sin_factura = [], [], []
+    en_ambiguos = set()
+    for p, pago in enumerate(pagos):
+        if p in factura_de:
+            factura = facturas[factura_de[p]]
+            conciliados.append({
+                'pago': pago.a_dict(),
+                'factura': factura.a_dict(),
+                'pista': pistas[p],
+                'dias': (pago.fecha - factura.fecha).days if pago.fecha else None,
+            })
+        elif totales[p] == 0:
+            sin_factura.append({'pago': pago.a_dict(), 'motivo': 'sin facturas de ese importe en la ventana'})
+        elif not candidatas[p]:
+            sin_factura.append({'pago': pago.a_dict(), 'motivo': 'sus candidatas ya están conciliadas con otros pagos'})
+        else:
+            listadas = candidatas[p][:MAX_CANDIDATAS]
+            en_ambiguos.update(listadas)
+            ambiguos.append({
+                'pago': pago.a_dict(),
+                'motivo': 'varias facturas posibles' if len(candidatas[p]) > 1 else
+                          'otros pagos optan a la misma factura',
+                'num_candidatas': totales[p] if totales[p] > MAX_CANDIDATAS else len(candidatas[p]),
+                'candidatas': [facturas[f].a_dict() for f in listadas],
+                'pista': pistas[p],
+            })
+    sin_pago = [facturas[f].a_dict() for f in range(len(facturas)) if f not in asignada and f not in en_ambiguos]
+    
+    return {
+        'parametros': {'dias': dias, 'tolerancia': a_texto(tolerancia)},
+        'resumen': {
+            'pagos': len(pagos),
+            'facturas': len(facturas),
+            'conciliados': len(conciliados),
+            'conciliados_con_pista': sum(1 for c in conciliados if c['pista']),
+            'ambiguos': len(ambiguos),
+            'pagos_sin_factura': len(sin_factura),
+            'facturas_sin_pago': len(sin_pago),
+        },
+        'conciliados': conciliados,
+        'ambiguos': ambiguos,
+        'pagos_sin_factura': sin_factura,
+        'facturas_sin_pago': sin_pago,
+        'fecha_calculo': datetime.now().isoformat(),
+    }
+
+COLUMNAS_EXPORTACION = (
+    'estado', 'pago_fila', 'pago_id', 'pago_fecha', 'pago_email', 'pago_importe_eur',
+    'factura_numero', 'factura_fecha', 'factura_nif', 'factura_total', 'pista', 'detalle',
+)
+
+def filas_exportacion(informe: Dict) -> Iterator[list]:
+    """Una fila por pago (y por factura sin pago) para la hoja de cálculo."""
+    def fila(estado, pago=None, factura=None, pista=None, detalle=''):
+        pago = pago or {}
+        factura = factura or {}
+        return [estado, pago.get('fila', ''), pago.get('id', ''), pago.get('fecha') or '', pago.get('email', ''),
+                pago.get('importe_eur', ''), factura.get('numero', ''), factura.get('fecha', ''),
+                factura.get('nif', ''), factura.get('total', ''), pista or '', detalle]
+    
+    for c in informe['conciliados']:
+        yield fila('conciliado', c['pago'], c['factura'], c['pista'])
+    for a in informe['ambiguos']:
+        numeros = ' '.join(f['numero'] for f in a['candidatas'])
+        yield fila('ambiguo', a['pago'], pista=a['pista'], detalle=f"{a['motivo']} ({a['num_candidatas']}): {numeros}")
+    for s in informe['pagos_sin_factura']:
+        yield fila('pago_sin_factura', s['pago'], detalle=s['motivo'])
+    for factura in informe['facturas_sin_pago']:
+        yield fila('factura_sin_pago', factura=factura)
+
+def imprimir_informe(informe: Dict, errores: List[Dict]):
+    r = informe['resumen']
+    print("\n" + "="*70)
+    print(f"   CONCILIACIÓN STRIPE/SUBSTACK ↔ FACTURAS EMITIDAS")
+    print(f"   (±{informe['parametros']['dias']} días, tolerancia {informe['parametros']['tolerancia']} €)")
+    print("="*70)
+    print(f"\n   Pagos:                 {r['pagos']:>8}")
+    print(f"   Facturas:              {r['facturas']:>8}")
+    print(f"\n   ✅ Conciliados:         {r['conciliados']:>8}  ({r['conciliados_con_pista']} con email/NIF)")
+    print(f"   ⚠️  Ambiguos:            {r['ambiguos']:>8}")
+    print(f"   ❌ Pagos sin factura:   {r['pagos_sin_factura']:>8}")
+    print(f"   ❌ Facturas sin pago:   {r['facturas_sin_pago']:>8}")
+    if errores:
+        print(f"   Filas no leídas:       {len(errores):>8}")
+    
+    if informe['ambiguos'] or informe['pagos_sin_factura'] or informe['facturas_sin_pago']:
+        print()
+    for a in informe['ambiguos'][:5]:
+        p = a['pago']
+        print(f"   ⚠️  Pago fila {p['fila']} ({p['fecha']}, {p['importe_eur']} €): {a['motivo']} "
+              f"({', '.join(f['numero'] for f in a['candidatas'][:5])})")
+    for s in informe['pagos_sin_factura'][:5]:
+        p = s['pago']
+        print(f"   ❌ Pago fila {p['fila']} ({p['fecha']}, {p['importe_eur']} €): {s['motivo']}")
+    for f in informe['facturas_sin_pago'][:5]:
+        print(f"   ❌ Factura {f['numero']} ({f['fecha']}, {f['total']} €) sin pago")
+    print("="*70 + "\n")
+
+def instrumentar(perfil: perfilado.Perfil):
+    """Cronometra la conciliación (solo con --profile; la lectura va por etapas)."""
+    global conciliar
+    conciliar = perfil.cronometrar('conciliar', conciliar)
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Concilia pagos de Stripe/Substack con facturas emitidas (importe, fecha y email/NIF)',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Ejemplos de uso:
+  python3 conciliar.py --pagos stripe_2025.csv --facturas emitidas.csv
+  
+  # Ventana de 3 días, pagos en otras monedas con 1 € de margen, y hoja para revisar:
+  python3 conciliar.py --pagos "pagos/2025-*.csv" --facturas emitidas.csv \\
+    --dias 3 --tolerancia 1 --exportar conciliacion.csv
+
+El importe del pago (convertido a EUR) se compara con el total de la factura
+(base + IVA - retención). Pistas: email del pago con la columna 'email' de
+las facturas (si la tienen) y NIF del pago (columna nif/tax_id) con el NIF.
+        """
+    )
+    parser.add_argument('--pagos', required=True, nargs='+',
+                        help='Exportaciones de Stripe/Substack; admite comodines')
+    parser.add_argument('--formato', choices=['csv', 'json', 'ndjson'], default='csv')
+    parser.add_argument('--facturas', required=True, nargs='+', help='CSV de facturas emitidas')
+    parser.add_argument('--dias', type=int, default=7, help='Días de margen entre factura y cobro (default: 7)')
+    parser.add_argument('--tolerancia', type=str, default='0',
+                        help='Diferencia admitida entre importe y total, en EUR (default: 0)')
+    parser.add_argument('--tipos-cambio', type=str,
+                        help='Tipos del BCE por día (CSV eurofxref-hist o binario de tipos_cambio.py)')
+    parser.add_argument('--offline', action='store_true',
+                        help='No descargar los tipos del BCE si falta el archivo de --tipos-cambio')
+    parser.add_argument('--json', action='store_true', help='Salida JSON (informe completo)')
+    parser.add_argument('--exportar', type=str, help='CSV con una fila por pago y por factura sin pago')
+    perfilado.añadir_argumento(parser)
+    
+    args = parser.parse_args()
+    
+    if args.dias < 0:
+        parser.error("--dias no puede ser negativo")
+    
+    perfil = perfilado.crear(args.profile)
+    if perfil is not None:
+        instrumentar(perfil)
+    
+    try:
+        tolerancia = a_centimos(Decimal(args.tolerancia.replace(',', '.')))
+        almacen = None
+        if args.tipos_cambio:
+            from tipos_cambio import cargar_almacen
+            with perfilado.etapa(perfil, 'cargar_tipos_cambio'):
+                almacen = cargar_almacen(args.tipos_cambio, offline=args.offline)
+        
+        archivos = expandir_archivos(args.pagos)
+        if not archivos:
+            parser.error(f"Ningún archivo coincide con {' '.join(args.pagos)}")
+        errores = []
+        with perfilado.etapa(perfil, 'leer_pagos'):
+            pagos = [pago for archivo in archivos for pago in leer_pagos(archivo, args.formato, almacen, errores)]
+        with perfilado.etapa(perfil, 'leer_facturas'):
+            facturas = [factura for archivo in expandir_archivos(args.facturas)
+                        for factura in leer_facturas(archivo, errores)]
+        
+        informe = conciliar(pagos, facturas, args.dias, tolerancia)
+        informe['errores'] = errores or None
+        
+        if args.exportar:
+            with perfilado.etapa(perfil, 'exportar'), open(args.exportar, 'w', encoding='utf-8', newline='') as f:
+                escritor = csv.writer(f)
+                escritor.writerow(COLUMNAS_EXPORTACION)
+                escritor.writerows(filas_exportacion(informe))
+            print(f"✅ Exportado a {args.exportar}", file=sys.stderr)
+        
+        if args.json:
+            with perfilado.etapa(perfil, 'salida_json'):
+                print(json.dumps(informe, indent=2, ensure_ascii=False))
+        else:
+            imprimir_informe(informe, errores)
+    
+    except Exception as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
+    
+    finally:
+        if perfil is not None:
+            perfil.emitir(args.profile)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,598 @@
+#!/usr/bin/env python3
+"""
+Almacén contable local en SQLite para Autónomos en España.
+
+Las facturas emitidas, las recibidas y los pagos de Stripe/Substack se
+importan una sola vez, con los mismos cálculos que generar_libro.py y
+procesar_stripe.py, y se guardan con los importes en céntimos (enteros),
+salvo la base de las facturas.
+Después, el libro y los modelos 303 y 130 de cualquier trimestre son
+consultas agregadas sobre índices que ya contienen las columnas sumadas:
+milisegundos, sin volver a leer los CSV.
+
+- Un archivo ya importado (mismo contenido) no se vuelve a leer.
+- Las filas repetidas entre exportaciones se descartan: facturas por
+  número (y NIF: los números de las recibidas solo son únicos por
+  proveedor), pagos por id del cargo o, si la exportación no lo trae, por
+  la huella de la fila.
+- Los importes en EUR de los pagos quedan fijados al importarlos (con los
+  tipos del BCE si se pasa --tipos-cambio).
+- La base de cada factura se guarda exacta (texto) y se suma con Decimal:
+  cada total se redondea una sola vez, como en generar_libro.py.
+- Las filas que no se pueden leer se saltan y se informan en `errores`,
+  como en procesar_facturas.py.
+
+Ejemplo:
+    python3 contabilidad.py --db conta.sqlite --emitidas emitidas.csv --recibidas recibidas.csv --pagos pagos.csv
+    python3 contabilidad.py --db conta.sqlite --trimestre 2 --año 2025
+"""
+
+import argparse
+import csv
+import hashlib
+import json
+import sqlite3
+import sys
+from datetime import date, datetime
+from decimal import Decimal
+from itertools import chain, groupby
+from typing import Dict, Iterable, Iterator, Optional, Sequence, Tuple
+
+from cache import huella_archivo
+from dinero import a_centimos, a_decimal, a_texto
+from fechas import crear_lector_fechas, rango_mes, rango_trimestre
+import perfilado
+
+ESQUEMA = """
+CREATE TABLE IF NOT EXISTS facturas (
+    tipo TEXT NOT NULL,             -- 'ingreso' (emitida) o 'gasto' (recibida)
+    numero TEXT NOT NULL,           -- sin número: '#' + huella de la fila y nº de aparición
+    nif TEXT NOT NULL,
+    fecha TEXT,                     -- YYYY-MM-DD; NULL si no se pudo leer
+    concepto TEXT,
+    base TEXT NOT NULL,             -- exacta, sin redondear (ver SumaExacta)
+    tipo_iva TEXT NOT NULL,
+    cuota_iva INTEGER NOT NULL,
+    tipo_retencion TEXT NOT NULL,
+    retencion INTEGER NOT NULL,
+    total INTEGER NOT NULL,
+    PRIMARY KEY (tipo, numero, nif)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS facturas_fecha ON facturas (tipo, fecha, base, cuota_iva, retencion);
+
+CREATE TABLE IF NOT EXISTS pagos (
+    id TEXT PRIMARY KEY,            -- id del cargo o huella de la fila
+    fecha TEXT,                     -- YYYY-MM-DD; NULL si no se pudo leer
+    email TEXT,
+    importe INTEGER NOT NULL,       -- céntimos, en `moneda`
+    moneda TEXT NOT NULL,
+    total_eur INTEGER NOT NULL,     -- céntimos de EUR
+    base INTEGER NOT NULL,
+    iva INTEGER NOT NULL,
+    pais TEXT,                      -- NULL: sin país (se trata como UE)
+    es_ue INTEGER NOT NULL,
+    substack_fee INTEGER NOT NULL,
+    stripe_fee INTEGER NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS pagos_fecha
+    ON pagos (fecha, es_ue, pais, total_eur, base, iva, substack_fee, stripe_fee);
+
+CREATE TABLE IF NOT EXISTS importaciones (
+    huella TEXT PRIMARY KEY,        -- sha256 del contenido + clase de archivo
+    archivo TEXT NOT NULL,
+    clase TEXT NOT NULL,            -- 'emitidas', 'recibidas' o 'pagos'
+    filas INTEGER NOT NULL,
+    nuevas INTEGER NOT NULL,
+    fecha TEXT NOT NULL
+);
+"""
+
+# Versión del esquema (PRAGMA user_version); la 1 guardaba la base en céntimos
+VERSION_ESQUEMA = 2
+
+# Columnas con el id del cargo en las exportaciones de Stripe
+COLUMNAS_ID = ('id', 'ID', 'Charge ID', 'charge_id')
+
+class SumaExacta:
+    """Agregado suma_exacta(base): suma con Decimal de importes en texto (SUM los pasaría a float)."""
+    
+    def __init__(self):
+        self.total = Decimal('0')
+    
+    def step(self, valor: str):
+        self.total += Decimal(valor)
+    
+    def finalize(self) -> str:
+        return str(self.total)
+
+def abrir(ruta: str) -> sqlite3.Connection:
+    """Abre (o crea) el almacén en modo WAL."""
+    con = sqlite3.connect(ruta)
+    version = con.execute('PRAGMA user_version').fetchone()[0]
+    if version != VERSION_ESQUEMA:
+        if version or con.execute("SELECT 1 FROM sqlite_master WHERE name = 'facturas'").fetchone():
+            con.close()
+            raise ValueError(f"{ruta}: almacén de una versión anterior (esquema {version or 1}); "
+                             "cree uno nuevo e importe de nuevo los archivos")
+        con.execute(f'PRAGMA user_version = {VERSION_ESQUEMA}')
+    con.execute('PRAGMA journal_mode=WAL')
+    con.execute('PRAGMA synchronous=NORMAL')
+    con.executescript(ESQUEMA)
+    con.create_aggregate('suma_exacta', 1, SumaExacta)
+    return con
+
+def _importar(
+    con: sqlite3.Connection,
+    archivo: str,
+    clase: str,
+    sql: str,
+    filas: Iterable[tuple],
+    contador: Dict[str, int]
+) -> Dict:
+    """
+    Inserta las filas en una transacción y anota la importación (todo o
+    nada). Las filas con error (contador['errores']) no se insertan.
+    """
+    huella = huella_archivo(archivo, clase)
+    resultado = {'archivo': archivo, 'clase': clase, 'filas': 0, 'nuevas': 0, 'errores': [], 'omitido': False}
+    if con.execute('SELECT 1 FROM importaciones WHERE huella = ?', (huella,)).fetchone():
+        resultado['omitido'] = True
+        return resultado
+    with con:
+        antes = con.total_changes
+        con.executemany(sql, filas)
+        resultado['filas'] = contador['filas']
+        resultado['nuevas'] = con.total_changes - antes
+        resultado['errores'] = contador['errores']
+        con.execute(
+            'INSERT INTO importaciones VALUES (?, ?, ?, ?, ?, ?)',
+            (huella, archivo, clase, resultado['filas'], resultado['nuevas'], datetime.now().isoformat())
+        )
+    return resultado
+
+def importar_facturas(con: sqlite3.Connection, archivo: str, clase: str) -> Dict:
+    """
+    Importa un CSV de facturas ('emitidas' o 'recibidas'), calculado como en
+    generar_libro.procesar_factura.
+    
+    Las facturas sin número se guardan con la huella de la fila más su
+    número de aparición en el archivo (como los pagos sin id en
+    importar_pagos): dos facturas sin número del mismo NIF no se pisan.
+    Returns: {archivo, clase, filas, nuevas, errores, omitido}; errores como
+    en procesar_facturas.procesar_csv ({linea, error, datos})
+    """
+    from generar_libro import procesar_factura
+    tipo = 'ingreso' if clase == 'emitidas' else 'gasto'
+    contador = {'filas': 0, 'errores': []}
+    
+    def filas() -> Iterator[tuple]:
+        leer_fecha = crear_lector_fechas()
+        vistas: Dict[bytes, int] = {}
+        with open(archivo, 'r', encoding='utf-8') as f:
+            for linea, row in enumerate(csv.DictReader(f), start=2):  # 1 es la cabecera
+                contador['filas'] += 1
+                try:
+                    apunte = procesar_factura(row, tipo)
+                except Exception as e:
+                    contador['errores'].append({'linea': linea, 'error': str(e), 'datos': row})
+                    continue
+                fecha = leer_fecha(apunte.fecha)
+                numero = apunte.numero.strip()
+                if not numero:
+                    huella = hashlib.sha1('\x1f'.join(str(v) for v in row.values()).encode()).digest()
+                    vistas[huella] = n = vistas.get(huella, 0) + 1
+                    numero = f'#{huella.hex()}:{n}'
+                yield (
+                    tipo, numero, apunte.nif, fecha.isoformat() if fecha else None,
+                    apunte.concepto, str(apunte.base_imponible), str(apunte.tipo_iva),
+                    apunte.cuota_iva, str(apunte.tipo_retencion), apunte.retencion, apunte.total,
+                )
+    
+    sql = 'INSERT OR IGNORE INTO facturas VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)'
+    return _importar(con, archivo, clase, sql, filas(), contador)
+
+def _tablas(archivo: str, formato: str) -> Iterator[Tuple[Sequence[str], Iterable[list]]]:
+    """(cabecera, filas) de una exportación; en JSON, una por grupo de pagos con las mismas claves."""
+    from procesar_stripe import iterar_json, iterar_ndjson, leer_filas_csv
+    if formato == 'csv':
+        filas = leer_filas_csv(archivo)
+        yield next(filas, []), filas
+        return
+    lector = iterar_ndjson if formato == 'ndjson' else iterar_json
+    for claves, grupo in groupby(lector(archivo), key=tuple):
+        yield claves, (list(pago.values()) for pago in grupo)
+
+def importar_pagos(con: sqlite3.Connection, archivo: str, formato: str = 'csv', almacen=None) -> Dict:
+    """
+    Importa una exportación de Stripe/Substack, clasificada como en
+    procesar_stripe.procesar_pago (reembolsos e importes nulos no cuentan).
+    
+    Sin columna de id, la clave es una huella de la fila más su número de
+    aparición en el archivo: dos pagos idénticos del mismo archivo se
+    guardan los dos y la misma fila en otra exportación se descarta.
+    Returns: {archivo, clase, filas, nuevas, errores, omitido}; errores con
+    la posición del pago en la exportación ({fila, error, datos})
+    """
+    from procesar_stripe import compilar_esquema, procesar_pago
+    contador = {'filas': 0, 'errores': []}
+    inicio, fin = date.min, date.max
+    
+    def filas() -> Iterator[tuple]:
+        vistas: Dict[bytes, int] = {}
+        for cabecera, tabla in _tablas(archivo, formato):
+            esquema = compilar_esquema(cabecera)
+            ancho = esquema.ancho
+            cola = list(esquema.cola)
+            columna_id = next((cabecera.index(c) for c in COLUMNAS_ID if c in cabecera), None)
+            for fila in tabla:
+                if not fila:
+                    continue
+                contador['filas'] += 1
+                if len(fila) != ancho:
+                    fila = (fila + [''] * ancho)[:ancho]
+                if columna_id is not None and fila[columna_id]:
+                    clave = fila[columna_id]
+                else:
+                    huella = hashlib.sha1('\x1f'.join(map(str, fila)).encode()).digest()
+                    vistas[huella] = n = vistas.get(huella, 0) + 1
+                    clave = f'{huella.hex()}:{n}'
+                try:
+                    pago = procesar_pago(fila + cola, esquema, inicio, fin, almacen)
+                except Exception as e:
+                    contador['errores'].append({'fila': contador['filas'], 'error': str(e), 'datos': fila})
+                    continue
+                if pago is None:
+                    continue
+                (fecha, email, importe, moneda, _, importe_eur, base, iva,
+                 pais, es_ue, substack_fee, stripe_fee) = pago
+                yield (clave, fecha.isoformat() if fecha else None, email, importe, moneda,
+                       importe_eur, base, iva, pais, int(es_ue), substack_fee, stripe_fee)
+    
+    sql = 'INSERT OR IGNORE INTO pagos VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)'
+    return _importar(con, archivo, 'pagos', sql, filas(), contador)
+
+def totales_facturas(con: sqlite3.Connection, inicio: date, fin: date) -> Dict[str, Tuple[int, Decimal, int, int]]:
+    """
+    tipo → (facturas, base, cuota IVA, retención) con fecha en [inicio, fin):
+    la base exacta (Decimal, sin redondear), el resto en céntimos.
+    """
+    totales = {}
+    for tipo in ('ingreso', 'gasto'):
+        n, base, cuota_iva, retencion = con.execute(
+            'SELECT COUNT(*), suma_exacta(base), COALESCE(SUM(cuota_iva), 0), COALESCE(SUM(retencion), 0)'
+            ' FROM facturas WHERE tipo = ? AND fecha >= ? AND fecha < ?',
+            (tipo, inicio.isoformat(), fin.isoformat())
+        ).fetchone()
+        totales[tipo] = (n, Decimal(base), cuota_iva, retencion)
+    return totales
+
+def totales_pagos(con: sqlite3.Connection, inicio: date, fin: date, sin_fecha: bool = False) -> Dict[str, int]:
+    """
+    Acumulados de los pagos con fecha en [inicio, fin), en céntimos; con
+    `sin_fecha`, más los pagos sin fecha (ver informe).
+    """
+    acc = dict.fromkeys((
+        'cantidad_ue', 'total_bruto_ue', 'total_base_ue', 'total_iva_ue',
+        'cantidad_no_ue', 'total_base_no_ue', 'cantidad_sin_pais', 'total_sin_pais',
+        'total_substack_fee', 'total_stripe_fee',
+    ), 0)
+    # Dos consultas y no un OR: así cada una se resuelve solo con el índice pagos_fecha
+    consulta = (
+        'SELECT es_ue, pais IS NULL, COUNT(*), SUM(total_eur), SUM(base), SUM(iva),'
+        ' SUM(substack_fee), SUM(stripe_fee) FROM pagos WHERE {} GROUP BY es_ue, pais IS NULL'
+    )
+    filas = con.execute(consulta.format('fecha >= ? AND fecha < ?'), (inicio.isoformat(), fin.isoformat()))
+    if sin_fecha:
+        filas = chain(filas, con.execute(consulta.format('fecha IS NULL')))
+    for es_ue, sin_pais, cantidad, total, base, iva, substack_fee, stripe_fee in filas:
+        if es_ue:
+            acc['cantidad_ue'] += cantidad
+            acc['total_bruto_ue'] += total
+            acc['total_base_ue'] += base
+            acc['total_iva_ue'] += iva
+            if sin_pais:
+                acc['cantidad_sin_pais'] += cantidad
+                acc['total_sin_pais'] += total
+        else:
+            acc['cantidad_no_ue'] += cantidad
+            acc['total_base_no_ue'] += base
+        acc['total_substack_fee'] += substack_fee
+        acc['total_stripe_fee'] += stripe_fee
+    return acc
+
+def totales_pagos_con_fecha(con: sqlite3.Connection, inicio: Optional[date], fin: Optional[date]) -> Dict[str, int]:
+    """
+    Como totales_pagos (base, IVA y fees), sin los pagos sin fecha. Con
+    inicio y fin None, solo los pagos sin fecha.
+    """
+    acc = {'total_base_ue': 0, 'total_iva_ue': 0, 'total_base_no_ue': 0,
+           'total_substack_fee': 0, 'total_stripe_fee': 0}
+    if inicio is None:
+        condicion, parametros = 'fecha IS NULL', ()
+    else:
+        condicion, parametros = 'fecha >= ? AND fecha < ?', (inicio.isoformat(), fin.isoformat())
+    filas = con.execute(
+        'SELECT es_ue, SUM(base), SUM(iva), SUM(substack_fee), SUM(stripe_fee)'
+        f' FROM pagos WHERE {condicion} GROUP BY es_ue',
+        parametros
+    )
+    for es_ue, base, iva, substack_fee, stripe_fee in filas:
+        acc['total_base_ue' if es_ue else 'total_base_no_ue'] += base
+        acc['total_iva_ue'] += iva if es_ue else 0
+        acc['total_substack_fee'] += substack_fee
+        acc['total_stripe_fee'] += stripe_fee
+    return acc
+
+def cifras_ejercicio(con: sqlite3.Connection, año: int):
+    """
+    Cifras de cada trimestre del año para calcular_ejercicio (con las mismas
+    reglas que informe) y las de los pagos sin fecha (ver el argumento
+    sin_fecha de calcular_ejercicio).
+    Returns: ([Cifras 1T..4T], Cifras sin fecha)
+    """
+    from calcular_ejercicio import Cifras
+    
+    def cifras(facturas: Dict, pagos: Dict) -> Cifras:
+        return Cifras(
+            ingresos=a_decimal(a_centimos(facturas['ingreso'][1], pagos['total_base_ue'] + pagos['total_base_no_ue'])),
+            gastos=a_decimal(a_centimos(facturas['gasto'][1], pagos['total_substack_fee'] + pagos['total_stripe_fee'])),
+            retenciones=a_decimal(facturas['ingreso'][3]),
+            iva_repercutido=a_decimal(facturas['ingreso'][2] + pagos['total_iva_ue']),
+            iva_soportado=a_decimal(facturas['gasto'][2]),
+        )
+    
+    trimestres = []
+    for trimestre in range(1, 5):
+        inicio, fin = rango_trimestre(trimestre, año)
+        trimestres.append(cifras(totales_facturas(con, inicio, fin), totales_pagos_con_fecha(con, inicio, fin)))
+    sin_facturas = {'ingreso': (0, 0, 0, 0), 'gasto': (0, 0, 0, 0)}
+    return trimestres, cifras(sin_facturas, totales_pagos_con_fecha(con, None, None))
+
+def informe(
+    con: sqlite3.Connection,
+    año: int,
+    trimestre: Optional[int] = None,
+    mes: Optional[int] = None,
+    compensacion: Decimal = Decimal('0'),
+    pagos_anteriores: Decimal = Decimal('0')
+) -> Dict:
+    """
+    Libro, pagos y modelos 303 y 130 de un trimestre, un mes o el año
+    (sin trimestre ni mes). El 130 acumula desde el 1 de enero.
+    
+    Los pagos sin fecha se declaran en el 4T (y cuentan en el año), no en
+    cada periodo: su IVA se ingresaría varias veces. Es la misma regla que
+    calcular_ejercicio y el año completo de procesar_stripe.
+    """
+    from calcular_irpf import calcular_modelo_130
+    from calcular_iva import calcular_iva_trimestral
+    
+    if mes is not None:
+        inicio, fin = rango_mes(mes, año)
+        descripcion = f'{mes:02d}/{año}'
+    else:
+        inicio, fin = rango_trimestre(trimestre, año)
+        descripcion = f'{trimestre}T {año}' if trimestre else f'Año {año}'
+    
+    facturas = totales_facturas(con, inicio, fin)
+    pagos = totales_pagos(con, inicio, fin, sin_fecha=mes is None and fin == date(año + 1, 1, 1))
+    n_ingresos, base_ingresos, iva_ingresos, retenciones = facturas['ingreso']
+    n_gastos, base_gastos, iva_gastos, _ = facturas['gasto']
+    fees = pagos['total_substack_fee'] + pagos['total_stripe_fee']
+    
+    # Modelo 303: facturas + pagos UE (IVA incluido); no-UE como exportación
+    iva_repercutido = iva_ingresos + pagos['total_iva_ue']
+    modelo_303 = calcular_iva_trimestral(a_decimal(iva_repercutido), a_decimal(iva_gastos), compensacion)
+    modelo_303['base_imponible'] = a_texto(a_centimos(base_ingresos, pagos['total_base_ue']))
+    modelo_303['exportaciones'] = a_texto(pagos['total_base_no_ue'])
+    
+    # Modelo 130: ingresos y gastos del periodo y de lo que va de año antes de él
+    # (las bases de facturas son exactas: cada total se redondea una vez)
+    ingresos = a_centimos(base_ingresos, pagos['total_base_ue'] + pagos['total_base_no_ue'])
+    gastos = a_centimos(base_gastos, fees)
+    ingresos_anteriores = gastos_anteriores = retenciones_anteriores = 0
+    if inicio.month > 1:
+        previas = totales_facturas(con, date(año, 1, 1), inicio)
+        pagos_previos = totales_pagos_con_fecha(con, date(año, 1, 1), inicio)
+        ingresos_anteriores = a_centimos(previas['ingreso'][1],
+                                         pagos_previos['total_base_ue'] + pagos_previos['total_base_no_ue'])
+        gastos_anteriores = a_centimos(previas['gasto'][1],
+                                       pagos_previos['total_substack_fee'] + pagos_previos['total_stripe_fee'])
+        retenciones_anteriores = previas['ingreso'][3]
+    modelo_130 = calcular_modelo_130(
+        a_decimal(ingresos), a_decimal(gastos), a_decimal(retenciones),
+        a_decimal(ingresos_anteriores), a_decimal(gastos_anteriores), a_decimal(retenciones_anteriores),
+        pagos_anteriores
+    )
+    
+    return {
+        'periodo': {
+            'trimestre': trimestre,
+            'mes': mes,
+            'año': año,
+            'descripcion': descripcion,
+            'desde': inicio.isoformat(),
+            'hasta': date.fromordinal(fin.toordinal() - 1).isoformat(),
+        },
+        'libro': {
+            'ingresos': {
+                'num_facturas': n_ingresos,
+                'base_imponible': a_texto(a_centimos(base_ingresos)),
+                'iva_repercutido': a_texto(iva_ingresos),
+                'retenciones': a_texto(retenciones),
+            },
+            'gastos': {
+                'num_facturas': n_gastos,
+                'base_imponible': a_texto(a_centimos(base_gastos)),
+                'iva_soportado': a_texto(iva_gastos),
+            },
+            'liquidacion': {
+                'rendimiento_neto': a_texto(a_centimos(base_ingresos - base_gastos)),
+                'iva_a_liquidar': a_texto(iva_ingresos - iva_gastos),
+            },
+        },
+        'pagos': {
+            'total_pagos': pagos['cantidad_ue'] + pagos['cantidad_no_ue'],
+            'ue': {
+                'cantidad': pagos['cantidad_ue'],
+                'total_cobrado': a_texto(pagos['total_bruto_ue']),
+                'base_imponible': a_texto(pagos['total_base_ue']),
+                'iva_incluido': a_texto(pagos['total_iva_ue']),
+            },
+            'no_ue': {
+                'cantidad': pagos['cantidad_no_ue'],
+                'base_imponible': a_texto(pagos['total_base_no_ue']),
+            },
+            'sin_pais': {
+                'cantidad': pagos['cantidad_sin_pais'],
+                'total': a_texto(pagos['total_sin_pais']),
+            },
+            'fees': a_texto(fees),
+        },
+        'modelo_303': modelo_303,
+        'modelo_130': modelo_130,
+    }
+
+def resumen_almacen(con: sqlite3.Connection) -> Dict:
+    """Filas guardadas por tabla."""
+    return {
+        'facturas_emitidas': con.execute("SELECT COUNT(*) FROM facturas WHERE tipo = 'ingreso'").fetchone()[0],
+        'facturas_recibidas': con.execute("SELECT COUNT(*) FROM facturas WHERE tipo = 'gasto'").fetchone()[0],
+        'pagos': con.execute('SELECT COUNT(*) FROM pagos').fetchone()[0],
+        'importaciones': con.execute('SELECT COUNT(*) FROM importaciones').fetchone()[0],
+    }
+
+def imprimir_informe(r: Dict):
+    """Resumen del informe en terminal."""
+    libro = r['libro']
+    pagos = r['pagos']
+    m303 = r['modelo_303']
+    m130 = r['modelo_130']
+    print("\n" + "="*60)
+    print(f"   INFORME CONTABLE - {r['periodo']['descripcion']}")
+    print("="*60)
+    print(f"\n📈 Facturas emitidas ({libro['ingresos']['num_facturas']}):"
+          f" base {float(libro['ingresos']['base_imponible']):,.2f} €,"
+          f" IVA {float(libro['ingresos']['iva_repercutido']):,.2f} €,"
+          f" retenciones {float(libro['ingresos']['retenciones']):,.2f} €")
+    print(f"📉 Facturas recibidas ({libro['gastos']['num_facturas']}):"
+          f" base {float(libro['gastos']['base_imponible']):,.2f} €,"
+          f" IVA {float(libro['gastos']['iva_soportado']):,.2f} €")
+    print(f"💳 Pagos ({pagos['total_pagos']}): base UE {float(pagos['ue']['base_imponible']):,.2f} €,"
+          f" IVA {float(pagos['ue']['iva_incluido']):,.2f} €,"
+          f" exportación {float(pagos['no_ue']['base_imponible']):,.2f} €, fees {float(pagos['fees']):,.2f} €")
+    print("\n" + "-"*60)
+    print(f"📊 MODELO 303: {m303['resultado_tipo']} {float(m303['cuota_resultado']):,.2f} €"
+          f" (repercutido {float(m303['iva_repercutido']):,.2f}, soportado {float(m303['iva_soportado']):,.2f})")
+    print(f"📊 MODELO 130: {m130['resultado_tipo']} {float(m130['resultado_a_ingresar']):,.2f} €"
+          f" (rendimiento neto acumulado {float(m130['calculo']['rendimiento_neto']):,.2f})")
+    print("="*60 + "\n")
+
+def instrumentar(perfil: perfilado.Perfil):
+    """Cronometra importaciones y consultas (solo con --profile)."""
+    global importar_facturas, importar_pagos, totales_facturas, totales_pagos, informe
+    importar_facturas = perfil.cronometrar('importar_facturas', importar_facturas)
+    importar_pagos = perfil.cronometrar('importar_pagos', importar_pagos)
+    totales_facturas = perfil.cronometrar('consulta_facturas', totales_facturas)
+    totales_pagos = perfil.cronometrar('consulta_pagos', totales_pagos)
+    informe = perfil.cronometrar('informe', informe)
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Almacén contable en SQLite: importa una vez, consulta en milisegundos',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Ejemplos de uso:
+  # Importar (los archivos ya importados se omiten; las filas repetidas se descartan):
+  python3 contabilidad.py --db conta.sqlite --emitidas emitidas.csv --recibidas recibidas.csv \\
+    --pagos "pagos/2025-*.csv"
+  
+  # Libro, 303 y 130 de un trimestre (o --mes, o el año sin ninguno de los dos):
+  python3 contabilidad.py --db conta.sqlite --trimestre 2 --año 2025 --json
+        """
+    )
+    parser.add_argument('--db', required=True, help='Archivo SQLite (se crea si no existe)')
+    parser.add_argument('--emitidas', nargs='+', default=[], help='CSV de facturas emitidas a importar')
+    parser.add_argument('--recibidas', nargs='+', default=[], help='CSV de facturas recibidas a importar')
+    parser.add_argument('--pagos', nargs='+', default=[],
+                        help='Exportaciones de Stripe/Substack a importar; admite comodines')
+    parser.add_argument('--formato', choices=['csv', 'json', 'ndjson'], default='csv', help='Formato de --pagos')
+    parser.add_argument('--tipos-cambio', type=str,
+                        help='Tipos del BCE por día para los pagos (CSV eurofxref-hist o binario de tipos_cambio.py)')
+    parser.add_argument('--offline', action='store_true',
+                        help='No descargar los tipos del BCE si falta el archivo de --tipos-cambio')
+    parser.add_argument('--trimestre', type=int, choices=[1, 2, 3, 4], help='Trimestre del informe')
+    parser.add_argument('--mes', type=int, choices=range(1, 13), metavar='MES', help='Mes del informe (1-12)')
+    parser.add_argument('--año', type=int, help='Año del informe')
+    parser.add_argument('--compensacion', type=str, default='0', help='IVA a compensar de trimestres anteriores (303)')
+    parser.add_argument('--pagos-anteriores', type=str, default='0', help='Pagos mod.130 anteriores del año')
+    parser.add_argument('--json', action='store_true', help='Salida en formato JSON')
+    perfilado.añadir_argumento(parser)
+    
+    args = parser.parse_args()
+    
+    if args.año is None and (args.trimestre or args.mes):
+        parser.error("--trimestre y --mes necesitan --año")
+    if args.trimestre and args.mes:
+        parser.error("Use --trimestre o --mes, no los dos")
+    
+    perfil = perfilado.crear(args.profile)
+    if perfil is not None:
+        instrumentar(perfil)
+    
+    try:
+        con = abrir(args.db)
+        salida = {}
+        
+        importaciones = []
+        for archivo in args.emitidas:
+            importaciones.append(importar_facturas(con, archivo, 'emitidas'))
+        for archivo in args.recibidas:
+            importaciones.append(importar_facturas(con, archivo, 'recibidas'))
+        if args.pagos:
+            from procesar_stripe import expandir_archivos
+            almacen = None
+            if args.tipos_cambio:
+                from tipos_cambio import cargar_almacen
+                with perfilado.etapa(perfil, 'cargar_tipos_cambio'):
+                    almacen = cargar_almacen(args.tipos_cambio, offline=args.offline)
+            for archivo in expandir_archivos(args.pagos):
+                importaciones.append(importar_pagos(con, archivo, args.formato, almacen))
+        for i in importaciones:
+            if i['omitido']:
+                print(f"⏭️  {i['archivo']}: ya importado", file=sys.stderr)
+            else:
+                print(f"📥 {i['archivo']}: {i['filas']} filas, {i['nuevas']} nuevas", file=sys.stderr)
+                for error in i['errores']:
+                    posicion = f"Línea {error['linea']}" if 'linea' in error else f"Fila {error['fila']}"
+                    print(f"   ⚠️  {posicion}: {error['error']}", file=sys.stderr)
+        if importaciones:
+            salida['importaciones'] = importaciones
+        
+        if args.año is not None:
+            salida['informe'] = informe(
+                con, args.año, args.trimestre, args.mes,
+                Decimal(args.compensacion), Decimal(args.pagos_anteriores)
+            )
+        salida['almacen'] = resumen_almacen(con)
+        con.close()
+        
+        if args.json:
+            print(json.dumps(salida, indent=2, ensure_ascii=False))
+        elif 'informe' in salida:
+            imprimir_informe(salida['informe'])
+        else:
+            a = salida['almacen']
+            print(f"🗄️  {args.db}: {a['facturas_emitidas']} emitidas, {a['facturas_recibidas']} recibidas,"
+                  f" {a['pagos']} pagos ({a['importaciones']} importaciones)")
+    
+    except Exception as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
+    
+    finally:
+        if perfil is not None:
+            perfil.emitir(args.profile)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+Aritmética monetaria en céntimos enteros, compartida por todos los scripts.
+
+Los importes se representan como int (céntimos) y los tipos (IVA,
+retención, divisor 1.21, tipos de cambio) como fracciones exactas, así que
+cada operación redondea una sola vez, con ROUND_HALF_UP, y da el mismo
+céntimo que el cálculo con Decimal y quantize(Decimal('0.01')) — sin crear
+Decimals en los bucles por fila. tests/test_dinero.py lo comprueba contra
+el cálculo Decimal.
+"""
+
+from decimal import Decimal, ROUND_HALF_UP
+from functools import lru_cache
+from typing import Tuple, Union
+
+CENTIMO = Decimal('0.01')
+
+def redondear(valor: Decimal) -> Decimal:
+    """Redondea a 2 decimales (céntimos) según norma fiscal española."""
+    return valor.quantize(CENTIMO, rounding=ROUND_HALF_UP)
+
+def dividir(numerador: int, denominador: int) -> int:
+    """numerador / denominador redondeado a entero con ROUND_HALF_UP (denominador > 0)."""
+    if numerador >= 0:
+        return (2 * numerador + denominador) // (2 * denominador)
+    return -((-2 * numerador + denominador) // (2 * denominador))
+
+@lru_cache(maxsize=1024)
+def fraccion(valor: Union[Decimal, str, int]) -> Tuple[int, int]:
+    """Fracción exacta (numerador, denominador) de un tipo o factor. Memoizada."""
+    return Decimal(valor).as_integer_ratio()
+
+def a_centimos(valor: Decimal, mas: int = 0) -> int:
+    """
+    Decimal → céntimos, redondeando con ROUND_HALF_UP. `mas` (céntimos) se
+    suma antes de redondear: a_centimos(base, cuota - retencion) es el total
+    de una factura aunque la base tenga más de dos decimales.
+    """
+    numerador, denominador = valor.as_integer_ratio()
+    return dividir(numerador * 100 + mas * denominador, denominador)
+
+def a_decimal(centimos: int) -> Decimal:
+    """Céntimos → Decimal con dos decimales."""
+    return Decimal(centimos).scaleb(-2)
+
+def a_texto(centimos: int) -> str:
+    """Céntimos → '1234.56' (igual que str() de un Decimal redondeado)."""
+    if centimos < 0:
+        return f"-{-centimos // 100}.{-centimos % 100:02d}"
+    return f"{centimos // 100}.{centimos % 100:02d}"
+
+def texto_a_centimos(texto: str) -> int:
+    """
+    '60', '60.5', '60.00' → céntimos. Las formas habituales se convierten
+    sin pasar por Decimal; el resto (exponentes, más decimales...) sí.
+    Lanza decimal.InvalidOperation si el texto no es un número.
+    """
+    entero, _, decimales = texto.partition('.')
+    if entero.isdigit():
+        if len(decimales) == 2 and decimales.isdigit():
+            return int(entero + decimales)
+        if not decimales:
+            return int(entero) * 100
+    return a_centimos(Decimal(texto))
+
+def porcentaje(centimos: int, tipo: Decimal) -> int:
+    """Cuota de `tipo` % sobre un importe en céntimos (p. ej. IVA 21 %)."""
+    numerador, denominador = fraccion(tipo)
+    return dividir(centimos * numerador, denominador * 100)
+
+def porcentaje_de(valor: Decimal, tipo: Decimal) -> int:
+    """Cuota de `tipo` % sobre un Decimal cualquiera, en céntimos."""
+    n_valor, d_valor = valor.as_integer_ratio()
+    n_tipo, d_tipo = fraccion(tipo)
+    return dividir(n_valor * n_tipo, d_valor * d_tipo)
+
+def multiplicar(centimos: int, factor: Decimal) -> int:
+    """Importe × factor (p. ej. tipo de cambio), en céntimos."""
+    numerador, denominador = fraccion(factor)
+    return dividir(centimos * numerador, denominador)
+
+def dividir_entre(centimos: int, divisor: Decimal) -> int:
+    """Importe ÷ divisor (p. ej. base = total / 1.21), en céntimos."""
+    numerador, denominador = fraccion(divisor)
+    return dividir(centimos * denominador, numerador)
@@ -0,0 +1,465 @@
+#!/usr/bin/env python3
+"""
+Índice en disco de los pagos ya vistos, para no contar dos veces los que
+se repiten entre exportaciones de Stripe/Substack.
+
+Las exportaciones se solapan en los días del borde y al juntarlas esos
+pagos cuentan dos veces. La clave de cada pago es el id del cargo, si la
+exportación lo trae, o una huella de sus campos: fecha, importe, moneda,
+fees, email y país. La huella no depende del orden de las columnas ni del
+formato de la fecha, y lleva el número de aparición del pago en el archivo,
+para que dos pagos idénticos del mismo archivo cuenten como dos.
+
+Las claves se guardan en una tabla hash de direccionamiento abierto en un
+archivo que se abre con mmap. Solo se leen las páginas que tocan las
+consultas, así que el histórico no se carga en memoria:
+    
+    cabecera   b'GADUP1\\0\\0', capacidad (uint64, potencia de 2), claves (uint64),
+               bits del filtro de Bloom (uint64, 0 = sin filtro), estado (uint32, 1 = a medio escribir)
+    ranuras    capacidad × 16 bytes: huella de la clave (12 bytes) + archivo de origen (uint32, 0 = libre)
+    bloom      bits / 8 bytes
+    origenes   JSON con los archivos registrados (sha256 del contenido, ruta, fecha), hasta el final
+
+Con filtro de Bloom (unos 10 bits por clave, un 4 % del índice; por bloques:
+los bits de cada clave caen en una misma palabra de 64 bits) las claves
+nuevas se reconocen sin tocar la tabla. Se guardan en memoria y se escriben
+al cerrar, ordenadas por ranura: con un histórico que no cabe en la caché
+de páginas, comprobar una exportación nueva casi no lee disco.
+"""
+
+import argparse
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+from datetime import datetime
+from itertools import groupby
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+from cache import BLOQUE_LECTURA, huella_archivo
+import perfilado
+from procesar_stripe import (
+    COLUMNAS_ID, compilar_esquema, expandir_archivos, iterar_json, iterar_ndjson, leer_filas_csv
+)
+
+MAGIA = b'GADUP1\0\0'
+CABECERA = struct.Struct('<8sQQQI')
+POSICION_ESTADO = 32
+INICIO_RANURAS = 64
+TAM_RANURA = 16
+TAM_HUELLA = 12
+LIBRE = bytes(4)
+CAPACIDAD_INICIAL = 1 << 16
+CARGA_MAXIMA = 0.5
+BITS_BLOOM = 5  # bits del filtro por ranura: al menos 10 por clave con la carga máxima
+MAX_PENDIENTES = 1 << 20  # claves nuevas en memoria (con Bloom) antes de escribirlas
+RANURAS_POR_LECTURA = 1 << 16
+
+def huella(texto: str) -> bytes:
+    """Huella de 12 bytes de una clave (blake2b)."""
+    return hashlib.blake2b(texto.encode(), digest_size=TAM_HUELLA).digest()
+
+def _crear(ruta: str, capacidad: int, bloom: bool, origenes: List[Dict]):
+    """Índice vacío: la tabla y el filtro quedan a cero (archivo disperso)."""
+    bits = capacidad * BITS_BLOOM if bloom else 0
+    with open(ruta, 'wb') as f:
+        f.write(CABECERA.pack(MAGIA, capacidad, 0, bits, 0))
+        f.truncate(INICIO_RANURAS + TAM_RANURA * capacidad + bits // 8)
+        f.seek(0, os.SEEK_END)
+        f.write(json.dumps(origenes, ensure_ascii=False).encode())
+
+class IndiceDuplicados:
+    """
+    Claves de pagos → archivo de origen (su posición en `origenes`, desde 1),
+    en un archivo mapeado en memoria (ver el formato arriba). Un solo
+    proceso escribe a la vez; si se interrumpe, al abrirlo de nuevo se
+    recuentan las claves y se rehace el filtro.
+    """
+    
+    def __init__(self, ruta: str, bloom: bool = False):
+        self.ruta = ruta
+        if not os.path.exists(ruta):
+            _crear(ruta, CAPACIDAD_INICIAL, bloom, [])
+        self._abrir(ruta)
+        self._pendientes: Dict[bytes, int] = {}
+        self._modificado = False
+        if self._estado:
+            self._reparar()
+    
+    def _abrir(self, ruta: str):
+        self._archivo = open(ruta, 'r+b')
+        magia, self.capacidad, self.claves, self.bits, self._estado = CABECERA.unpack(
+            self._archivo.read(CABECERA.size)
+        )
+        if magia != MAGIA:
+            self._archivo.close()
+            raise ValueError(f'No es un índice de duplicados: {ruta}')
+        self._mascara = self.capacidad - 1
+        self._limite = int(self.capacidad * CARGA_MAXIMA)
+        self._inicio_bloom = INICIO_RANURAS + TAM_RANURA * self.capacidad
+        self._fin = self._inicio_bloom + self.bits // 8
+        self._archivo.seek(self._fin)
+        self.origenes: List[Dict] = json.loads(self._archivo.read() or b'[]')
+        self._por_huella = {o['huella']: i for i, o in enumerate(self.origenes, 1)}
+        self._mmap = mmap.mmap(self._archivo.fileno(), self._fin)
+    
+    def __len__(self) -> int:
+        return self.claves + len(self._pendientes)
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *excepcion):
+        self.cerrar()
+    
+    def _marcar_modificado(self):
+        if not self._modificado:
+            self._modificado = True
+            struct.pack_into('<I', self._mmap, POSICION_ESTADO, 1)
+    
+    def origen(self, huella_contenido: str, archivo: str) -> Tuple[int, bool]:
+        """Número de origen de un archivo por su contenido. Returns: (origen, si es nuevo)."""
+        origen = self._por_huella.get(huella_contenido)
+        if origen is not None:
+            return origen, False
+        self._marcar_modificado()
+        self.origenes.append({'huella': huella_contenido, 'archivo': archivo,
+                              'registrado': datetime.now().isoformat(timespec='seconds')})
+        origen = self._por_huella[huella_contenido] = len(self.origenes)
+        return origen, True
+    
+    def _ranura(self, clave: bytes) -> Tuple[int, int]:
+        """(posición, origen) de la clave, o de la ranura libre donde iría (origen 0)."""
+        mm = self._mmap
+        mascara = self._mascara
+        i = int.from_bytes(clave[:8], 'little') & mascara
+        while True:
+            posicion = INICIO_RANURAS + TAM_RANURA * i
+            ranura = mm[posicion:posicion + TAM_RANURA]
+            if ranura[TAM_HUELLA:] == LIBRE:
+                return posicion, 0
+            if ranura[:TAM_HUELLA] == clave:
+                return posicion, int.from_bytes(ranura[TAM_HUELLA:], 'little')
+            i = (i + 1) & mascara
+    
+    def _bloque_bloom(self, clave: bytes) -> Tuple[int, int]:
+        """
+        (posición de la palabra de 64 bits, máscara con los bits de la clave):
+        la palabra sale de los bytes 0-4 de la huella y cada uno de los bytes
+        5-11 marca un bit (módulo 64), así que son 7 funciones hash.
+        """
+        c = clave
+        mascara = (1 << (c[5] & 63) | 1 << (c[6] & 63) | 1 << (c[7] & 63) | 1 << (c[8] & 63)
+                   | 1 << (c[9] & 63) | 1 << (c[10] & 63) | 1 << (c[11] & 63))
+        palabra = int.from_bytes(c[:5], 'little') % (self.bits >> 6)
+        return self._inicio_bloom + 8 * palabra, mascara
+    
+    def _en_bloom(self, clave: bytes) -> bool:
+        posicion, mascara = self._bloque_bloom(clave)
+        return (int.from_bytes(self._mmap[posicion:posicion + 8], 'little') & mascara) == mascara
+    
+    def _marcar_bloom(self, clave: bytes):
+        posicion, mascara = self._bloque_bloom(clave)
+        palabra = int.from_bytes(self._mmap[posicion:posicion + 8], 'little') | mascara
+        self._mmap[posicion:posicion + 8] = palabra.to_bytes(8, 'little')
+    
+    def _escribir(self, posicion: int, clave: bytes, origen: int, marcar: bool = True):
+        self._mmap[posicion:posicion + TAM_RANURA] = clave + origen.to_bytes(4, 'little')
+        self.claves += 1
+        if marcar and self.bits:
+            self._marcar_bloom(clave)
+    
+    def registrar(self, clave: bytes, origen: int) -> int:
+        """
+        Origen de la clave si ya estaba en el índice; si no, la añade con
+        `origen` y devuelve 0.
+        """
+        anterior = self._pendientes.get(clave)
+        if anterior:
+            return anterior
+        if self.bits and not self._en_bloom(clave):
+            self._marcar_modificado()
+            self._marcar_bloom(clave)
+            self._pendientes[clave] = origen
+            if len(self._pendientes) >= MAX_PENDIENTES:
+                self._volcar()
+            return 0
+        if self.claves + len(self._pendientes) >= self._limite:
+            self._crecer()
+        posicion, anterior = self._ranura(clave)
+        if not anterior:
+            self._marcar_modificado()
+            self._escribir(posicion, clave, origen)
+        return anterior
+    
+    def _volcar(self):
+        """Escribe las claves pendientes, en orden de ranura (accesos secuenciales)."""
+        while self.claves + len(self._pendientes) > self._limite:
+            self._crecer()
+        mascara = self._mascara
+        for clave in sorted(self._pendientes, key=lambda c: int.from_bytes(c[:8], 'little') & mascara):
+            posicion, _ = self._ranura(clave)
+            self._escribir(posicion, clave, self._pendientes[clave], marcar=False)
+        self._pendientes.clear()
+    
+    def _ranuras_ocupadas(self, mm, capacidad: int) -> Iterator[Tuple[bytes, int]]:
+        """(clave, origen) de cada ranura ocupada, leyendo la tabla por bloques."""
+        for inicio in range(0, capacidad, RANURAS_POR_LECTURA):
+            fin = min(capacidad, inicio + RANURAS_POR_LECTURA)
+            bloque = mm[INICIO_RANURAS + TAM_RANURA * inicio:INICIO_RANURAS + TAM_RANURA * fin]
+            for posicion in range(0, len(bloque), TAM_RANURA):
+                origen = int.from_bytes(bloque[posicion + TAM_HUELLA:posicion + TAM_RANURA], 'little')
+                if origen:
+                    yield bloque[posicion:posicion + TAM_HUELLA], origen
+    
+    def reservar(self, claves_nuevas: int):
+        """Crece de una vez para `claves_nuevas` claves más, en lugar de duplicarse varias veces."""
+        capacidad = self.capacidad
+        while len(self) + claves_nuevas > capacidad * CARGA_MAXIMA:
+            capacidad *= 2
+        if capacidad > self.capacidad:
+            self._crecer(capacidad)
+    
+    def _crecer(self, capacidad: Optional[int] = None):
+        """Duplica la capacidad (o la lleva a `capacidad`): reinserta las claves en un archivo nuevo."""
+        self._marcar_modificado()
+        viejo_mmap, viejo_archivo, vieja_capacidad = self._mmap, self._archivo, self.capacidad
+        temporal = self.ruta + '.tmp'
+        _crear(temporal, capacidad or 2 * vieja_capacidad, bool(self.bits), self.origenes)
+        self._abrir(temporal)
+        struct.pack_into('<I', self._mmap, POSICION_ESTADO, 1)
+        for clave, origen in self._ranuras_ocupadas(viejo_mmap, vieja_capacidad):
+            posicion, _ = self._ranura(clave)
+            self._escribir(posicion, clave, origen)
+        # El filtro nuevo solo tiene las claves de la tabla: faltan las pendientes
+        if self.bits:
+            for clave in self._pendientes:
+                self._marcar_bloom(clave)
+        viejo_mmap.close()
+        viejo_archivo.close()
+        os.replace(temporal, self.ruta)
+    
+    def _reparar(self):
+        """Tras una escritura interrumpida: recuenta las claves y rehace el filtro."""
+        self._marcar_modificado()
+        self.claves = 0
+        if self.bits:
+            self._mmap[self._inicio_bloom:self._fin] = bytes(self.bits // 8)
+        for clave, _ in self._ranuras_ocupadas(self._mmap, self.capacidad):
+            self.claves += 1
+            if self.bits:
+                self._marcar_bloom(clave)
+    
+    def cerrar(self):
+        """Escribe lo pendiente, los orígenes y la cabecera (en ese orden) y cierra."""
+        if self._modificado:
+            self._volcar()
+            self._mmap.flush()
+            self._archivo.seek(self._fin)
+            self._archivo.write(json.dumps(self.origenes, ensure_ascii=False).encode())
+            self._archivo.truncate()
+            self._archivo.flush()
+            CABECERA.pack_into(self._mmap, 0, MAGIA, self.capacidad, self.claves, self.bits, 0)
+            self._mmap.flush()
+            self._modificado = False
+        self._mmap.close()
+        self._archivo.close()
+
+def contar_lineas(archivo: str) -> int:
+    """Líneas de un archivo (cota de sus filas en CSV y NDJSON), sin decodificarlo."""
+    with open(archivo, 'rb') as f:
+        return sum(bloque.count(b'\n') for bloque in iter(lambda: f.read(BLOQUE_LECTURA), b''))
+
+def _texto(valor) -> str:
+    return valor if isinstance(valor, str) else '' if valor is None else str(valor)
+
+def claves_archivo(archivo: str, formato: str = 'csv') -> Iterator[Tuple[int, bytes, bool]]:
+    """
+    (posición, huella, es_id) de cada pago de una exportación. La posición
+    es la de procesar_stripe: fila de datos del CSV u objeto del JSON, desde 1.
+    """
+    if formato == 'csv':
+        filas = leer_filas_csv(archivo)
+        grupos = [(next(filas, []), enumerate(filas, 1))]
+    else:
+        lector = iterar_ndjson if formato == 'ndjson' else iterar_json
+        grupos = ((list(claves), ((n, [_texto(v) for v in pago.values()]) for n, pago in grupo))
+                  for claves, grupo in groupby(enumerate(lector(archivo), 1), key=lambda x: tuple(x[1])))
+    
+    for cabecera, filas in grupos:
+        esquema = compilar_esquema(cabecera)
+        ancho = esquema.ancho
+        cola = list(esquema.cola)
+        columna_id = next((cabecera.index(c) for c in COLUMNAS_ID if c in cabecera), None)
+        dias: Dict[str, str] = {}
+        for posicion, fila in filas:
+            if not fila:
+                continue
+            if len(fila) != ancho:
+                fila = (fila + [''] * ancho)[:ancho]
+            if columna_id is not None and fila[columna_id].strip():
+                yield posicion, huella('id\x1f' + fila[columna_id].strip()), True
+                continue
+            fila += cola
+            importe, moneda, fecha, substack_fee, stripe_fee, email = esquema.extraer(fila)
+            dia = dias.get(fecha)
+            if dia is None:
+                if len(dias) > 100000:
+                    dias.clear()
+                leida = esquema.leer_fecha(fecha)
+                dia = dias[fecha] = leida.isoformat() if leida else fecha.strip()
+            campos = [importe.strip(), (moneda or '').strip().upper(), dia,
+                      substack_fee.strip(), stripe_fee.strip(), email.strip().lower()]
+            campos += [fila[i].strip().upper() for i in esquema.paises]
+            yield posicion, huella('fp\x1f' + '\x1f'.join(campos)), False
+
+def marcar_duplicados(
+    archivos: List[str],
+    formato: str,
+    ruta_indice: str,
+    bloom: bool = False
+) -> Tuple[List[Set[int]], Dict]:
+    """
+    Pagos repetidos de `archivos`, que se leen en ese orden y se registran
+    en el índice.
+    
+    Un pago se omite si ya está en otro archivo de esta ejecución, aunque el
+    índice lo registrara en una anterior. Si solo consta en un archivo que
+    ahora no se procesa, se cuenta (una vez) y se informa como ya visto.
+    Volver a procesar un archivo sin cambios no lo marca como repetido de sí
+    mismo; una copia exacta de otro archivo de la ejecución se omite entera.
+    
+    Returns: (posiciones a omitir de cada archivo, informe)
+    """
+    omitir = []
+    informe_archivos = []
+    with IndiceDuplicados(ruta_indice, bloom) as indice:
+        origenes = []
+        en_ejecucion: Dict[int, str] = {}
+        for archivo in archivos:
+            origen, nuevo = indice.origen(huella_archivo(archivo), archivo)
+            origenes.append((origen, nuevo))
+        for archivo, (origen, _) in zip(archivos, origenes):
+            en_ejecucion.setdefault(origen, archivo)
+        # Los archivos ya registrados no traen claves nuevas (salvo los repetidos de otros)
+        if formato != 'json':
+            indice.reservar(sum(contar_lineas(archivo) for archivo, (_, nuevo) in zip(archivos, origenes) if nuevo))
+        adoptadas: Dict[bytes, int] = {}
+        
+        for archivo, (origen, nuevo) in zip(archivos, origenes):
+            repetidas: Set[int] = set()
+            resumen = {'archivo': archivo, 'nuevo': nuevo, 'filas': 0, 'repetidas': 0,
+                       'repetidas_en': {}, 'ya_vistas': {}}
+            copia_de = en_ejecucion[origen] if en_ejecucion[origen] != archivo else None
+            vistas: Dict[bytes, int] = {}
+            for posicion, clave, es_id in claves_archivo(archivo, formato):
+                resumen['filas'] += 1
+                otro = None
+                if copia_de:
+                    otro = copia_de
+                else:
+                    n = vistas[clave] = vistas.get(clave, 0) + 1
+                    if n > 1 and es_id:
+                        otro = archivo
+                    else:
+                        if n > 1:
+                            clave = hashlib.blake2b(clave + n.to_bytes(4, 'little'), digest_size=TAM_HUELLA).digest()
+                        dueño = indice.registrar(clave, origen)
+                        if dueño and dueño != origen:
+                            if dueño in en_ejecucion:
+                                otro = en_ejecucion[dueño]
+                            else:
+                                primero = adoptadas.setdefault(clave, origen)
+                                if primero != origen:
+                                    otro = en_ejecucion[primero]
+                                else:
+                                    anterior = indice.origenes[dueño - 1]['archivo']
+                                    resumen['ya_vistas'][anterior] = resumen['ya_vistas'].get(anterior, 0) + 1
+                if otro is not None:
+                    repetidas.add(posicion)
+                    resumen['repetidas_en'][otro] = resumen['repetidas_en'].get(otro, 0) + 1
+            resumen['repetidas'] = len(repetidas)
+            if copia_de:
+                resumen['copia_de'] = copia_de
+            omitir.append(repetidas)
+            informe_archivos.append(resumen)
+        claves = len(indice)
+        con_bloom = bool(indice.bits)
+    
+    return omitir, {
+        'indice': ruta_indice,
+        'claves': claves,
+        'bloom': con_bloom,
+        'repetidas': sum(len(r) for r in omitir),
+        'archivos': informe_archivos,
+    }
+
+def imprimir_informe(informe: Dict):
+    print("\n" + "="*70)
+    print(f"   PAGOS REPETIDOS ENTRE EXPORTACIONES")
+    print(f"   Índice: {informe['indice']} ({informe['claves']} claves)")
+    print("="*70)
+    for r in informe['archivos']:
+        print(f"\n   {r['archivo']}{' (nuevo)' if r['nuevo'] else ''}")
+        print(f"      Pagos:          {r['filas']:>8}")
+        print(f"      Repetidos:      {r['repetidas']:>8}" + (f"  (copia de {r['copia_de']})" if r.get('copia_de') else ''))
+        for otro, n in r['repetidas_en'].items():
+            print(f"         {n:>8} en {otro}")
+        for anterior, n in r['ya_vistas'].items():
+            print(f"      Ya vistos en {anterior} (no procesado ahora): {n}")
+    print(f"\n   Total repetidos: {informe['repetidas']}")
+    print("="*70 + "\n")
+
+def instrumentar(perfil: perfilado.Perfil):
+    """Cronometra la lectura de claves y la búsqueda en el índice (solo con --profile)."""
+    global claves_archivo, marcar_duplicados
+    claves_archivo = perfil.cronometrar_iterador('claves_archivo', claves_archivo)
+    marcar_duplicados = perfil.cronometrar('marcar_duplicados', marcar_duplicados)
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Pagos repetidos entre exportaciones de Stripe/Substack (índice persistente en disco)',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Ejemplos de uso:
+  python3 duplicados.py --indice pagos.idx --archivo "exportaciones/*.csv"
+  
+  # Histórico muy grande: filtro de Bloom delante de la tabla (al crear el índice)
+  python3 duplicados.py --indice pagos.idx --bloom --archivo nueva.csv --json
+
+Para omitir los repetidos al calcular: procesar_stripe.py --indice-duplicados pagos.idx
+        """
+    )
+    parser.add_argument('--indice', required=True, help='Archivo del índice (se crea si no existe)')
+    parser.add_argument('--archivo', required=True, nargs='+', help='Exportaciones; admite comodines')
+    parser.add_argument('--formato', choices=['csv', 'json', 'ndjson'], default='csv')
+    parser.add_argument('--bloom', action='store_true',
+                        help='Crear el índice con filtro de Bloom (no cambia uno que ya existe)')
+    parser.add_argument('--json', action='store_true', help='Salida JSON')
+    perfilado.añadir_argumento(parser)
+    
+    args = parser.parse_args()
+    
+    perfil = perfilado.crear(args.profile)
+    if perfil is not None:
+        instrumentar(perfil)
+    
+    try:
+        archivos = expandir_archivos(args.archivo)
+        _, informe = marcar_duplicados(archivos, args.formato, args.indice, args.bloom)
+        if args.json:
+            print(json.dumps(informe, indent=2, ensure_ascii=False))
+        else:
+            imprimir_informe(informe)
+    except Exception as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
+    
+    finally:
+        if perfil is not None:
+            perfil.emitir(args.profile)
+
+if __name__ == "__main__":
+    main()
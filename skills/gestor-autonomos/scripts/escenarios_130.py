@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+"""
+Escenarios del Modelo 130: cuánto cambia el pago fraccionado si entra otra
+factura o se compra algo más este trimestre.
+
+En lugar de llamar a calcular_modelo_130 una vez por supuesto, se dan
+rangos de ingresos, gastos y retenciones del trimestre y se calcula la
+rejilla entera (todas las combinaciones) de una vez, por columnas de
+céntimos: con NumPy, cientos de miles de escenarios en milisegundos. Las
+reglas son las de calcular_modelo_130, céntimo a céntimo: reducción del 7%
+del rendimiento neto positivo con tope de 2000 €, 20% del rendimiento neto
+positivo, menos retenciones y pagos anteriores, y 0 si sale negativo.
+--verificar lo comprueba contra la función escalar.
+    
+    python3 escenarios_130.py --ingresos 10000:14000:500 --gastos 2000:5000:250 --retenciones 1500
+"""
+
+import argparse
+import json
+import sys
+import time
+from decimal import Decimal
+from itertools import product
+from typing import Dict, Iterator, List, Sequence
+
+from calcular_irpf import (
+    MAXIMO_REDUCCION_GASTOS, PORCENTAJE_PAGO_FRACCIONADO, REDUCCION_GASTOS_DIFICIL_JUSTIFICACION,
+    calcular_modelo_130
+)
+from dinero import a_centimos, a_decimal, a_texto, dividir, fraccion
+import perfilado
+
+np = None
+
+# Columnas de cada escenario (céntimos); mismos nombres que el dict de calcular_modelo_130
+COLUMNAS = (
+    'ingresos', 'gastos', 'retenciones', 'rendimiento_neto_previo', 'reduccion_gastos_dificil_justificacion',
+    'rendimiento_neto', 'pago_20_por_ciento', 'resultado_previo', 'resultado_a_ingresar',
+)
+# Una rejilla mayor es casi seguro un paso equivocado
+MAX_ESCENARIOS = 10_000_000
+# Cota de los productos intermedios para operar en int64 sin desbordar
+LIMITE_INT64 = 2 ** 61
+
+def cargar_numpy() -> bool:
+    """Importa NumPy la primera vez que hace falta. False si no está instalado."""
+    global np
+    if np is None:
+        try:
+            import numpy
+        except ImportError:
+            return False
+        np = numpy
+    return True
+
+def centimos(texto: str) -> int:
+    """'1500', '1500.5' → céntimos. Los escenarios van al céntimo: más decimales son un error."""
+    try:
+        valor = Decimal(texto.strip())
+    except ArithmeticError:
+        raise ValueError(f"'{texto}' no es un importe") from None
+    if valor != valor.quantize(Decimal('0.01')):
+        raise ValueError(f"{texto}: como mucho 2 decimales")
+    return a_centimos(valor)
+
+def parsear_rango(texto: str) -> Sequence[int]:
+    """
+    Valores de un eje de la rejilla, en céntimos: '12000' (uno),
+    '9000,12000,15000' (lista) o '10000:14000:500' (de 10000 a 14000,
+    incluido, de 500 en 500). Los rangos se devuelven como range, sin
+    crear la lista: calcular_escenarios mira el tamaño antes de recorrerlos.
+    """
+    if ':' not in texto:
+        return [centimos(valor) for valor in texto.split(',')]
+    partes = texto.split(':')
+    if len(partes) != 3:
+        raise ValueError(f"Rango '{texto}': use inicio:fin:paso")
+    inicio, fin, paso = map(centimos, partes)
+    if paso <= 0 or fin < inicio:
+        raise ValueError(f"Rango '{texto}': el paso tiene que ser positivo y el fin no menor que el inicio")
+    return range(inicio, fin + 1, paso)
+
+def _dividir_np(numerador, denominador: int):
+    """dinero.dividir sobre arrays int64 (ROUND_HALF_UP, denominador > 0)."""
+    cociente = (2 * np.abs(numerador) + denominador) // (2 * denominador)
+    return np.where(numerador < 0, -cociente, cociente)
+
+def _escenarios_numpy(ingresos, gastos, retenciones, anteriores, aplicar_reduccion) -> Dict:
+    ingresos_ant, gastos_ant, retenciones_ant, pagos_ant = anteriores
+    n_reduccion, d_reduccion = fraccion(REDUCCION_GASTOS_DIFICIL_JUSTIFICACION)
+    n_pago, d_pago = fraccion(PORCENTAJE_PAGO_FRACCIONADO)
+    i, g, r = (eje.ravel() for eje in np.meshgrid(
+        np.array(ingresos, dtype=np.int64), np.array(gastos, dtype=np.int64),
+        np.array(retenciones, dtype=np.int64), indexing='ij'
+    ))
+    
+    previo = (i + ingresos_ant) - (g + gastos_ant)
+    if aplicar_reduccion:
+        reduccion = np.minimum(_dividir_np(previo * n_reduccion, 100 * d_reduccion),
+                               a_centimos(MAXIMO_REDUCCION_GASTOS))
+        reduccion = np.where(previo > 0, reduccion, 0)
+    else:
+        reduccion = np.zeros_like(previo)
+    neto = previo - reduccion
+    pago = np.where(neto > 0, _dividir_np(neto * n_pago, 100 * d_pago), 0)
+    resultado = pago - (r + retenciones_ant) - pagos_ant
+    return dict(zip(COLUMNAS, (i, g, r, previo, reduccion, neto, pago, resultado, np.maximum(resultado, 0))))
+
+def _escenarios_python(ingresos, gastos, retenciones, anteriores, aplicar_reduccion) -> Dict:
+    ingresos_ant, gastos_ant, retenciones_ant, pagos_ant = anteriores
+    n_reduccion, d_reduccion = fraccion(REDUCCION_GASTOS_DIFICIL_JUSTIFICACION)
+    n_pago, d_pago = fraccion(PORCENTAJE_PAGO_FRACCIONADO)
+    tope = a_centimos(MAXIMO_REDUCCION_GASTOS)
+    columnas = {columna: [] for columna in COLUMNAS}
+    añadir = [columnas[columna].append for columna in COLUMNAS]
+    for i, g, r in product(ingresos, gastos, retenciones):
+        previo = (i + ingresos_ant) - (g + gastos_ant)
+        reduccion = 0
+        if aplicar_reduccion and previo > 0:
+            reduccion = min(dividir(previo * n_reduccion, 100 * d_reduccion), tope)
+        neto = previo - reduccion
+        pago = dividir(neto * n_pago, 100 * d_pago) if neto > 0 else 0
+        resultado = pago - (r + retenciones_ant) - pagos_ant
+        for anotar, valor in zip(añadir, (i, g, r, previo, reduccion, neto, pago, resultado, max(resultado, 0))):
+            anotar(valor)
+    return columnas
+
+def calcular_escenarios(
+    ingresos: Sequence[int],
+    gastos: Sequence[int],
+    retenciones: Sequence[int] = (0,),
+    ingresos_anteriores: int = 0,
+    gastos_anteriores: int = 0,
+    retenciones_anteriores: int = 0,
+    pagos_anteriores: int = 0,
+    aplicar_reduccion_5_gastos: bool = True,
+    motor: str = 'auto'
+) -> Dict[str, Sequence[int]]:
+    """
+    Modelo 130 de cada combinación de ingresos, gastos y retenciones del
+    trimestre, con los mismos acumulados anteriores. Importes en céntimos.
+    
+    `motor`: 'numpy' (arrays int64), 'python' (listas) o 'auto' (NumPy si
+    está instalado y los importes caben en int64); el resultado es el mismo.
+    
+    Returns:
+        {columna: valores} (ver COLUMNAS), un valor por escenario en el
+        orden de itertools.product(ingresos, gastos, retenciones)
+    """
+    total = len(ingresos) * len(gastos) * len(retenciones)
+    if total > MAX_ESCENARIOS:
+        raise ValueError(f"{total} escenarios: el máximo es {MAX_ESCENARIOS} (amplíe el paso de los rangos)")
+    anteriores = (ingresos_anteriores, gastos_anteriores, retenciones_anteriores, pagos_anteriores)
+    cota = max(map(abs, (*ingresos, *gastos, *retenciones, *anteriores)), default=0)
+    # (ingresos + anteriores - gastos - anteriores) × 20 × 2 de dividir, con margen
+    if motor != 'python' and cota * 200 < LIMITE_INT64 and cargar_numpy():
+        return _escenarios_numpy(ingresos, gastos, retenciones, anteriores, aplicar_reduccion_5_gastos)
+    return _escenarios_python(ingresos, gastos, retenciones, anteriores, aplicar_reduccion_5_gastos)
+
+def filas_escenarios(columnas: Dict[str, Sequence[int]]) -> Iterator[tuple]:
+    """Escenarios fila a fila (enteros de Python en céntimos), en el orden de COLUMNAS."""
+    return zip(*(valores.tolist() if hasattr(valores, 'tolist') else valores
+                 for valores in (columnas[columna] for columna in COLUMNAS)))
+
+def _lineas(columnas: Dict[str, Sequence[int]], plantilla: str) -> Iterator[str]:
+    """
+    Escenarios formateados con `plantilla` (un '%s%d.%02d' por columna): el
+    signo, los euros y los céntimos de cada importe se separan por columnas
+    y cada línea sale de una sola operación %, sin llamar a a_texto por valor.
+    """
+    partes = []
+    for columna in COLUMNAS:
+        valores = columnas[columna]
+        if hasattr(valores, 'tolist'):
+            absolutos = np.abs(valores)
+            partes += [np.where(valores < 0, '-', '').tolist(), (absolutos // 100).tolist(), (absolutos % 100).tolist()]
+        else:
+            partes += [['-' if v < 0 else '' for v in valores], [abs(v) // 100 for v in valores],
+                       [abs(v) % 100 for v in valores]]
+    for valores in zip(*partes):
+        yield plantilla % valores
+
+def escribir_csv(columnas: Dict, f):
+    """CSV con cabecera, importes como a_texto ('1234.56')."""
+    f.write(','.join(COLUMNAS) + '\r\n')
+    f.writelines(_lineas(columnas, ','.join(['%s%d.%02d'] * len(COLUMNAS)) + '\r\n'))
+
+def escribir_ndjson(columnas: Dict, f):
+    """Un objeto JSON por escenario, con los importes como texto (igual que json.dumps)."""
+    plantilla = '{' + ', '.join(f'"{columna}": "%s%d.%02d"' for columna in COLUMNAS) + '}\n'
+    f.writelines(_lineas(columnas, plantilla))
+
+def verificar(columnas: Dict, anteriores: Sequence[int], aplicar_reduccion_5_gastos: bool, muestra: int = 0) -> List[Dict]:
+    """
+    Compara escenarios con calcular_modelo_130 (todos, o `muestra` repartidos
+    por la rejilla). Returns: los que no coinciden (vacío si todo cuadra).
+    """
+    filas = list(filas_escenarios(columnas))
+    if muestra and muestra < len(filas):
+        filas = filas[::len(filas) // muestra][:muestra]
+    ingresos_ant, gastos_ant, retenciones_ant, pagos_ant = map(a_decimal, anteriores)
+    distintos = []
+    for fila in filas:
+        escenario = dict(zip(COLUMNAS, fila))
+        escalar = calcular_modelo_130(
+            a_decimal(escenario['ingresos']), a_decimal(escenario['gastos']), a_decimal(escenario['retenciones']),
+            ingresos_ant, gastos_ant, retenciones_ant, pagos_ant, aplicar_reduccion_5_gastos
+        )
+        esperado = {columna: Decimal(escalar['calculo'][columna]) for columna in COLUMNAS[3:-1]}
+        esperado['resultado_a_ingresar'] = Decimal(escalar['resultado_a_ingresar'])
+        if any(a_decimal(escenario[columna]) != valor for columna, valor in esperado.items()):
+            distintos.append({'escenario': {c: a_texto(v) for c, v in escenario.items()},
+                              'calcular_modelo_130': {c: str(v) for c, v in esperado.items()}})
+    return distintos
+
+def instrumentar(perfil: perfilado.Perfil):
+    """Cronometra cálculo y escritura (solo con --profile)."""
+    global calcular_escenarios, escribir_csv, escribir_ndjson
+    calcular_escenarios = perfil.cronometrar('calcular_escenarios', calcular_escenarios)
+    escribir_csv = perfil.cronometrar('escribir_csv', escribir_csv)
+    escribir_ndjson = perfil.cronometrar('escribir_ndjson', escribir_ndjson)
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Escenarios del Modelo 130: rejilla de ingresos, gastos y retenciones en una pasada',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Cada eje es un valor (12000), una lista (9000,12000,15000) o un rango
+inicio:fin:paso con el fin incluido (10000:14000:500). Se calculan todas las
+combinaciones; la salida es CSV (o NDJSON) con una fila por escenario.
+
+Ejemplos de uso:
+  # ¿Y si facturo entre 10.000 y 14.000 € y gasto entre 2.000 y 5.000 €?
+  python3 escenarios_130.py --ingresos 10000:14000:500 --gastos 2000:5000:250 --retenciones 1500
+  
+  # 3T, con lo acumulado del año y una compra de 0 a 3.000 € (de 10 en 10):
+  python3 escenarios_130.py --ingresos 9000 --gastos 2500:5500:10 \\
+    --ingresos-anteriores 21000 --gastos-anteriores 6000 --pagos-anteriores 2100 --ndjson
+  
+  # Comprobar la rejilla contra calcular_modelo_130, escenario a escenario:
+  python3 escenarios_130.py --ingresos 0:20000:100 --gastos 0:20000:100 --verificar --salida /dev/null
+        """
+    )
+    parser.add_argument('--ingresos', type=str, required=True, help='Ingresos del trimestre (valor, lista o rango)')
+    parser.add_argument('--gastos', type=str, required=True, help='Gastos del trimestre (valor, lista o rango)')
+    parser.add_argument('--retenciones', type=str, default='0', help='Retenciones del trimestre (valor, lista o rango)')
+    parser.add_argument('--ingresos-anteriores', type=str, default='0', help='Ingresos acumulados trimestres anteriores')
+    parser.add_argument('--gastos-anteriores', type=str, default='0', help='Gastos acumulados trimestres anteriores')
+    parser.add_argument('--retenciones-anteriores', type=str, default='0', help='Retenciones acumuladas anteriores')
+    parser.add_argument('--pagos-anteriores', type=str, default='0', help='Pagos fraccionados anteriores (130)')
+    parser.add_argument('--sin-reduccion-gastos', action='store_true',
+                        help='No aplicar reducción 7%% gastos difícil justificación')
+    parser.add_argument('--ndjson', action='store_true', help='Salida en NDJSON (un escenario por línea)')
+    parser.add_argument('--salida', type=str, help='Escribir en un archivo (NDJSON si termina en .ndjson o .jsonl)')
+    parser.add_argument('--motor', choices=['auto', 'python', 'numpy'], default='auto',
+                        help='auto: NumPy si está instalado (mismo resultado)')
+    parser.add_argument('--verificar', type=int, nargs='?', const=0, metavar='N',
+                        help='Comprobar los escenarios (o N de ellos) contra calcular_modelo_130')
+    perfilado.añadir_argumento(parser)
+    
+    args = parser.parse_args()
+    
+    if args.motor == 'numpy' and not cargar_numpy():
+        parser.error("--motor numpy necesita NumPy (pip install numpy)")
+    
+    perfil = perfilado.crear(args.profile)
+    if perfil is not None:
+        instrumentar(perfil)
+    
+    try:
+        ejes = [parsear_rango(texto) for texto in (args.ingresos, args.gastos, args.retenciones)]
+        anteriores = [centimos(texto) for texto in (args.ingresos_anteriores, args.gastos_anteriores,
+                                                    args.retenciones_anteriores, args.pagos_anteriores)]
+        
+        inicio = time.perf_counter()
+        columnas = calcular_escenarios(*ejes, *anteriores, aplicar_reduccion_5_gastos=not args.sin_reduccion_gastos,
+                                       motor=args.motor)
+        segundos = time.perf_counter() - inicio
+        resultados = columnas['resultado_a_ingresar']
+        minimo, maximo = (resultados.min(), resultados.max()) if hasattr(resultados, 'min') else (min(resultados), max(resultados))
+        print(f"🧮 {len(resultados)} escenarios en {segundos * 1000:.1f} ms; resultado a ingresar de "
+              f"{a_texto(int(minimo))} a {a_texto(int(maximo))} €", file=sys.stderr)
+        
+        ndjson = args.ndjson or (args.salida or '').lower().endswith(('.ndjson', '.jsonl'))
+        escribir = escribir_ndjson if ndjson else escribir_csv
+        if args.salida:
+            with open(args.salida, 'w', encoding='utf-8', newline='') as f:
+                escribir(columnas, f)
+        else:
+            escribir(columnas, sys.stdout)
+        
+        if args.verificar is not None:
+            with perfilado.etapa(perfil, 'verificar'):
+                distintos = verificar(columnas, anteriores, not args.sin_reduccion_gastos, args.verificar)
+            if distintos:
+                print(f"❌ {len(distintos)} escenario(s) no coinciden con calcular_modelo_130:", file=sys.stderr)
+                for d in distintos[:5]:
+                    print(f"   {json.dumps(d, ensure_ascii=False)}", file=sys.stderr)
+                sys.exit(1)
+            print("✅ Coinciden con calcular_modelo_130", file=sys.stderr)
+    
+    except Exception as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
+    
+    finally:
+        if perfil is not None:
+            perfil.emitir(args.profile)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""
+Fechas compartidas por los scripts: parsers rápidos de los formatos de las
+exportaciones y de los CSV de facturas (Substack 'DD-MMM-YY', ISO con o sin
+hora, europeo 'DD/MM/YYYY'), el lector memoizado por columna y los rangos
+[inicio, fin) de un trimestre o un mes.
+"""
+
+from datetime import date, datetime
+from functools import lru_cache
+from typing import Callable, Optional, Tuple
+
+MESES_ABREV = {
+    'jan': 1, 'feb': 2, 'mar': 3, 'apr': 4, 'may': 5, 'jun': 6,
+    'jul': 7, 'aug': 8, 'sep': 9, 'oct': 10, 'nov': 11, 'dec': 12,
+}
+
+def _crear_fecha(año: int, mes: int, dia: int) -> Optional[date]:
+    try:
+        return date(año, mes, dia)
+    except ValueError:
+        return None
+
+def _fecha_substack(valor: str) -> Optional[date]:
+    """'DD-MMM-YY' (Substack). None si la cadena no tiene esa forma."""
+    if len(valor) == 9 and valor[2] == '-' and valor[6] == '-' and valor[:2].isdigit() and valor[7:].isdigit():
+        mes = MESES_ABREV.get(valor[3:6].lower())
+        if mes:
+            año = int(valor[7:])
+            # Misma regla que %y: 69-99 → 1900, 00-68 → 2000
+            return _crear_fecha(año + (1900 if año >= 69 else 2000), mes, int(valor[:2]))
+    return None
+
+def _fecha_iso(valor: str) -> Optional[date]:
+    """'YYYY-MM-DD', con o sin hora detrás (' ' o 'T'). None si no tiene esa forma."""
+    if (len(valor) >= 10 and valor[4] == '-' and valor[7] == '-'
+            and (len(valor) == 10 or valor[10] in ' T')
+            and valor[:4].isdigit() and valor[5:7].isdigit() and valor[8:10].isdigit()):
+        return _crear_fecha(int(valor[:4]), int(valor[5:7]), int(valor[8:10]))
+    return None
+
+def _fecha_europea(valor: str) -> Optional[date]:
+    """'DD/MM/YYYY'. None si la cadena no tiene esa forma."""
+    if (len(valor) == 10 and valor[2] == '/' and valor[5] == '/'
+            and valor[:2].isdigit() and valor[3:5].isdigit() and valor[6:].isdigit()):
+        return _crear_fecha(int(valor[6:]), int(valor[3:5]), int(valor[:2]))
+    return None
+
+FORMATOS_FECHA = (_fecha_substack, _fecha_iso, _fecha_europea)
+
+def _fecha_strptime(valor: str) -> Optional[date]:
+    """Variantes sin ceros a la izquierda ('2-Oct-25', '2025-1-5'): vía strptime."""
+    for patron, texto in (
+        ('%d-%b-%y', valor),
+        ('%Y-%m-%d', valor.split(' ')[0].split('T')[0]),
+        ('%d/%m/%Y', valor),
+    ):
+        try:
+            return datetime.strptime(texto, patron).date()
+        except ValueError:
+            pass
+    return None
+
+def detectar_formato_fecha(valor: str) -> Optional[Callable[[str], Optional[date]]]:
+    """Devuelve el parser rápido que reconoce `valor`, o None."""
+    for formato in FORMATOS_FECHA:
+        if formato(valor) is not None:
+            return formato
+    return None
+
+def parsear_fecha(valor: str) -> Optional[date]:
+    """
+    Parsea fechas en múltiples formatos.
+    Substack: '02-Oct-25', '15-Nov-25'
+    Stripe: '2025-10-02', '2025-10-02 14:30:00'
+    Europeo: '02/10/2025'
+    """
+    if not valor:
+        return None
+    
+    valor = str(valor).strip()
+    
+    for formato in FORMATOS_FECHA:
+        fecha = formato(valor)
+        if fecha is not None:
+            return fecha
+    
+    return _fecha_strptime(valor)
+
+def crear_lector_fechas(maxsize: int = 4096) -> Callable[[str], Optional[date]]:
+    """
+    Crea un parser de fechas para una columna.
+    
+    El formato se detecta con el primer valor válido y las filas siguientes
+    van directas a su parser (sin excepciones); el resultado se memoiza por
+    cadena, porque miles de pagos comparten día. Las marcas de tiempo ISO se
+    recortan al día antes de consultar la caché.
+    """
+    formato = None
+    
+    @lru_cache(maxsize=maxsize)
+    def leer_dia(valor: str) -> Optional[date]:
+        nonlocal formato
+        if formato is not None:
+            fecha = formato(valor)
+            if fecha is not None:
+                return fecha
+        fecha = parsear_fecha(valor)
+        if fecha is not None and formato is None:
+            formato = detectar_formato_fecha(valor)
+        return fecha
+    
+    def leer(valor: str) -> Optional[date]:
+        if not valor:
+            return None
+        if valor.__class__ is not str:
+            return parsear_fecha(valor)
+        valor = valor.strip()
+        if len(valor) > 10 and valor[10] in ' T' and valor[4] == '-' and valor[7] == '-':
+            valor = valor[:10]
+        return leer_dia(valor)
+    
+    return leer
+
+def rango_trimestre(trimestre: Optional[int], año: int) -> Tuple[date, date]:
+    """Fechas [inicio, fin) del trimestre (o del año entero si trimestre es None)."""
+    if trimestre is None:
+        return date(año, 1, 1), date(año + 1, 1, 1)
+    mes_inicio = (trimestre - 1) * 3 + 1
+    mes_fin = trimestre * 3
+    fecha_inicio = date(año, mes_inicio, 1)
+    fecha_fin = date(año + 1, 1, 1) if mes_fin == 12 else date(año, mes_fin + 1, 1)
+    return fecha_inicio, fecha_fin
+
+def rango_mes(mes: int, año: int) -> Tuple[date, date]:
+    """Fechas [inicio, fin) de un mes."""
+    return date(año, mes, 1), date(año + (mes == 12), mes % 12 + 1, 1)
@@ -7,171 +7,426 @@ Genera el libro obligatorio en formato CSV/JSON según normativa AEAT.
 import argparse
 import csv
 import json
+import os
 import sys
-from decimal import Decimal, ROUND_HALF_UP
-from datetime import datetime
-from typing import List, Dict
+from bisect import bisect_left
+from contextlib import ExitStack
+from decimal import Decimal
+from datetime import date, datetime, timedelta
+from typing import IO, Iterable, Iterator, List, Dict, Optional, Tuple
 
-def redondear_centimos(valor: Decimal) -> Decimal:
-    """Redondea a 2 decimales."""
-    return valor.quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+from dinero import redondear as redondear_centimos, a_centimos, a_texto, porcentaje_de
+import cache
+import perfilado
+from registros import Apunte, serializar, tipo_decimal
+from fechas import crear_lector_fechas, rango_mes, rango_trimestre
 
-def leer_facturas_csv(archivo: str) -> List[Dict]:
-    """Lee facturas de un archivo CSV."""
-    facturas = []
+def iterar_facturas_csv(archivo: str) -> Iterator[Dict]:
+    """Facturas de un archivo CSV, una a una (sin cargarlas todas)."""
     try:
         with open(archivo, 'r', encoding='utf-8') as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                facturas.append(row)
+            yield from csv.DictReader(f)
     except FileNotFoundError:
         print(f"Advertencia: Archivo no encontrado {archivo}", file=sys.stderr)
-    return facturas
 
-def procesar_factura(row: Dict, tipo: str) -> Dict:
-    """Procesa una factura y calcula totales."""
+def leer_facturas_csv(archivo: str) -> List[Dict]:
+    """Lee facturas de un archivo CSV."""
+    return list(iterar_facturas_csv(archivo))
+
+def procesar_factura(row: Dict, tipo: str) -> Apunte:
+    """Procesa una factura y calcula totales (importes numéricos, ver registros.Apunte)."""
     base = Decimal(row.get('base_imponible', '0').replace(',', '.'))
-    iva_pct = Decimal(row.get('tipo_iva', '21').replace(',', '.'))
-    ret_pct = Decimal(row.get('tipo_retencion', '0').replace(',', '.'))
+    iva_pct = tipo_decimal(row.get('tipo_iva', '21'))
+    ret_pct = tipo_decimal(row.get('tipo_retencion', '0'))
     
-    iva = redondear_centimos(base * iva_pct / Decimal('100'))
-    retencion = redondear_centimos(base * ret_pct / Decimal('100'))
-    total = redondear_centimos(base + iva - retencion)
+    iva = porcentaje_de(base, iva_pct)
+    retencion = porcentaje_de(base, ret_pct)
+    total = a_centimos(base, iva - retencion)
+    
+    concepto = row.get('concepto', '')
+    return Apunte(
+        tipo, row.get('nombre', concepto),
+        row.get('numero', ''), row.get('fecha', ''), row.get('nif', ''), concepto,
+        base, iva_pct, iva, ret_pct, retencion, total
+    )
+
+class IndiceLibro:
+    """
+    Ingresos y gastos ordenados por fecha.
+    
+    Cada factura se lee y se calcula una sola vez al cargarla; un periodo
+    (trimestre, mes o rango) son dos búsquedas binarias sobre las fechas, así
+    que de una misma carga salen varios libros sin volver a leer los CSV.
+    Las facturas con la fecha vacía o ilegible quedan aparte, en sin_fecha.
+    """
+    
+    def __init__(self):
+        self.fechas: Dict[str, List[date]] = {'ingreso': [], 'gasto': []}
+        self.apuntes: Dict[str, List[Apunte]] = {'ingreso': [], 'gasto': []}
+        self.sin_fecha: Dict[str, List[Apunte]] = {'ingreso': [], 'gasto': []}
+    
+    def añadir(self, rows: Iterable[Dict], tipo: str):
+        """Procesa las facturas de un CSV y las añade al índice ('ingreso' o 'gasto')."""
+        leer_fecha = crear_lector_fechas()
+        fechas, apuntes = self.fechas[tipo], self.apuntes[tipo]
+        for row in rows:
+            apunte = procesar_factura(row, tipo)
+            fecha = leer_fecha(apunte.fecha)
+            if fecha is None:
+                self.sin_fecha[tipo].append(apunte)
+            else:
+                fechas.append(fecha)
+                apuntes.append(apunte)
+        self._ordenar(tipo)
+    
+    def parcial(self, tipo: str) -> Tuple[List[date], List[Apunte], List[Apunte]]:
+        """(fechas, apuntes, sin fecha) de un tipo: lo que se guarda en caché por archivo."""
+        return self.fechas[tipo], self.apuntes[tipo], self.sin_fecha[tipo]
+    
+    def fusionar(self, tipo: str, parcial: Tuple[List[date], List[Apunte], List[Apunte]]):
+        """Añade el parcial de otro archivo (ver parcial())."""
+        fechas, apuntes, sin_fecha = parcial
+        self.fechas[tipo] += fechas
+        self.apuntes[tipo] += apuntes
+        self.sin_fecha[tipo] += sin_fecha
+        self._ordenar(tipo)
+    
+    def _ordenar(self, tipo: str):
+        # Orden estable: las facturas del mismo día mantienen el orden del CSV
+        fechas, apuntes = self.fechas[tipo], self.apuntes[tipo]
+        orden = sorted(range(len(fechas)), key=fechas.__getitem__)
+        self.fechas[tipo] = [fechas[i] for i in orden]
+        self.apuntes[tipo] = [apuntes[i] for i in orden]
+    
+    def entre(self, tipo: str, inicio: date, fin: date) -> List[Apunte]:
+        """Apuntes con fecha en [inicio, fin)."""
+        fechas = self.fechas[tipo]
+        return self.apuntes[tipo][bisect_left(fechas, inicio):bisect_left(fechas, fin)]
+
+def apuntes_archivo(archivo: str, tipo: str) -> Tuple[List[date], List[Apunte], List[Apunte]]:
+    """Parcial de un CSV de facturas: fechas y apuntes ordenados por fecha, y los sin fecha."""
+    indice = IndiceLibro()
+    indice.añadir(leer_facturas_csv(archivo), tipo)
+    return indice.parcial(tipo)
+
+def cargar_indice(
+    facturas_emitidas: str = None,
+    facturas_recibidas: str = None,
+    cache=None
+) -> IndiceLibro:
+    """
+    Lee los CSV de facturas emitidas (ingresos) y recibidas (gastos) en un
+    IndiceLibro. Con `cache` (ver cache.py), los CSV sin cambios no se releen.
+    """
+    indice = IndiceLibro()
+    for archivo, tipo in ((facturas_emitidas, 'ingreso'), (facturas_recibidas, 'gasto')):
+        if not archivo:
+            continue
+        if cache is not None and os.path.exists(archivo):
+            parcial = cache.obtener(archivo, ('generar_libro', tipo), lambda: apuntes_archivo(archivo, tipo))
+        else:
+            parcial = apuntes_archivo(archivo, tipo)
+        indice.fusionar(tipo, parcial)
+    return indice
+
+def periodo_libro(
+    año: int = None,
+    trimestre: int = None,
+    mes: int = None,
+    desde: date = None,
+    hasta: date = None
+) -> Dict:
+    """
+    Periodo de un libro: un trimestre, un mes, el año entero (sin trimestre
+    ni mes) o un rango de fechas [desde, hasta], ambas incluidas.
+    """
+    if desde is not None or hasta is not None:
+        desde = desde or date(año, 1, 1)
+        hasta = hasta or date(año, 12, 31)
+        descripcion = f'{desde.isoformat()} a {hasta.isoformat()}'
+        inicio, fin = desde, hasta + timedelta(days=1)
+    elif mes is not None:
+        inicio, fin = rango_mes(mes, año)
+        descripcion = f'{mes:02d}/{año}'
+    else:
+        inicio, fin = rango_trimestre(trimestre, año)
+        descripcion = f'{trimestre}T {año}' if trimestre else f'Año {año}'
+    return {
+        'trimestre': trimestre,
+        'mes': mes,
+        'año': año if año is not None else inicio.year,
+        'descripcion': descripcion,
+        'desde': inicio.isoformat(),
+        'hasta': (fin - timedelta(days=1)).isoformat(),
+    }
+
+def limites_periodo(periodo: Dict) -> Tuple[date, date]:
+    """[inicio, fin) de un periodo de periodo_libro."""
+    return date.fromisoformat(periodo['desde']), date.fromisoformat(periodo['hasta']) + timedelta(days=1)
+
+class TotalesLibro:
+    """
+    Totales de un libro: bases exactas (Decimal), cuotas y retenciones en
+    céntimos. Se suman de golpe (sumar) o apunte a apunte (añadir, al
+    escribir el libro en streaming).
+    """
+    
+    def __init__(self):
+        self.num_facturas = {'ingreso': 0, 'gasto': 0}
+        self.base = {'ingreso': Decimal('0'), 'gasto': Decimal('0')}
+        self.cuota_iva = {'ingreso': 0, 'gasto': 0}
+        self.retencion = {'ingreso': 0, 'gasto': 0}
+    
+    def sumar(self, tipo: str, apuntes: List[Apunte]):
+        self.num_facturas[tipo] += len(apuntes)
+        self.base[tipo] += sum((f.base_imponible for f in apuntes), Decimal('0'))
+        self.cuota_iva[tipo] += sum(f.cuota_iva for f in apuntes)
+        self.retencion[tipo] += sum(f.retencion for f in apuntes)
+    
+    def añadir(self, apunte: Apunte):
+        tipo = apunte.tipo
+        self.num_facturas[tipo] += 1
+        self.base[tipo] += apunte.base_imponible
+        self.cuota_iva[tipo] += apunte.cuota_iva
+        self.retencion[tipo] += apunte.retencion
+    
+    def resumen(self) -> Dict:
+        """Sección 'resumen' del libro."""
+        base, iva = self.base, self.cuota_iva
+        return {
+            'ingresos': {
+                'num_facturas': self.num_facturas['ingreso'],
+                'base_imponible': str(redondear_centimos(base['ingreso'])),
+                'iva_repercutido': a_texto(iva['ingreso']),
+                'retenciones': a_texto(self.retencion['ingreso'])
+            },
+            'gastos': {
+                'num_facturas': self.num_facturas['gasto'],
+                'base_imponible': str(redondear_centimos(base['gasto'])),
+                'iva_soportado': a_texto(iva['gasto'])
+            },
+            'liquidacion': {
+                'rendimiento_neto': str(redondear_centimos(base['ingreso'] - base['gasto'])),
+                'iva_a_liquidar': a_texto(iva['ingreso'] - iva['gasto'])
+            }
+        }
+
+def libro_periodo(indice: IndiceLibro, periodo: Dict) -> Dict:
+    """
+    Libro de ingresos y gastos de un periodo (ver periodo_libro).
+    
+    Returns:
+        Libro completo con ingresos, gastos (registros.Apunte) y resúmenes;
+        json.dumps(libro, default=serializar) escribe los apuntes como dicts
+    """
+    inicio, fin = limites_periodo(periodo)
+    ingresos = indice.entre('ingreso', inicio, fin)
+    gastos = indice.entre('gasto', inicio, fin)
+    
+    totales = TotalesLibro()
+    totales.sumar('ingreso', ingresos)
+    totales.sumar('gasto', gastos)
     
     return {
-        'tipo': tipo,
-        'numero': row.get('numero', ''),
-        'fecha': row.get('fecha', ''),
-        'nif': row.get('nif', ''),
-        'nombre': row.get('nombre', row.get('concepto', '')),
-        'concepto': row.get('concepto', ''),
-        'base_imponible': str(base),
-        'tipo_iva': str(iva_pct),
-        'cuota_iva': str(iva),
-        'tipo_retencion': str(ret_pct),
-        'retencion': str(retencion),
-        'total': str(total)
+        'periodo': periodo,
+        'ingresos': ingresos,
+        'gastos': gastos,
+        'resumen': totales.resumen(),
+        'sin_fecha': indice.sin_fecha['ingreso'] + indice.sin_fecha['gasto'],
+        'fecha_generacion': datetime.now().isoformat()
     }
 
 def generar_libro(
     trimestre: int,
     año: int,
     facturas_emitidas: str = None,
-    facturas_recibidas: str = None
+    facturas_recibidas: str = None,
+    indice: IndiceLibro = None
 ) -> Dict:
     """
-    Genera el libro de ingresos y gastos.
+    Genera el libro de ingresos y gastos de un trimestre.
     
     Args:
-        trimestre: 1-4
+        trimestre: 1-4 (None: año completo)
         año: Año fiscal
         facturas_emitidas: Ruta CSV facturas emitidas
         facturas_recibidas: Ruta CSV facturas recibidas
+        indice: IndiceLibro ya cargado (para varios periodos de una sola lectura)
     
     Returns:
-        Libro completo con ingresos, gastos y resúmenes
+        Libro completo con ingresos, gastos y resúmenes (ver libro_periodo)
     """
-    libro = {
-        'periodo': {
-            'trimestre': trimestre,
-            'año': año,
-            'descripcion': f'{trimestre}T {año}'
-        },
-        'ingresos': [],
-        'gastos': [],
-        'resumen': {},
-        'fecha_generacion': datetime.now().isoformat()
-    }
+    if indice is None:
+        indice = cargar_indice(facturas_emitidas, facturas_recibidas)
+    return libro_periodo(indice, periodo_libro(año, trimestre))
+
+class EscritorCSV:
+    """
+    Libro en CSV, fila a fila: cabecera al crearlo, una sección por tipo
+    (seccion) con sus apuntes (apunte) y el resumen al cerrar (cerrar).
+    """
+    TITULOS = {'ingreso': '=== INGRESOS (FACTURAS EMITIDAS) ===', 'gasto': '=== GASTOS (FACTURAS RECIBIDAS) ==='}
+    COLUMNAS = ['Número', 'Fecha', 'NIF', 'Concepto', 'Base Imponible', 'Tipo IVA', 'Cuota IVA', 'Retención', 'Total']
     
-    # Totales
-    total_ingresos_base = Decimal('0')
-    total_ingresos_iva = Decimal('0')
-    total_ingresos_retencion = Decimal('0')
-    total_gastos_base = Decimal('0')
-    total_gastos_iva = Decimal('0')
+    def __init__(self, f: IO[str], periodo: Dict):
+        self.writer = csv.writer(f)
+        self.writer.writerow(['LIBRO DE INGRESOS Y GASTOS'])
+        self.writer.writerow([f'Periodo: {periodo["descripcion"]}'])
     
-    # Procesar facturas emitidas (ingresos)
-    if facturas_emitidas:
-        rows = leer_facturas_csv(facturas_emitidas)
-        for row in rows:
-            factura = procesar_factura(row, 'ingreso')
-            libro['ingresos'].append(factura)
-            total_ingresos_base += Decimal(factura['base_imponible'])
-            total_ingresos_iva += Decimal(factura['cuota_iva'])
-            total_ingresos_retencion += Decimal(factura['retencion'])
-    
-    # Procesar facturas recibidas (gastos)
-    if facturas_recibidas:
-        rows = leer_facturas_csv(facturas_recibidas)
-        for row in rows:
-            factura = procesar_factura(row, 'gasto')
-            libro['gastos'].append(factura)
-            total_gastos_base += Decimal(factura['base_imponible'])
-            total_gastos_iva += Decimal(factura['cuota_iva'])
-    
-    # Calcular resúmenes
-    libro['resumen'] = {
-        'ingresos': {
-            'num_facturas': len(libro['ingresos']),
-            'base_imponible': str(redondear_centimos(total_ingresos_base)),
-            'iva_repercutido': str(redondear_centimos(total_ingresos_iva)),
-            'retenciones': str(redondear_centimos(total_ingresos_retencion))
-        },
-        'gastos': {
-            'num_facturas': len(libro['gastos']),
-            'base_imponible': str(redondear_centimos(total_gastos_base)),
-            'iva_soportado': str(redondear_centimos(total_gastos_iva))
-        },
-        'liquidacion': {
-            'rendimiento_neto': str(redondear_centimos(total_ingresos_base - total_gastos_base)),
-            'iva_a_liquidar': str(redondear_centimos(total_ingresos_iva - total_gastos_iva))
-        }
-    }
+    def seccion(self, tipo: str):
+        self.writer.writerow([])
+        self.writer.writerow([self.TITULOS[tipo]])
+        self.writer.writerow(self.COLUMNAS)
     
-    return libro
+    def apunte(self, f: Apunte):
+        self.writer.writerow([
+            f.numero, f.fecha, f.nif, f.concepto,
+            f.base_imponible, f.tipo_iva, a_texto(f.cuota_iva),
+            a_texto(f.retencion), a_texto(f.total)
+        ])
+    
+    def cerrar(self, resumen: Dict, sin_fecha: int):
+        r = resumen
+        self.writer.writerow([])
+        self.writer.writerow(['=== RESUMEN ==='])
+        self.writer.writerow(['Total ingresos (base)', r['ingresos']['base_imponible']])
+        self.writer.writerow(['IVA repercutido', r['ingresos']['iva_repercutido']])
+        self.writer.writerow(['Retenciones practicadas', r['ingresos']['retenciones']])
+        self.writer.writerow(['Total gastos (base)', r['gastos']['base_imponible']])
+        self.writer.writerow(['IVA soportado', r['gastos']['iva_soportado']])
+        self.writer.writerow(['Rendimiento neto', r['liquidacion']['rendimiento_neto']])
+        self.writer.writerow(['IVA a liquidar', r['liquidacion']['iva_a_liquidar']])
+
+class EscritorNDJSON:
+    """
+    Libro en NDJSON (un objeto JSON por línea): {"periodo": ...}, un apunte
+    por línea (con su 'tipo') y al final {"resumen": ..., "sin_fecha": N, ...}.
+    """
+    
+    def __init__(self, f: IO[str], periodo: Dict):
+        self.f = f
+        self._linea({'periodo': periodo})
+    
+    def _linea(self, objeto):
+        self.f.write(json.dumps(objeto, ensure_ascii=False) + '\n')
+    
+    def seccion(self, tipo: str):
+        pass
+    
+    def apunte(self, f: Apunte):
+        self._linea(f.a_dict())
+    
+    def cerrar(self, resumen: Dict, sin_fecha: int):
+        self._linea({'resumen': resumen, 'sin_fecha': sin_fecha, 'fecha_generacion': datetime.now().isoformat()})
+
+ESCRITORES = {'csv': EscritorCSV, 'ndjson': EscritorNDJSON}
+
+def formato_archivo(archivo: str) -> str:
+    """'ndjson' para .ndjson/.jsonl, 'csv' para el resto."""
+    return 'ndjson' if os.path.splitext(archivo)[1].lower() in ('.ndjson', '.jsonl') else 'csv'
+
+def escribir_libro(libro: Dict, escritor):
+    """Escribe un libro ya calculado (libro_periodo) apunte a apunte."""
+    for tipo, apuntes in (('ingreso', libro['ingresos']), ('gasto', libro['gastos'])):
+        escritor.seccion(tipo)
+        for apunte in apuntes:
+            escritor.apunte(apunte)
+    escritor.cerrar(libro['resumen'], len(libro['sin_fecha']))
 
 def exportar_csv(libro: Dict, archivo: str):
-    """Exporta el libro a formato CSV."""
+    """Exporta el libro a formato CSV (o NDJSON si el archivo es .ndjson/.jsonl)."""
     with open(archivo, 'w', encoding='utf-8', newline='') as f:
-        writer = csv.writer(f)
-        
-        # Cabecera
-        writer.writerow(['LIBRO DE INGRESOS Y GASTOS'])
-        writer.writerow([f'Periodo: {libro["periodo"]["descripcion"]}'])
-        writer.writerow([])
-        
-        # Ingresos
-        writer.writerow(['=== INGRESOS (FACTURAS EMITIDAS) ==='])
-        writer.writerow(['Número', 'Fecha', 'NIF', 'Concepto', 'Base Imponible', 'Tipo IVA', 'Cuota IVA', 'Retención', 'Total'])
-        for f in libro['ingresos']:
-            writer.writerow([
-                f['numero'], f['fecha'], f['nif'], f['concepto'],
-                f['base_imponible'], f['tipo_iva'], f['cuota_iva'],
-                f['retencion'], f['total']
-            ])
-        writer.writerow([])
-        
-        # Gastos
-        writer.writerow(['=== GASTOS (FACTURAS RECIBIDAS) ==='])
-        writer.writerow(['Número', 'Fecha', 'NIF', 'Concepto', 'Base Imponible', 'Tipo IVA', 'Cuota IVA', 'Retención', 'Total'])
-        for f in libro['gastos']:
-            writer.writerow([
-                f['numero'], f['fecha'], f['nif'], f['concepto'],
-                f['base_imponible'], f['tipo_iva'], f['cuota_iva'],
-                f['retencion'], f['total']
-            ])
-        writer.writerow([])
-        
-        # Resumen
-        writer.writerow(['=== RESUMEN ==='])
-        r = libro['resumen']
-        writer.writerow(['Total ingresos (base)', r['ingresos']['base_imponible']])
-        writer.writerow(['IVA repercutido', r['ingresos']['iva_repercutido']])
-        writer.writerow(['Retenciones practicadas', r['ingresos']['retenciones']])
-        writer.writerow(['Total gastos (base)', r['gastos']['base_imponible']])
-        writer.writerow(['IVA soportado', r['gastos']['iva_soportado']])
-        writer.writerow(['Rendimiento neto', r['liquidacion']['rendimiento_neto']])
-        writer.writerow(['IVA a liquidar', r['liquidacion']['iva_a_liquidar']])
+        escribir_libro(libro, ESCRITORES[formato_archivo(archivo)](f, libro['periodo']))
+
+def libros_streaming(
+    periodos: List[Dict],
+    escritores: List[Optional[object]],
+    facturas_emitidas: str = None,
+    facturas_recibidas: str = None
+) -> Tuple[List[TotalesLibro], int]:
+    """
+    Libros de varios periodos en una sola pasada por los CSV, sin cargarlos:
+    cada factura se calcula, se escribe en los libros de los periodos que la
+    contienen y se suma a sus totales. Los resúmenes se escriben al final.
+    Memoria constante, pero los apuntes salen en el orden de los CSV (no se
+    ordenan por fecha como en IndiceLibro).
+    
+    Args:
+        escritores: EscritorCSV/EscritorNDJSON por periodo (None: solo totales)
+    
+    Returns:
+        (TotalesLibro por periodo, número de facturas sin fecha válida)
+    """
+    limites = [limites_periodo(periodo) for periodo in periodos]
+    totales = [TotalesLibro() for _ in periodos]
+    destinos = [(inicio, fin, escritor, total)
+                for (inicio, fin), escritor, total in zip(limites, escritores, totales)]
+    sin_fecha = 0
+    for archivo, tipo in ((facturas_emitidas, 'ingreso'), (facturas_recibidas, 'gasto')):
+        for escritor in escritores:
+            if escritor is not None:
+                escritor.seccion(tipo)
+        if not archivo:
+            continue
+        leer_fecha = crear_lector_fechas()
+        for row in iterar_facturas_csv(archivo):
+            apunte = procesar_factura(row, tipo)
+            fecha = leer_fecha(apunte.fecha)
+            if fecha is None:
+                sin_fecha += 1
+                continue
+            for inicio, fin, escritor, total in destinos:
+                if inicio <= fecha < fin:
+                    total.añadir(apunte)
+                    if escritor is not None:
+                        escritor.apunte(apunte)
+    for escritor, total in zip(escritores, totales):
+        if escritor is not None:
+            escritor.cerrar(total.resumen(), sin_fecha)
+    return totales, sin_fecha
+
+def imprimir_resumen(libro: Dict):
+    """Resumen del libro en terminal."""
+    print("\n" + "="*60)
+    print(f"   LIBRO DE INGRESOS Y GASTOS - {libro['periodo']['descripcion']}")
+    print("="*60)
+    
+    r = libro['resumen']
+    
+    print(f"\n📈 INGRESOS ({r['ingresos']['num_facturas']} facturas):")
+    print(f"   Base imponible:     {float(r['ingresos']['base_imponible']):>12,.2f} €")
+    print(f"   IVA repercutido:    {float(r['ingresos']['iva_repercutido']):>12,.2f} €")
+    print(f"   Retenciones:        {float(r['ingresos']['retenciones']):>12,.2f} €")
+    
+    print(f"\n📉 GASTOS ({r['gastos']['num_facturas']} facturas):")
+    print(f"   Base imponible:     {float(r['gastos']['base_imponible']):>12,.2f} €")
+    print(f"   IVA soportado:      {float(r['gastos']['iva_soportado']):>12,.2f} €")
+    
+    print("\n" + "-"*60)
+    print("📊 LIQUIDACIÓN:")
+    rn = float(r['liquidacion']['rendimiento_neto'])
+    iva = float(r['liquidacion']['iva_a_liquidar'])
+    print(f"   Rendimiento neto:   {rn:>12,.2f} €")
+    if iva >= 0:
+        print(f"   IVA a ingresar:     {iva:>12,.2f} €")
+    else:
+        print(f"   IVA a compensar:    {iva:>12,.2f} €")
+    print("="*60 + "\n")
+
+def archivo_periodo(archivo: str, periodo: Dict) -> str:
+    """libro.csv → libro_2025-04-01_2025-06-30.csv (un archivo por periodo)."""
+    nombre, extension = os.path.splitext(archivo)
+    return f"{nombre}_{periodo['desde']}_{periodo['hasta']}{extension}"
+
+def instrumentar(perfil: perfilado.Perfil):
+    """Cronometra lectura, proceso por factura, libro por periodo y exportación (solo con --profile)."""
+    global leer_facturas_csv, procesar_factura, cargar_indice, libro_periodo, exportar_csv, libros_streaming
+    leer_facturas_csv = perfil.cronometrar('leer_facturas_csv', leer_facturas_csv)
+    procesar_factura = perfil.cronometrar('procesar_factura', procesar_factura, por_fila=True)
+    cargar_indice = perfil.cronometrar('cargar_indice', cargar_indice)
+    libro_periodo = perfil.cronometrar('libro_periodo', libro_periodo)
+    exportar_csv = perfil.cronometrar('exportar_csv', exportar_csv)
+    libros_streaming = perfil.cronometrar('libros_streaming', libros_streaming)
 
 def main():
     parser = argparse.ArgumentParser(
@@ -186,71 +441,132 @@ Ejemplos de uso:
   # Solo con facturas emitidas:
   python3 generar_libro.py --trimestre 2 --año 2024 --facturas-emitidas ventas.csv
   
-  # Exportar a CSV:
+  # Los cuatro trimestres (una sola lectura de los CSV), un mes o un rango:
+  python3 generar_libro.py --trimestre 1 2 3 4 --año 2024 --facturas-emitidas ventas.csv
+  python3 generar_libro.py --mes 5 --año 2024 --facturas-emitidas ventas.csv
+  python3 generar_libro.py --desde 2024-03-15 --hasta 2024-05-31 --facturas-emitidas ventas.csv
+  
+  # Exportar a CSV (con varios periodos, un archivo por periodo; .ndjson/.jsonl: NDJSON):
   python3 generar_libro.py --trimestre 1 --año 2024 --facturas-emitidas f.csv --exportar libro.csv
+  
+  # Libro anual enorme con memoria constante (fila a fila, en el orden de los CSV):
+  python3 generar_libro.py --año 2024 --facturas-emitidas f.csv --streaming --exportar libro.csv
+  python3 generar_libro.py --año 2024 --facturas-emitidas f.csv --streaming --ndjson > libro.ndjson
 
 Formato CSV esperado (con cabecera):
 numero,fecha,nif,concepto,base_imponible,tipo_iva,tipo_retencion
         """
     )
     
-    parser.add_argument('--trimestre', type=int, required=True, choices=[1, 2, 3, 4], help='Trimestre (1-4)')
-    parser.add_argument('--año', type=int, required=True, help='Año fiscal')
+    parser.add_argument('--trimestre', type=int, nargs='+', choices=[1, 2, 3, 4],
+                        help='Trimestre(s) (1-4). Sin trimestre, mes ni rango: año completo')
+    parser.add_argument('--mes', type=int, nargs='+', choices=range(1, 13), metavar='MES',
+                        help='Mes(es) (1-12)')
+    parser.add_argument('--desde', type=date.fromisoformat, help='Inicio del rango (YYYY-MM-DD, incluido)')
+    parser.add_argument('--hasta', type=date.fromisoformat, help='Fin del rango (YYYY-MM-DD, incluido)')
+    parser.add_argument('--año', type=int, help='Año fiscal')
     parser.add_argument('--facturas-emitidas', type=str, help='CSV de facturas emitidas')
     parser.add_argument('--facturas-recibidas', type=str, help='CSV de facturas recibidas')
-    parser.add_argument('--exportar', type=str, help='Exportar a archivo CSV')
+    parser.add_argument('--exportar', type=str, help='Exportar a archivo CSV (NDJSON si termina en .ndjson o .jsonl)')
     parser.add_argument('--json', action='store_true', help='Salida en formato JSON')
+    parser.add_argument('--ndjson', action='store_true', help='Salida en NDJSON: un apunte por línea, resumen al final')
+    parser.add_argument('--streaming', action='store_true',
+                        help='Escribir cada factura al leerla, sin cargar los CSV (memoria constante; '
+                             'los apuntes quedan en el orden de los CSV)')
+    perfilado.añadir_argumento(parser)
+    cache.añadir_argumento(parser)
     
     args = parser.parse_args()
     
     if not args.facturas_emitidas and not args.facturas_recibidas:
         parser.error("Debe proporcionar al menos --facturas-emitidas o --facturas-recibidas")
+    rango = args.desde is not None or args.hasta is not None
+    if args.año is None and not (args.desde and args.hasta):
+        parser.error("Debe indicar --año (o un rango completo con --desde y --hasta)")
+    if args.desde and args.hasta and args.desde > args.hasta:
+        parser.error("--desde es posterior a --hasta")
+    if args.json and args.ndjson:
+        parser.error("--json y --ndjson son excluyentes")
+    if args.streaming and args.json:
+        parser.error("--streaming no admite --json (use --ndjson)")
+    if args.streaming and args.ndjson and args.exportar:
+        parser.error("--streaming escribe en --exportar o en la salida con --ndjson, no en ambos")
+    
+    periodos = [periodo_libro(args.año, trimestre=t) for t in args.trimestre or []]
+    periodos += [periodo_libro(args.año, mes=m) for m in args.mes or []]
+    if rango:
+        periodos.append(periodo_libro(args.año, desde=args.desde, hasta=args.hasta))
+    if not periodos:
+        periodos.append(periodo_libro(args.año))
+    if args.streaming and args.ndjson and len(periodos) > 1:
+        parser.error("--streaming --ndjson admite un solo periodo (use --exportar: un archivo por periodo)")
+    
+    def archivo_exportacion(periodo: Dict) -> str:
+        return args.exportar if len(periodos) == 1 else archivo_periodo(args.exportar, periodo)
+    
+    perfil = perfilado.crear(args.profile)
+    if perfil is not None:
+        instrumentar(perfil)
     
     try:
-        libro = generar_libro(
-            trimestre=args.trimestre,
-            año=args.año,
-            facturas_emitidas=args.facturas_emitidas,
-            facturas_recibidas=args.facturas_recibidas
-        )
+        if args.streaming:
+            with ExitStack() as archivos:
+                escritores = []
+                for periodo in periodos:
+                    if args.exportar:
+                        archivo = archivo_exportacion(periodo)
+                        f = archivos.enter_context(open(archivo, 'w', encoding='utf-8', newline=''))
+                        escritores.append(ESCRITORES[formato_archivo(archivo)](f, periodo))
+                    elif args.ndjson:
+                        escritores.append(EscritorNDJSON(sys.stdout, periodo))
+                    else:
+                        escritores.append(None)
+                totales, sin_fecha = libros_streaming(periodos, escritores, args.facturas_emitidas,
+                                                      args.facturas_recibidas)
+            if sin_fecha:
+                print(f"Advertencia: {sin_fecha} factura(s) sin fecha válida, fuera de todos los periodos",
+                      file=sys.stderr)
+            for periodo, total in zip(periodos, totales):
+                if args.exportar:
+                    print(f"\n✅ Libro exportado a: {archivo_exportacion(periodo)}\n")
+                elif not args.ndjson:
+                    imprimir_resumen({'periodo': periodo, 'resumen': total.resumen()})
+            return
+        
+        indice = cargar_indice(args.facturas_emitidas, args.facturas_recibidas, cache.crear(args.cache and not args.no_cache))
+        libros = [libro_periodo(indice, periodo) for periodo in periodos]
+        
+        sin_fecha = len(libros[0]['sin_fecha'])
+        if sin_fecha:
+            print(f"Advertencia: {sin_fecha} factura(s) sin fecha válida, fuera de todos los periodos",
+                  file=sys.stderr)
         
         if args.exportar:
-            exportar_csv(libro, args.exportar)
-            print(f"\n✅ Libro exportado a: {args.exportar}\n")
+            for libro in libros:
+                archivo = archivo_exportacion(libro['periodo'])
+                exportar_csv(libro, archivo)
+                print(f"\n✅ Libro exportado a: {archivo}\n")
         
         if args.json:
-            print(json.dumps(libro, indent=2, ensure_ascii=False))
+            # json.dump escribe por trozos: no se construye la cadena entera
+            with perfilado.etapa(perfil, 'salida_json'):
+                json.dump(libros[0] if len(libros) == 1 else libros, sys.stdout,
+                          indent=2, ensure_ascii=False, default=serializar)
+                print()
+        elif args.ndjson:
+            for libro in libros:
+                escribir_libro(libro, EscritorNDJSON(sys.stdout, libro['periodo']))
         elif not args.exportar:
-            # Mostrar resumen en terminal
-            print("\n" + "="*60)
-            print(f"   LIBRO DE INGRESOS Y GASTOS - {libro['periodo']['descripcion']}")
-            print("="*60)
-            
-            r = libro['resumen']
-            
-            print(f"\n📈 INGRESOS ({r['ingresos']['num_facturas']} facturas):")
-            print(f"   Base imponible:     {float(r['ingresos']['base_imponible']):>12,.2f} €")
-            print(f"   IVA repercutido:    {float(r['ingresos']['iva_repercutido']):>12,.2f} €")
-            print(f"   Retenciones:        {float(r['ingresos']['retenciones']):>12,.2f} €")
-            
-            print(f"\n📉 GASTOS ({r['gastos']['num_facturas']} facturas):")
-            print(f"   Base imponible:     {float(r['gastos']['base_imponible']):>12,.2f} €")
-            print(f"   IVA soportado:      {float(r['gastos']['iva_soportado']):>12,.2f} €")
-            
-            print("\n" + "-"*60)
-            print("📊 LIQUIDACIÓN:")
-            rn = float(r['liquidacion']['rendimiento_neto'])
-            iva = float(r['liquidacion']['iva_a_liquidar'])
-            print(f"   Rendimiento neto:   {rn:>12,.2f} €")
-            if iva >= 0:
-                print(f"   IVA a ingresar:     {iva:>12,.2f} €")
-            else:
-                print(f"   IVA a compensar:    {iva:>12,.2f} €")
-            print("="*60 + "\n")
-            
+            for libro in libros:
+                imprimir_resumen(libro)
+    
     except Exception as e:
         print(f"Error: {e}", file=sys.stderr)
         sys.exit(1)
+    
+    finally:
+        if perfil is not None:
+            perfil.emitir(args.profile)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+Punto de entrada único de los scripts: gestor <subcomando> [opciones].
+    
+    gestor iva --iva-repercutido 500 --iva-soportado 200
+    gestor stripe --archivo pagos.csv --trimestre 4 --año 2025 --json
+
+Cada subcomando importa solo su script y le pasa las opciones tal cual
+(`gestor iva --help` es la ayuda de calcular_iva.py); este módulo no
+importa nada más que sys. El programador de tareas lanza miles de
+invocaciones en un cierre, así que el arranque de cada subcomando tiene un
+presupuesto (ARRANQUE_MS) que `gestor --arranque` comprueba con
+`python -X importtime`:
+    
+    gestor --arranque            # tabla y código de salida 1 si alguno se pasa
+    gestor --arranque iva stripe
+"""
+
+import sys
+
+# subcomando → (script, descripción)
+SUBCOMANDOS = {
+    'iva': ('calcular_iva', 'Modelo 303: IVA trimestral'),
+    'irpf': ('calcular_irpf', 'Modelo 130: pago fraccionado del IRPF'),
+    'facturas': ('procesar_facturas', 'Facturas de un CSV y validación de NIF/NIE/CIF'),
+    'libro': ('generar_libro', 'Libro de ingresos y gastos'),
+    'stripe': ('procesar_stripe', 'Pagos de Stripe/Substack: IVA por país, fees, 303 y 130'),
+    'ejercicio': ('calcular_ejercicio', '303 y 130 de todo el año encadenados'),
+    'escenarios': ('escenarios_130', 'Modelo 130 de una rejilla de ingresos, gastos y retenciones'),
+    'conciliar': ('conciliar', 'Pagos de Stripe/Substack frente a facturas emitidas'),
+    'duplicados': ('duplicados', 'Pagos repetidos entre exportaciones (índice en disco)'),
+    'conta': ('contabilidad', 'Almacén SQLite: importar y consultar trimestres'),
+    'servidor': ('servidor', 'Servidor local HTTP/JSON con los cálculos'),
+}
+
+# Presupuesto de importación de cada subcomando, en ms (-X importtime, con
+# los .pyc compilados). argparse, re, decimal, json y datetime ya suman unos
+# 20 ms; lo que importe de más un script tiene que ir dentro de la función
+# que lo usa (concurrent.futures, tempfile, tracemalloc, numpy...).
+ARRANQUE_MS = {
+    'iva': 45,
+    'irpf': 45,
+    'facturas': 55,
+    'libro': 55,
+    'stripe': 55,
+    'ejercicio': 50,
+    'escenarios': 50,
+    'conciliar': 55,
+    'duplicados': 55,
+    'conta': 55,
+    'servidor': 150,
+}
+
+def ayuda() -> str:
+    lineas = ['uso: gestor <subcomando> [opciones]   (gestor <subcomando> --help: opciones de cada uno)', '',
+              'subcomandos:']
+    lineas += [f'  {nombre:<11}{descripcion}' for nombre, (_, descripcion) in SUBCOMANDOS.items()]
+    lineas += ['', '  --arranque [SUBCOMANDO...]  comprobar el tiempo de importación de cada subcomando']
+    return '\n'.join(lineas)
+
+def medir_arranque(script: str, repeticiones: int = 5) -> float:
+    """ms de `import script` según -X importtime (el mínimo de varias ejecuciones)."""
+    import os
+    import subprocess
+    directorio = os.path.dirname(os.path.abspath(__file__))
+    mejor = None
+    for _ in range(repeticiones):
+        salida = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {script}'],
+                                cwd=directorio, capture_output=True, text=True, check=True)
+        # "import time: propio | acumulado | nombre": la línea sin sangría del script
+        for linea in salida.stderr.splitlines():
+            campos = linea.split('|')
+            if len(campos) == 3 and campos[2] == f' {script}':
+                microsegundos = int(campos[1])
+                mejor = microsegundos if mejor is None else min(mejor, microsegundos)
+    if mejor is None:
+        raise RuntimeError(f'-X importtime no dio el tiempo de {script}')
+    return mejor / 1000
+
+def comprobar_arranque(argumentos) -> int:
+    """Mide cada subcomando contra ARRANQUE_MS. Returns: 0, o 1 si alguno se pasa."""
+    import argparse
+    import compileall
+    import os
+    parser = argparse.ArgumentParser(prog='gestor --arranque',
+                                     description='Tiempo de importación de cada subcomando frente a su presupuesto')
+    parser.add_argument('subcomandos', nargs='*', metavar='SUBCOMANDO', help='Default: todos')
+    parser.add_argument('--repeticiones', type=int, default=5, help='Se toma la mejor de N ejecuciones (default: 5)')
+    args = parser.parse_args(argumentos)
+    for nombre in args.subcomandos:
+        if nombre not in SUBCOMANDOS:
+            parser.error(f"subcomando desconocido '{nombre}' (hay: {', '.join(SUBCOMANDOS)})")
+    
+    # Como en uso normal: con los .pyc ya escritos (la primera ejecución los compila)
+    compileall.compile_dir(os.path.dirname(os.path.abspath(__file__)), maxlevels=0, quiet=1)
+    
+    excedidos = 0
+    print(f"{'subcomando':<12}{'script':<20}{'ms':>8}{'presupuesto':>13}")
+    for nombre in args.subcomandos or SUBCOMANDOS:
+        script = SUBCOMANDOS[nombre][0]
+        ms = medir_arranque(script, args.repeticiones)
+        excede = ms > ARRANQUE_MS[nombre]
+        excedidos += excede
+        print(f"{nombre:<12}{script:<20}{ms:>8.1f}{ARRANQUE_MS[nombre]:>13}{'  ❌ EXCEDE' if excede else '  ✅'}")
+    return 1 if excedidos else 0
+
+def main(argumentos=None) -> int:
+    argumentos = sys.argv[1:] if argumentos is None else argumentos
+    if not argumentos or argumentos[0] in ('-h', '--help'):
+        print(ayuda(), file=sys.stdout if argumentos else sys.stderr)
+        return 0 if argumentos else 2
+    if argumentos[0] == '--arranque':
+        return comprobar_arranque(argumentos[1:])
+    
+    subcomando, *resto = argumentos
+    if subcomando not in SUBCOMANDOS:
+        print(f"gestor: subcomando desconocido '{subcomando}'\n\n{ayuda()}", file=sys.stderr)
+        return 2
+    script = __import__(SUBCOMANDOS[subcomando][0])
+    # El script lee sys.argv: su ayuda y sus errores salen como 'gestor <subcomando>'
+    sys.argv = [f'gestor {subcomando}', *resto]
+    return script.main()
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,179 @@
+"""
+Perfilado por etapas (--profile) compartido por todos los scripts.
+
+Sin --profile no se instrumenta nada: las funciones del bucle por fila son
+las originales y etapa() devuelve un contexto vacío. Con --profile, cada
+script sustituye sus funciones de cada etapa (lectura, parseo, acumulación...)
+por versiones cronometradas y al final se imprime por stderr, como tabla o
+JSON, el tiempo de cada etapa, filas/s, el pico de memoria (tracemalloc) y
+las filas más lentas. tracemalloc hace más lenta cada asignación de
+memoria: los tiempos con --profile sirven para comparar etapas entre sí,
+no con una ejecución normal.
+"""
+
+import heapq
+import json
+import sys
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Callable, Dict, Iterator, List, Optional
+
+FILAS_LENTAS = 5
+
+class Perfil:
+    """Tiempos por etapa de una ejecución."""
+    
+    def __init__(self, filas_lentas: int = FILAS_LENTAS):
+        # nombre → [segundos, segundos propios (sin etapas anidadas), llamadas, pico tracemalloc]
+        self.etapas: Dict[str, list] = {}
+        self.lentas: List[tuple] = []
+        self.filas_lentas = filas_lentas
+        self.filas = 0
+        self._pila: List[float] = []
+        self._pico = 0
+        # Sin --profile no se importa (arrastra linecache y tokenize al arranque)
+        import tracemalloc
+        self._tracemalloc = tracemalloc
+        tracemalloc.start()
+        self.inicio = time.perf_counter()
+    
+    def _etapa(self, nombre: str) -> list:
+        return self.etapas.setdefault(nombre, [0.0, 0.0, 0, None])
+    
+    def _terminar(self, etapa: list, duracion: float):
+        hijos = self._pila.pop()
+        if self._pila:
+            self._pila[-1] += duracion
+        etapa[0] += duracion
+        etapa[1] += duracion - hijos
+        etapa[2] += 1
+    
+    @contextmanager
+    def etapa(self, nombre: str):
+        """Cronometra un bloque y su pico de memoria."""
+        etapa = self._etapa(nombre)
+        self._pico = max(self._pico, self._tracemalloc.get_traced_memory()[1])
+        self._tracemalloc.reset_peak()
+        self._pila.append(0.0)
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._terminar(etapa, time.perf_counter() - inicio)
+            pico = self._tracemalloc.get_traced_memory()[1]
+            etapa[3] = max(etapa[3] or 0, pico)
+            self._pico = max(self._pico, pico)
+    
+    def cronometrar(self, nombre: str, funcion: Callable, por_fila: bool = False) -> Callable:
+        """
+        Versión cronometrada de `funcion`. Con por_fila=True cada llamada
+        cuenta como una fila y se guardan las más lentas (con su primer
+        argumento, que suele ser la fila).
+        """
+        etapa = self._etapa(nombre)
+        pila = self._pila
+        reloj = time.perf_counter
+        
+        def medida(*args, **kwargs):
+            pila.append(0.0)
+            inicio = reloj()
+            try:
+                return funcion(*args, **kwargs)
+            finally:
+                duracion = reloj() - inicio
+                self._terminar(etapa, duracion)
+                if por_fila:
+                    self.filas += 1
+                    self._anotar_fila(duracion, args)
+        return medida
+    
+    def cronometrar_iterador(self, nombre: str, funcion: Callable[..., Iterator]) -> Callable[..., Iterator]:
+        """Versión de un generador (p. ej. un lector) que cronometra cada next()."""
+        etapa = self._etapa(nombre)
+        
+        def medida(*args, **kwargs):
+            iterador = iter(funcion(*args, **kwargs))
+            while True:
+                self._pila.append(0.0)
+                inicio = time.perf_counter()
+                try:
+                    valor = next(iterador)
+                except StopIteration:
+                    return
+                finally:
+                    self._terminar(etapa, time.perf_counter() - inicio)
+                yield valor
+        return medida
+    
+    def _anotar_fila(self, duracion: float, args: tuple):
+        if len(self.lentas) < self.filas_lentas:
+            heapq.heappush(self.lentas, (duracion, self.filas, repr(args[0])[:200] if args else ''))
+        elif duracion > self.lentas[0][0]:
+            heapq.heapreplace(self.lentas, (duracion, self.filas, repr(args[0])[:200] if args else ''))
+    
+    def informe(self, filas: Optional[int] = None) -> Dict:
+        """
+        Tiempos por etapa (de mayor a menor). `filas`: filas procesadas, si
+        el script no las ha contado con cronometrar(..., por_fila=True).
+        """
+        total = time.perf_counter() - self.inicio
+        filas = self.filas if filas is None else filas
+        pico = max(self._pico, self._tracemalloc.get_traced_memory()[1])
+        etapas = []
+        for nombre, (segundos, propios, llamadas, pico_etapa) in sorted(
+                self.etapas.items(), key=lambda x: x[1][0], reverse=True):
+            if not llamadas:
+                continue
+            etapas.append({
+                'etapa': nombre,
+                'segundos': round(segundos, 6),
+                'segundos_propios': round(propios, 6),
+                'porcentaje': round(100 * segundos / total, 1) if total else None,
+                'llamadas': llamadas,
+                'filas_por_segundo': round(filas / segundos) if filas and segundos else None,
+                'pico_memoria_mb': round(pico_etapa / 2**20, 2) if pico_etapa is not None else None,
+            })
+        return {
+            'segundos': round(total, 6),
+            'filas': filas,
+            'filas_por_segundo': round(filas / total) if filas and total else None,
+            'pico_memoria_mb': round(pico / 2**20, 2),
+            'etapas': etapas,
+            'filas_lentas': [
+                {'fila': n, 'segundos': round(duracion, 6), 'datos': datos}
+                for duracion, n, datos in sorted(self.lentas, reverse=True)
+            ],
+        }
+    
+    def emitir(self, formato: str = 'texto', filas: Optional[int] = None):
+        """Imprime el informe por stderr (la salida normal no cambia)."""
+        informe = self.informe(filas)
+        self._tracemalloc.stop()
+        if formato == 'json':
+            print(json.dumps({'perfil': informe}, indent=2, ensure_ascii=False), file=sys.stderr)
+            return
+        print(f"\n⏱️  PERFIL: {informe['segundos']:.3f} s, {informe['filas']} filas"
+              f" ({informe['filas_por_segundo'] or '-'} filas/s), pico de memoria {informe['pico_memoria_mb']} MB",
+              file=sys.stderr)
+        print(f"   {'etapa':<28}{'s':>10}{'s propios':>11}{'%':>7}{'llamadas':>11}{'filas/s':>12}", file=sys.stderr)
+        for e in informe['etapas']:
+            print(f"   {e['etapa']:<28}{e['segundos']:>10.4f}{e['segundos_propios']:>11.4f}"
+                  f"{e['porcentaje'] or 0:>7.1f}{e['llamadas']:>11}{e['filas_por_segundo'] or '-':>12}",
+                  file=sys.stderr)
+        if informe['filas_lentas']:
+            print("   Filas más lentas:", file=sys.stderr)
+            for f in informe['filas_lentas']:
+                print(f"     #{f['fila']} {f['segundos'] * 1000:.3f} ms {f['datos']}", file=sys.stderr)
+
+def añadir_argumento(parser):
+    """Añade --profile [texto|json] a un ArgumentParser."""
+    parser.add_argument('--profile', nargs='?', const='texto', choices=['texto', 'json'],
+                        help='Tiempo por etapa, filas/s, pico de memoria y filas más lentas (stderr)')
+
+def crear(formato: Optional[str]) -> Optional[Perfil]:
+    """Perfil si se pidió --profile; None (sin ningún coste) si no."""
+    return Perfil() if formato else None
+
+def etapa(perfil: Optional[Perfil], nombre: str):
+    """Contexto que cronometra un bloque, o uno vacío sin perfil."""
+    return perfil.etapa(nombre) if perfil is not None else nullcontext()
@@ -7,12 +7,20 @@ Valida, calcula y genera resúmenes de facturas emitidas y recibidas.
 import argparse
 import csv
 import json
+import os
 import sys
-from decimal import Decimal, ROUND_HALF_UP
+from decimal import Decimal
 from datetime import datetime
-from typing import List, Dict, Optional
+from functools import lru_cache
+from itertools import islice
+from typing import List, Dict, Optional, Tuple, Iterable, Iterator
 import re
 
+from dinero import redondear as redondear_centimos, a_centimos, a_texto, porcentaje_de
+import cache
+import perfilado
+from registros import FacturaValidada, serializar, tipo_decimal
+
 # Tipos de IVA válidos en España
 TIPOS_IVA = {
     'general': Decimal('21'),
@@ -29,43 +37,176 @@ TIPOS_RETENCION = {
     'sin_retencion': Decimal('0')
 }
 
-def redondear_centimos(valor: Decimal) -> Decimal:
-    """Redondea a 2 decimales."""
-    return valor.quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+LETRAS_NIF = 'TRWAGMYFPDXBNJZSQVHLCKE'
+PATRON_NIF = re.compile(r'[0-9]{8}[A-Z]')
+PATRON_NIE = re.compile(r'[XYZ][0-9]{7}[A-Z]')
+PATRON_CIF = re.compile(r'[ABCDEFGHJKLMNPQRSUVW][0-9]{7}[0-9A-J]')
 
-def validar_nif(nif: str) -> dict:
-    """
-    Valida un NIF/NIE/CIF español.
-    Returns: dict con 'valido', 'tipo', y 'mensaje'
-    """
-    nif = nif.upper().replace(' ', '').replace('-', '')
+# CIF: el control es una letra (KPQRSNW), un dígito (ABEH) o cualquiera de los dos (resto)
+CIF_CONTROL_LETRA = frozenset('KPQRSNW')
+CIF_CONTROL_DIGITO = frozenset('ABEH')
+LETRAS_CONTROL_CIF = 'JABCDEFGHI'
+# Cada dígito de posición impar del CIF se sustituye por la suma de las cifras de su doble
+DOBLE_CIF = str.maketrans('0123456789', '0246813579')
+# NIE: la letra inicial cuenta como dígito delante del número
+PREFIJOS_NIE = {'X': 0, 'Y': 10_000_000, 'Z': 20_000_000}
+
+NIF_VALIDO = (True, 'NIF', 'NIF válido')
+NIE_VALIDO = (True, 'NIE', 'NIE válido')
+CIF_VALIDO = (True, 'CIF', 'CIF válido')
+FORMATO_NO_RECONOCIDO = (False, 'DESCONOCIDO', 'Formato no reconocido')
+
+# Con al menos tantos NIFs distintos, validar_lote usa NumPy (si está instalado)
+UMBRAL_VECTORIAL = 4096
+# NIFs por lote al validar un archivo o stdin (--validar-nifs)
+BLOQUE_NIFS = 65536
+
+np = None
+
+def cargar_numpy() -> bool:
+    """Importa NumPy la primera vez que hace falta. False si no está instalado."""
+    global np
+    if np is None:
+        try:
+            import numpy
+        except ImportError:
+            return False
+        np = numpy
+    return True
+
+def normalizar_nif(nif: str) -> str:
+    """Mayúsculas y sin espacios (tampoco al final de línea) ni guiones."""
+    return nif.strip().upper().replace(' ', '').replace('-', '')
+
+def control_cif(nif: str) -> int:
+    """Dígito de control (0-9) de un CIF: suma de pares + suma de cifras de impares × 2."""
+    suma = sum(map(int, nif[2:8:2] + nif[1:8:2].translate(DOBLE_CIF)))
+    return (10 - suma % 10) % 10
+
+@lru_cache(maxsize=65536)
+def _validar_normalizado(nif: str) -> Tuple[bool, str, str]:
+    """(valido, tipo, mensaje) de un NIF ya normalizado. Memoizada: los NIFs se repiten."""
+    inicial = nif[:1]
     
     # NIF persona física (8 números + letra)
-    if re.match(r'^[0-9]{8}[A-Z]$', nif):
-        letras = 'TRWAGMYFPDXBNJZSQVHLCKE'
-        numero = int(nif[:8])
-        letra_correcta = letras[numero % 23]
-        if nif[8] == letra_correcta:
-            return {'valido': True, 'tipo': 'NIF', 'mensaje': 'NIF válido'}
-        else:
-            return {'valido': False, 'tipo': 'NIF', 'mensaje': f'Letra incorrecta. Debería ser {letra_correcta}'}
+    if inicial.isdigit():
+        if PATRON_NIF.fullmatch(nif):
+            letra_correcta = LETRAS_NIF[int(nif[:8]) % 23]
+            if nif[8] == letra_correcta:
+                return NIF_VALIDO
+            return False, 'NIF', f'Letra incorrecta. Debería ser {letra_correcta}'
     
     # NIE extranjero (X/Y/Z + 7 números + letra)
-    if re.match(r'^[XYZ][0-9]{7}[A-Z]$', nif):
-        letras = 'TRWAGMYFPDXBNJZSQVHLCKE'
-        primera = {'X': '0', 'Y': '1', 'Z': '2'}[nif[0]]
-        numero = int(primera + nif[1:8])
-        letra_correcta = letras[numero % 23]
-        if nif[8] == letra_correcta:
-            return {'valido': True, 'tipo': 'NIE', 'mensaje': 'NIE válido'}
-        else:
-            return {'valido': False, 'tipo': 'NIE', 'mensaje': f'Letra incorrecta. Debería ser {letra_correcta}'}
+    elif inicial in PREFIJOS_NIE:
+        if PATRON_NIE.fullmatch(nif):
+            letra_correcta = LETRAS_NIF[(PREFIJOS_NIE[inicial] + int(nif[1:8])) % 23]
+            if nif[8] == letra_correcta:
+                return NIE_VALIDO
+            return False, 'NIE', f'Letra incorrecta. Debería ser {letra_correcta}'
     
-    # CIF empresa (letra + 8 caracteres)
-    if re.match(r'^[ABCDEFGHJKLMNPQRSUVW][0-9]{7}[0-9A-J]$', nif):
-        return {'valido': True, 'tipo': 'CIF', 'mensaje': 'CIF con formato válido'}
+    # CIF empresa (letra + 7 números + control)
+    elif PATRON_CIF.fullmatch(nif):
+        digito = control_cif(nif)
+        letra = LETRAS_CONTROL_CIF[digito]
+        if inicial in CIF_CONTROL_LETRA:
+            validos = (letra,)
+        elif inicial in CIF_CONTROL_DIGITO:
+            validos = (str(digito),)
+        else:
+            validos = (str(digito), letra)
+        if nif[8] in validos:
+            return CIF_VALIDO
+        return False, 'CIF', f"Dígito de control incorrecto. Debería ser {' o '.join(validos)}"
     
-    return {'valido': False, 'tipo': 'DESCONOCIDO', 'mensaje': 'Formato no reconocido'}
+    return FORMATO_NO_RECONOCIDO
+
+def validar_nif(nif: str) -> dict:
+    """
+    Valida un NIF/NIE/CIF español (letra de control del NIF/NIE y dígito
+    o letra de control del CIF).
+    Returns: dict con 'valido', 'tipo', y 'mensaje'
+    """
+    if not (nif.isalnum() and nif.isupper()):
+        nif = normalizar_nif(nif)
+    valido, tipo, mensaje = _validar_normalizado(nif)
+    return {'valido': valido, 'tipo': tipo, 'mensaje': mensaje}
+
+def _validar_vectorial(nifs: List[str]) -> List[Tuple[bool, str, str]]:
+    """
+    Valida NIFs normalizados y distintos con NumPy: los de 9 caracteres ASCII
+    se comprueban como una matriz de bytes (formato, número y módulo 23 de
+    todos a la vez); el resto (CIF, formatos raros) por _validar_normalizado.
+    """
+    resultados: List[Optional[Tuple[bool, str, str]]] = [None] * len(nifs)
+    indices = [i for i, nif in enumerate(nifs) if len(nif) == 9 and nif.isascii()]
+    if indices:
+        texto = ''.join([nifs[i] for i in indices]).encode('ascii')
+        matriz = np.frombuffer(texto, dtype=np.uint8).reshape(len(indices), 9)
+        digitos = matriz.astype(np.int64) - ord('0')
+        es_digito = (digitos >= 0) & (digitos <= 9)
+        letra = matriz[:, 8]
+        letra_valida = (letra >= ord('A')) & (letra <= ord('Z'))
+        
+        es_nif = es_digito[:, :8].all(axis=1) & letra_valida
+        primera = matriz[:, 0].astype(np.int64) - ord('X')
+        es_nie = (primera >= 0) & (primera <= 2) & es_digito[:, 1:8].all(axis=1) & letra_valida
+        
+        digitos[:, 0] = np.where(es_nie, primera, digitos[:, 0])
+        numero = digitos[:, :8] @ (10 ** np.arange(7, -1, -1, dtype=np.int64))
+        letras = np.frombuffer(LETRAS_NIF.encode('ascii'), dtype=np.uint8)
+        correcta = letras[numero % 23]
+        acierto = correcta == letra
+        
+        for i, nif, nie, ok, letra_correcta in zip(indices, es_nif.tolist(), es_nie.tolist(),
+                                                   acierto.tolist(), correcta.tolist()):
+            if ok:
+                resultados[i] = NIF_VALIDO if nif else NIE_VALIDO if nie else None
+            elif nif or nie:
+                resultados[i] = (False, 'NIF' if nif else 'NIE', f'Letra incorrecta. Debería ser {chr(letra_correcta)}')
+    return [r if r is not None else _validar_normalizado(nif) for nif, r in zip(nifs, resultados)]
+
+def validar_lote(nifs: Iterable[str]) -> List[dict]:
+    """
+    Valida muchos NIFs de una vez: cada NIF distinto (ya normalizado) se
+    valida una sola vez y, con muchos distintos y NumPy instalado, los
+    NIF/NIE se comprueban de forma vectorial.
+    Returns: un dict por NIF, en el mismo orden, con 'nif' además de
+    'valido', 'tipo' y 'mensaje'
+    """
+    nifs = list(nifs)
+    normalizados = [nif if nif.isalnum() and nif.isupper() else normalizar_nif(nif) for nif in nifs]
+    unicos = list(dict.fromkeys(normalizados))
+    if len(unicos) >= UMBRAL_VECTORIAL and cargar_numpy():
+        validacion = dict(zip(unicos, _validar_vectorial(unicos)))
+    else:
+        validacion = {nif: _validar_normalizado(nif) for nif in unicos}
+    resultados = []
+    for nif, normalizado in zip(nifs, normalizados):
+        valido, tipo, mensaje = validacion[normalizado]
+        resultados.append({'nif': nif, 'valido': valido, 'tipo': tipo, 'mensaje': mensaje})
+    return resultados
+
+def leer_nifs(archivo: str) -> Iterator[str]:
+    """NIFs de un archivo (o '-' para stdin), uno por línea; salta las vacías."""
+    f = sys.stdin if archivo == '-' else open(archivo, 'r', encoding='utf-8')
+    try:
+        for linea in f:
+            nif = linea.strip()
+            if nif:
+                yield nif
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+def calcular_importes(
+    base_imponible: Decimal,
+    tipo_iva: Decimal,
+    tipo_retencion: Decimal
+) -> Tuple[int, int, int]:
+    """(cuota_iva, retencion, total) de una factura, en céntimos (ver dinero.py)."""
+    cuota_iva = porcentaje_de(base_imponible, tipo_iva)
+    retencion = porcentaje_de(base_imponible, tipo_retencion)
+    return cuota_iva, retencion, a_centimos(base_imponible, cuota_iva - retencion)
 
 def calcular_factura(
     base_imponible: Decimal,
@@ -73,22 +214,20 @@ def calcular_factura(
     tipo_retencion: Decimal = Decimal('0')
 ) -> dict:
     """
-    Calcula los importes de una factura.
+    Calcula los importes de una factura (en céntimos, ver dinero.py).
     """
-    cuota_iva = redondear_centimos(base_imponible * tipo_iva / Decimal('100'))
-    retencion = redondear_centimos(base_imponible * tipo_retencion / Decimal('100'))
-    total = redondear_centimos(base_imponible + cuota_iva - retencion)
+    cuota_iva, retencion, total = calcular_importes(base_imponible, tipo_iva, tipo_retencion)
     
     return {
         'base_imponible': str(base_imponible),
         'tipo_iva': str(tipo_iva),
-        'cuota_iva': str(cuota_iva),
+        'cuota_iva': a_texto(cuota_iva),
         'tipo_retencion': str(tipo_retencion),
-        'retencion': str(retencion),
-        'total': str(total)
+        'retencion': a_texto(retencion),
+        'total': a_texto(total)
     }
 
-def procesar_csv(archivo: str, tipo: str) -> dict:
+def procesar_csv(archivo: str, tipo: str, incluir_detalle: bool = True) -> dict:
     """
     Procesa un archivo CSV de facturas.
     
@@ -98,17 +237,24 @@ def procesar_csv(archivo: str, tipo: str) -> dict:
     Args:
         archivo: Ruta al archivo CSV
         tipo: 'emitidas' o 'recibidas'
+        incluir_detalle: False para no guardar ninguna factura (solo
+            totales): la memoria no crece con el archivo
     
     Returns:
-        Resumen con totales y lista de facturas procesadas
+        Resumen con totales (textos) y lista de facturas procesadas
+        (registros.FacturaValidada; json.dumps(resultado, default=serializar)
+        las escribe como dicts)
     """
     facturas = []
     errores = []
+    num_facturas = 0
+    nifs_invalidos = 0
     
+    # Las bases se suman exactas (pueden tener más de 2 decimales); el resto en céntimos
     total_base = Decimal('0')
-    total_iva = Decimal('0')
-    total_retencion = Decimal('0')
-    total_facturas = Decimal('0')
+    total_iva = 0
+    total_retencion = 0
+    total_facturas = 0
     
     try:
         with open(archivo, 'r', encoding='utf-8') as f:
@@ -117,36 +263,35 @@ def procesar_csv(archivo: str, tipo: str) -> dict:
             for i, row in enumerate(reader, start=2):  # Línea 2 en adelante (1 es cabecera)
                 try:
                     base = Decimal(row.get('base_imponible', '0').replace(',', '.'))
-                    iva = Decimal(row.get('tipo_iva', '21').replace(',', '.'))
-                    ret = Decimal(row.get('tipo_retencion', '0').replace(',', '.'))
+                    iva = tipo_decimal(row.get('tipo_iva', '21'))
+                    ret = tipo_decimal(row.get('tipo_retencion', '0'))
                     
-                    calculo = calcular_factura(base, iva, ret)
+                    cuota_iva, retencion, total = calcular_importes(base, iva, ret)
                     
                     # Validar NIF
                     nif = row.get('nif', '')
-                    validacion_nif = validar_nif(nif) if nif else {'valido': False, 'mensaje': 'NIF vacío'}
+                    if nif:
+                        validacion_nif = validar_nif(nif)
+                        nif_valido = validacion_nif['valido']
+                        advertencia_nif = None if nif_valido else validacion_nif['mensaje']
+                    else:
+                        nif_valido, advertencia_nif = False, 'NIF vacío'
                     
-                    factura = {
-                        'linea': i,
-                        'numero': row.get('numero', ''),
-                        'fecha': row.get('fecha', ''),
-                        'nif': nif,
-                        'nif_valido': validacion_nif['valido'],
-                        'concepto': row.get('concepto', ''),
-                        **calculo
-                    }
-                    
-                    if not validacion_nif['valido']:
-                        factura['advertencia_nif'] = validacion_nif['mensaje']
-                    
-                    facturas.append(factura)
+                    if incluir_detalle:
+                        facturas.append(FacturaValidada(
+                            i, nif_valido, advertencia_nif,
+                            row.get('numero', ''), row.get('fecha', ''), nif, row.get('concepto', ''),
+                            base, iva, cuota_iva, ret, retencion, total
+                        ))
                     
                     # Acumular totales
-                    total_base += Decimal(calculo['base_imponible'])
-                    total_iva += Decimal(calculo['cuota_iva'])
-                    total_retencion += Decimal(calculo['retencion'])
-                    total_facturas += Decimal(calculo['total'])
-                    
+                    num_facturas += 1
+                    nifs_invalidos += not nif_valido
+                    total_base += base
+                    total_iva += cuota_iva
+                    total_retencion += retencion
+                    total_facturas += total
+                
                 except Exception as e:
                     errores.append({
                         'linea': i,
@@ -162,19 +307,32 @@ def procesar_csv(archivo: str, tipo: str) -> dict:
     return {
         'tipo': tipo,
         'archivo': archivo,
-        'num_facturas': len(facturas),
+        'num_facturas': num_facturas,
         'num_errores': len(errores),
+        'num_nifs_invalidos': nifs_invalidos,
         'totales': {
             'base_imponible': str(redondear_centimos(total_base)),
-            'iva': str(redondear_centimos(total_iva)),
-            'retencion': str(redondear_centimos(total_retencion)),
-            'total': str(redondear_centimos(total_facturas))
+            'iva': a_texto(total_iva),
+            'retencion': a_texto(total_retencion),
+            'total': a_texto(total_facturas)
         },
-        'facturas': facturas,
+        'facturas': facturas if incluir_detalle else None,
         'errores': errores if errores else None,
         'fecha_proceso': datetime.now().isoformat()
     }
 
+def instrumentar(perfil: perfilado.Perfil):
+    """
+    Cronometra las etapas por factura (solo con --profile). La lectura del
+    CSV y la construcción de cada factura quedan en los 'segundos propios'
+    de procesar_csv.
+    """
+    global validar_nif, calcular_importes, serializar, procesar_csv
+    validar_nif = perfil.cronometrar('validar_nif', validar_nif)
+    calcular_importes = perfil.cronometrar('calcular_importes', calcular_importes, por_fila=True)
+    serializar = perfil.cronometrar('serializar', serializar)
+    procesar_csv = perfil.cronometrar('procesar_csv', procesar_csv)
+
 def main():
     parser = argparse.ArgumentParser(
         description='Procesador de Facturas para Autónomos',
@@ -187,8 +345,14 @@ Ejemplos de uso:
   # Procesar archivo CSV de facturas emitidas:
   python3 procesar_facturas.py --archivo facturas.csv --tipo emitidas
   
+  # Solo totales de un archivo muy grande (memoria constante):
+  python3 procesar_facturas.py --archivo facturas.csv --tipo emitidas --sin-detalle
+  
   # Validar un NIF:
   python3 procesar_facturas.py --validar-nif 12345678Z
+  
+  # Auditar una lista de NIFs de proveedores (uno por línea; '-' = stdin):
+  python3 procesar_facturas.py --validar-nifs proveedores.txt
 
 Formato CSV esperado (con cabecera):
 numero,fecha,nif,concepto,base_imponible,tipo_iva,tipo_retencion
@@ -204,15 +368,25 @@ F001,2024-01-15,B12345678,Servicios,1000,21,15
     # Modo proceso CSV
     parser.add_argument('--archivo', type=str, help='Archivo CSV a procesar')
     parser.add_argument('--tipo', choices=['emitidas', 'recibidas'], help='Tipo de facturas')
+    parser.add_argument('--sin-detalle', action='store_true',
+                        help='Solo totales, sin la lista de facturas (memoria constante)')
     
     # Validación NIF
     parser.add_argument('--validar-nif', type=str, help='Validar un NIF/NIE/CIF')
+    parser.add_argument('--validar-nifs', type=str, metavar='ARCHIVO',
+                        help="Validar los NIFs de un archivo, uno por línea ('-' = stdin)")
     
     # Formato salida
     parser.add_argument('--json', action='store_true', help='Salida en formato JSON')
+    perfilado.añadir_argumento(parser)
+    cache.añadir_argumento(parser)
     
     args = parser.parse_args()
     
+    perfil = perfilado.crear(args.profile)
+    if perfil is not None:
+        instrumentar(perfil)
+    
     try:
         # Modo validación NIF
         if args.validar_nif:
@@ -224,6 +398,27 @@ F001,2024-01-15,B12345678,Servicios,1000,21,15
                 print(f"\n{emoji} {args.validar_nif}: {resultado['mensaje']} ({resultado['tipo']})\n")
             return
         
+        # Modo validación en lote (streaming: memoria constante)
+        if args.validar_nifs:
+            nifs = leer_nifs(args.validar_nifs)
+            total = validos = 0
+            por_tipo = {}
+            while True:
+                lote = list(islice(nifs, BLOQUE_NIFS))
+                if not lote:
+                    break
+                for r in validar_lote(lote):
+                    total += 1
+                    validos += r['valido']
+                    por_tipo[r['tipo']] = por_tipo.get(r['tipo'], 0) + 1
+                    if args.json:
+                        print(json.dumps(r, ensure_ascii=False))
+                    elif not r['valido']:
+                        print(f"❌ {r['nif']}: {r['mensaje']} ({r['tipo']})")
+            resumen = ', '.join(f'{tipo}: {n}' for tipo, n in sorted(por_tipo.items()))
+            print(f"\n📋 {total} NIFs: {validos} válidos, {total - validos} inválidos ({resumen})", file=sys.stderr)
+            return
+        
         # Modo cálculo individual
         if args.base:
             resultado = calcular_factura(
@@ -248,9 +443,23 @@ F001,2024-01-15,B12345678,Servicios,1000,21,15
         
         # Modo proceso CSV
         if args.archivo and args.tipo:
-            resultado = procesar_csv(args.archivo, args.tipo)
+            parciales = cache.crear(args.cache and not args.no_cache)
+            if parciales is not None and os.path.exists(args.archivo):
+                resultado = parciales.obtener(
+                    args.archivo, ('procesar_facturas', args.tipo, not args.sin_detalle),
+                    lambda: procesar_csv(args.archivo, args.tipo, incluir_detalle=not args.sin_detalle)
+                )
+                # La clave es el contenido: el mismo CSV puede estar en otra ruta,
+                # y la fecha de proceso es la de esta ejecución, no la cacheada
+                if 'archivo' in resultado:
+                    resultado['archivo'] = args.archivo
+                if 'fecha_proceso' in resultado:
+                    resultado['fecha_proceso'] = datetime.now().isoformat()
+            else:
+                resultado = procesar_csv(args.archivo, args.tipo, incluir_detalle=not args.sin_detalle)
             if args.json:
-                print(json.dumps(resultado, indent=2, ensure_ascii=False))
+                with perfilado.etapa(perfil, 'salida_json'):
+                    print(json.dumps(resultado, indent=2, ensure_ascii=False, default=serializar))
             else:
                 if 'error' in resultado:
                     print(f"\n❌ Error: {resultado['error']}\n")
@@ -275,19 +484,27 @@ F001,2024-01-15,B12345678,Servicios,1000,21,15
                 print("="*55 + "\n")
                 
                 # Mostrar advertencias de NIF
-                nifs_invalidos = [f for f in resultado['facturas'] if not f.get('nif_valido', True)]
+                if resultado['facturas'] is None:
+                    if resultado['num_nifs_invalidos']:
+                        print(f"⚠️  {resultado['num_nifs_invalidos']} facturas con NIF con problemas (sin --sin-detalle se listan)\n")
+                    return
+                nifs_invalidos = [f for f in resultado['facturas'] if not f.nif_valido]
                 if nifs_invalidos:
                     print("⚠️  NIFs con problemas:")
                     for f in nifs_invalidos:
-                        print(f"   - Factura {f['numero']}: {f['nif']} - {f.get('advertencia_nif', 'NIF inválido')}")
+                        print(f"   - Factura {f.numero}: {f.nif} - {f.advertencia_nif or 'NIF inválido'}")
                     print()
             return
         
         parser.print_help()
-        
+    
     except Exception as e:
         print(f"Error: {e}", file=sys.stderr)
         sys.exit(1)
+    
+    finally:
+        if perfil is not None:
+            perfil.emitir(args.profile)
 
 if __name__ == "__main__":
     main()
@@ -20,13 +20,30 @@ REGLAS FISCALES APLICADAS:
 
 import argparse
 import csv
+import glob
+import heapq
 import json
+import os
 import sys
 import re
+import zlib
+from contextlib import contextmanager
 from decimal import Decimal, ROUND_HALF_UP
 from datetime import datetime, date
-from typing import List, Dict, Tuple, Optional
-import urllib.request
+from typing import List, Dict, Set, Tuple, Optional, Iterable, Iterator, Sequence, Callable, NamedTuple
+from itertools import groupby, islice, repeat
+from functools import lru_cache
+from operator import itemgetter
+
+from dinero import redondear, a_texto, texto_a_centimos, dividir, dividir_entre, fraccion
+import cache
+import perfilado
+from registros import Pago, codigo, serializar
+import fechas
+from fechas import parsear_fecha, crear_lector_fechas, rango_trimestre
+
+# NumPy es opcional: solo lo usa el motor columnar (ver cargar_numpy)
+np = None
 
 # Países UE-27 (sin UK desde 2021)
 PAISES_UE = {
@@ -61,19 +78,25 @@ TIPOS_CAMBIO = {
 
 DIVISOR_IVA = Decimal('1.21')
 
-def redondear(valor: Decimal) -> Decimal:
-    """Redondea a 2 decimales."""
-    return valor.quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+# Columnas candidatas de cada campo, en orden de prioridad (Substack / Stripe)
+COLUMNAS_IMPORTE = ('amount', 'Amount')
+COLUMNAS_MONEDA = ('currency', 'Currency')
+COLUMNAS_FECHA = ('date', 'Date', 'created', 'Created (UTC)')
+COLUMNAS_SUBSTACK_FEE = ('Substack fee', 'substack_fee')
+COLUMNAS_STRIPE_FEE = ('Stripe fee', 'stripe_fee')
+COLUMNAS_EMAIL = ('email', 'Customer Email')
+# Id del cargo (Stripe); Substack no lo exporta
+COLUMNAS_ID = ('id', 'ID', 'Charge ID', 'charge_id')
+# País: country (billing) > country (ip) > otros
+COLUMNAS_PAIS = (
+    'country (billing)', 'Country (billing)', 'billing_country',
+    'country (ip)', 'Country (ip)', 'ip_country',
+    'Country', 'country', 'Card Country',
+)
+VALORES_NULOS = {'', 'NULL', 'NONE', 'N/A'}
 
-def parsear_importe(valor: str) -> Tuple[Decimal, str]:
-    """
-    Parsea un importe con símbolo de moneda.
-    Ejemplos: '€60.00', 'CA$140.00', '$50.00', '60.00'
-    Returns: (importe, moneda)
-    """
-    if not valor or valor.strip() == '':
-        return Decimal('0'), 'EUR'
-    
+def _separar_moneda(valor: str) -> Tuple[str, str]:
+    """'CA$140.00' → ('140.00', 'CAD'). Sin símbolo la moneda es EUR."""
     valor = str(valor).strip()
     
     # Detectar moneda por símbolo
@@ -91,43 +114,44 @@ def parsear_importe(valor: str) -> Tuple[Decimal, str]:
         moneda = 'GBP'
         valor = valor[1:]
     
-    # Limpiar y convertir
-    valor = valor.replace(',', '.').replace(' ', '').strip()
+    return valor.replace(',', '.').replace(' ', '').strip(), moneda
+
+def moneda_de_columna(valor: Optional[str]) -> Optional[str]:
+    """Código de la columna de moneda (' usd' → 'USD'); None si está vacía o es nula."""
+    if valor is None:
+        return None
+    moneda = valor.strip().upper()
+    return moneda if moneda not in VALORES_NULOS else None
+
+def parsear_importe(valor: str) -> Tuple[Decimal, str]:
+    """
+    Parsea un importe con símbolo de moneda.
+    Ejemplos: '€60.00', 'CA$140.00', '$50.00', '60.00'
+    Returns: (importe, moneda)
+    """
+    if not valor or valor.strip() == '':
+        return Decimal('0'), 'EUR'
+    
+    valor, moneda = _separar_moneda(valor)
     try:
         return Decimal(valor), moneda
     except:
         return Decimal('0'), moneda
 
-def parsear_fecha(valor: str) -> Optional[date]:
+@lru_cache(maxsize=4096)
+def parsear_centimos(valor: str) -> Tuple[int, str]:
     """
-    Parsea fechas en múltiples formatos.
-    Substack: '02-Oct-25', '15-Nov-25'
-    Stripe: '2025-10-02', '2025-10-02 14:30:00'
+    Como parsear_importe, pero en céntimos enteros (ver dinero.py).
+    Memoizada: los precios y fees se repiten en casi todas las filas.
     """
-    if not valor:
-        return None
-    
-    valor = str(valor).strip()
-    
-    # Formato Substack: DD-MMM-YY
-    try:
-        return datetime.strptime(valor, '%d-%b-%y').date()
-    except:
-        pass
-    
-    # Formato ISO: YYYY-MM-DD
-    try:
-        return datetime.strptime(valor.split(' ')[0].split('T')[0], '%Y-%m-%d').date()
-    except:
-        pass
+    if not valor or valor.strip() == '':
+        return 0, 'EUR'
     
-    # Formato europeo: DD/MM/YYYY
+    valor, moneda = _separar_moneda(valor)
     try:
-        return datetime.strptime(valor, '%d/%m/%Y').date()
+        return texto_a_centimos(valor), moneda
     except:
-        pass
-    
-    return None
+        return 0, moneda
 
 def obtener_pais(pago: Dict) -> Optional[str]:
     """
@@ -136,22 +160,9 @@ def obtener_pais(pago: Dict) -> Optional[str]:
     
     IMPORTANTE: Si hay country (billing), usarlo aunque esté vacío country (ip)
     """
-    # Prioridad 1: country (billing)
-    for campo in ['country (billing)', 'Country (billing)', 'billing_country']:
+    for campo in COLUMNAS_PAIS:
         pais = pago.get(campo, '').strip().upper()
-        if pais and pais not in ['', 'NULL', 'NONE', 'N/A']:
-            return pais
-    
-    # Prioridad 2: country (ip) - solo si no hay billing
-    for campo in ['country (ip)', 'Country (ip)', 'ip_country']:
-        pais = pago.get(campo, '').strip().upper()
-        if pais and pais not in ['', 'NULL', 'NONE', 'N/A']:
-            return pais
-    
-    # Otros campos
-    for campo in ['Country', 'country', 'Card Country']:
-        pais = pago.get(campo, '').strip().upper()
-        if pais and pais not in ['', 'NULL', 'NONE', 'N/A']:
+        if pais and pais not in VALORES_NULOS:
             return pais
     
     return None
@@ -160,159 +171,402 @@ def es_ue(pais: str) -> bool:
     """Verifica si un país está en la UE-27."""
     return pais.upper() in PAISES_UE if pais else False
 
-def convertir_a_eur(importe: Decimal, moneda: str) -> Tuple[Decimal, Decimal]:
-    """Convierte a EUR. Returns: (importe_eur, tipo_cambio)"""
+def tipo_por_defecto(moneda: str) -> Decimal:
+    """Tipo de TIPOS_CAMBIO (EUR por unidad). ValueError si la moneda no está."""
+    tc = TIPOS_CAMBIO.get(moneda)
+    if tc is None:
+        raise ValueError(f"Moneda sin tipo de cambio: {moneda} (use --tipos-cambio o añádala a TIPOS_CAMBIO)")
+    return tc
+
+@lru_cache(maxsize=4096)
+def _eur_por_unidad(tipo_bce: Decimal) -> Decimal:
+    """Tipo del BCE (moneda por EUR) expresado como EUR por unidad."""
+    return (Decimal('1') / tipo_bce).quantize(Decimal('0.000001'), rounding=ROUND_HALF_UP)
+
+def convertir_a_eur(
+    importe: Decimal,
+    moneda: str,
+    fecha: Optional[date] = None,
+    almacen=None
+) -> Tuple[Decimal, Decimal]:
+    """
+    Convierte a EUR. Returns: (importe_eur, tipo_cambio en EUR por unidad)
+    
+    Con `almacen` (ver tipos_cambio.py) se usa el tipo del BCE vigente en la
+    fecha del pago (importe / tipo); si la moneda o la fecha no están en el
+    almacén, se usa la tabla TIPOS_CAMBIO. ValueError si la moneda no está
+    en ninguno de los dos: no se suma como si fueran euros.
+    """
     moneda = moneda.upper()
     if moneda == 'EUR':
         return importe, Decimal('1.0')
-    tc = TIPOS_CAMBIO.get(moneda, Decimal('1.0'))
+    if almacen is not None:
+        tipo_bce = almacen.tipo(moneda, fecha)
+        if tipo_bce is not None:
+            return redondear(importe / tipo_bce), _eur_por_unidad(tipo_bce)
+    tc = tipo_por_defecto(moneda)
     return redondear(importe * tc), tc
 
-def procesar_substack_stripe(
-    pagos: List[Dict],
-    trimestre: int,
-    año: int
-) -> Dict:
+def convertir_centimos(
+    centimos: int,
+    moneda: str,
+    fecha: Optional[date] = None,
+    almacen=None
+) -> Tuple[int, Decimal]:
+    """convertir_a_eur sobre céntimos enteros. Returns: (céntimos_eur, tipo_cambio)"""
+    numerador, denominador, tc = fraccion_cambio(moneda, fecha, almacen)
+    return dividir(centimos * numerador, denominador), tc
+
+def fraccion_cambio(
+    moneda: str,
+    fecha: Optional[date] = None,
+    almacen=None
+) -> Tuple[int, int, Decimal]:
     """
-    Procesa pagos de Substack o Stripe.
+    Conversión a EUR como fracción exacta: céntimos_eur =
+    dividir(céntimos × numerador, denominador).
+    Returns: (numerador, denominador, tipo_cambio en EUR por unidad)
     """
-    # Fechas del trimestre
-    mes_inicio = (trimestre - 1) * 3 + 1
-    mes_fin = trimestre * 3
-    fecha_inicio = date(año, mes_inicio, 1)
-    fecha_fin = date(año + 1, 1, 1) if mes_fin == 12 else date(año, mes_fin + 1, 1)
+    moneda = moneda.upper()
+    if moneda == 'EUR':
+        return 1, 1, Decimal('1.0')
+    if almacen is not None:
+        tipo_bce = almacen.tipo(moneda, fecha)
+        if tipo_bce is not None:
+            # importe / tipo_bce
+            numerador, denominador = fraccion(tipo_bce)
+            return denominador, numerador, _eur_por_unidad(tipo_bce)
+    tc = tipo_por_defecto(moneda)
+    numerador, denominador = fraccion(tc)
+    return numerador, denominador, tc
+
+class Esquema(NamedTuple):
+    """Posiciones de las columnas de una exportación, resueltas una vez por cabecera."""
+    ancho: int
+    extraer: Callable  # fila -> (importe, moneda, fecha, substack_fee, stripe_fee, email)
+    paises: Tuple[int, ...]
+    cola: Tuple  # valores por defecto de los campos sin columna
+    leer_fecha: Callable  # parser de la columna de fecha (ver crear_lector_fechas)
+    indices: Tuple[int, ...]  # posiciones que usa `extraer` (motor columnar)
+
+def compilar_esquema(cabecera: Sequence[str]) -> Esquema:
+    """
+    Resuelve la cabecera de un CSV/JSON en índices de columna.
     
-    # Acumuladores
-    pagos_ue = []
-    pagos_no_ue = []
-    pagos_sin_pais = []
+    Los campos sin columna apuntan a posiciones detrás de la fila, que se
+    rellenan con `cola`; así un solo itemgetter extrae todos los campos.
+    """
+    ancho = len(cabecera)
+    posiciones = {nombre: i for i, nombre in enumerate(cabecera)}
     
-    total_bruto_ue = Decimal('0')
-    total_base_ue = Decimal('0')
-    total_iva_ue = Decimal('0')
-    total_base_no_ue = Decimal('0')
-    total_sin_pais = Decimal('0')
+    indices = []
+    cola = []
+    campos = (
+        (COLUMNAS_IMPORTE, '0'),
+        (COLUMNAS_MONEDA, None),  # None: usar la moneda del símbolo
+        (COLUMNAS_FECHA, ''),
+        (COLUMNAS_SUBSTACK_FEE, '0'),
+        (COLUMNAS_STRIPE_FEE, '0'),
+        (COLUMNAS_EMAIL, ''),
+    )
+    for candidatas, defecto in campos:
+        for columna in candidatas:
+            if columna in posiciones:
+                indices.append(posiciones[columna])
+                break
+        else:
+            indices.append(ancho + len(cola))
+            cola.append(defecto)
     
-    total_substack_fee = Decimal('0')
-    total_stripe_fee = Decimal('0')
+    paises = tuple(posiciones[c] for c in COLUMNAS_PAIS if c in posiciones)
+    return Esquema(ancho, itemgetter(*indices), paises, tuple(cola), crear_lector_fechas(), tuple(indices))
+
+def procesar_pago(
+    fila: list,
+    esquema: Esquema,
+    fecha_inicio: date,
+    fecha_fin: date,
+    almacen=None
+) -> Optional[tuple]:
+    """
+    Parsea y clasifica un pago (fila ya completada con esquema.cola).
+    `almacen`: tipos de cambio del BCE por día (ver convertir_a_eur).
+    Returns: (fecha, email, importe, moneda, tc, importe_eur, base, iva,
+    pais, es_ue, substack_fee_eur, stripe_fee_eur), importes en céntimos,
+    o None si el pago no cuenta (importe nulo/negativo o fuera del trimestre).
+    """
+    amount_raw, moneda_raw, fecha_raw, substack_fee_raw, stripe_fee_raw, email = esquema.extraer(fila)
     
-    conversiones = {}
-    paises_ue = {}
-    paises_no_ue = {}
+    # Parsear importe
+    importe, moneda_detectada = parsear_centimos(amount_raw)
+    
+    if importe <= 0:
+        return None
+    
+    # Moneda (puede venir en columna separada; manda sobre el símbolo)
+    moneda = moneda_detectada
+    moneda_columna = moneda_de_columna(moneda_raw)
+    if moneda_columna is not None:
+        moneda = codigo(moneda_columna)
+    
+    # Parsear fecha y filtrar por trimestre
+    fecha = esquema.leer_fecha(fecha_raw)
+    if fecha and not (fecha_inicio <= fecha < fecha_fin):
+        return None
     
-    for pago in pagos:
+    # País (billing > ip)
+    pais = None
+    for i in esquema.paises:
+        valor = fila[i].strip().upper()
+        if valor and valor not in VALORES_NULOS:
+            pais = codigo(valor)
+            break
+    
+    # Convertir a EUR
+    importe_eur, tc = convertir_centimos(importe, moneda, fecha, almacen)
+    
+    # Fees (Substack y Stripe), en la misma moneda que el pago
+    substack_fee, _ = parsear_centimos(substack_fee_raw)
+    stripe_fee, _ = parsear_centimos(stripe_fee_raw)
+    substack_fee_eur, _ = convertir_centimos(substack_fee, moneda, fecha, almacen)
+    stripe_fee_eur, _ = convertir_centimos(stripe_fee, moneda, fecha, almacen)
+    
+    # OPCIÓN CONSERVADORA: Sin país → tratar como UE (paga IVA)
+    if pais is None or pais in PAISES_UE:
+        # UE o sin país: IVA incluido → Base = Total / 1.21
+        base = dividir_entre(importe_eur, DIVISOR_IVA)
+        iva = importe_eur - base
+        es_ue_final = True
+    else:
+        # No-UE: Exportación exenta
+        base = importe_eur
+        iva = 0
+        es_ue_final = False
+    
+    return (fecha, email, importe, moneda, tc, importe_eur, base, iva,
+            pais, es_ue_final, substack_fee_eur, stripe_fee_eur)
+
+class Detalle(NamedTuple):
+    """
+    Cómo se guarda el detalle por pago cuando no se quiere la lista entera:
+    
+    - 'mayores': los `limite` pagos de mayor importe (en EUR) de cada grupo
+    - 'muestra': una muestra uniforme de `limite` pagos de cada grupo
+    - 'ndjson': todos, escritos en `ruta` a medida que se procesan
+    
+    Los totales no cambian: solo cambia qué pagos se conservan.
+    """
+    modo: str
+    limite: int = 0
+    ruta: Optional[str] = None
+
+class MuestraDetalle:
+    """
+    Los `limite` pagos de menor clave: -importe en EUR ('mayores') o un
+    hash del pago ('muestra': el hash hace de número aleatorio, así que la
+    muestra es uniforme y reproducible). Guarda como mucho 2 × limite pagos
+    y se fusiona como una lista (append/extend): fusionar muestras de varios
+    archivos o meses da la misma muestra que una sola pasada.
+    """
+    
+    def __init__(self, modo: str, limite: int):
+        self.modo = modo
+        self.limite = limite
+        self.pagos = []
+    
+    def _clave(self, pago: Pago) -> tuple:
+        desempate = (str(pago.fecha), pago.email, pago.importe, pago.moneda, str(pago.pais))
+        if self.modo == 'mayores':
+            return (-pago.total_eur,) + desempate
+        return (zlib.crc32(repr(desempate).encode()),) + desempate
+    
+    def _recortar(self):
+        self.pagos = heapq.nsmallest(self.limite, self.pagos, key=itemgetter(0))
+    
+    def append(self, pago: Pago):
+        self.pagos.append((self._clave(pago), pago))
+        if len(self.pagos) >= 2 * self.limite:
+            self._recortar()
+    
+    def extend(self, pagos: Iterable[Pago]):
+        for pago in pagos:
+            self.append(pago)
+    
+    def __iter__(self) -> Iterator[Pago]:
+        """Mayores: de más a menos importe. Muestra: por fecha."""
+        self._recortar()
+        pagos = self.pagos if self.modo == 'mayores' else sorted(self.pagos, key=lambda p: p[0][1:])
+        return (pago for _, pago in pagos)
+
+class EscritorDetalle:
+    """
+    Archivo NDJSON con el detalle de un archivo de pagos: una línea por
+    pago, con su grupo ('ue' o 'no_ue'), escrita al procesarlo.
+    """
+    
+    def __init__(self, ruta: str):
+        self.ruta = ruta
+        self.f = open(ruta, 'w', encoding='utf-8')
+        self.cantidad = 0
+    
+    def escribir(self, grupo: str, pago: Pago):
+        self.f.write(json.dumps({'grupo': grupo, **pago.a_dict()}, ensure_ascii=False) + '\n')
+        self.cantidad += 1
+    
+    def cerrar(self):
+        self.f.close()
+
+class _SalidaDetalle:
+    """Un grupo de un EscritorDetalle con la interfaz de una lista: no guarda nada."""
+    
+    def __init__(self, escritor: EscritorDetalle, grupo: str):
+        self.escritor = escritor
+        self.grupo = grupo
+    
+    def append(self, pago: Pago):
+        self.escritor.escribir(self.grupo, pago)
+    
+    def extend(self, pagos: Iterable[Pago]):
+        for pago in pagos:
+            self.escritor.escribir(self.grupo, pago)
+    
+    def __iter__(self) -> Iterator[Pago]:
+        return iter(())
+    
+    def __reduce__(self):
+        # Al volver de un proceso trabajador: lo escrito ya está en el archivo
+        return list, ()
+
+def _contenedor_detalle(incluir_detalle, grupo: str):
+    """Dónde acumular el detalle de un grupo según incluir_detalle (bool, Detalle o EscritorDetalle)."""
+    if isinstance(incluir_detalle, EscritorDetalle):
+        return _SalidaDetalle(incluir_detalle, grupo)
+    if isinstance(incluir_detalle, Detalle) and incluir_detalle.modo != 'ndjson':
+        return MuestraDetalle(incluir_detalle.modo, incluir_detalle.limite)
+    return []
+
+def _detalle_en_memoria(incluir_detalle) -> bool:
+    """Si el reporte lleva las listas de detalle (no con --sin-detalle ni con NDJSON)."""
+    if isinstance(incluir_detalle, EscritorDetalle):
+        return False
+    if isinstance(incluir_detalle, Detalle):
+        return incluir_detalle.modo != 'ndjson'
+    return bool(incluir_detalle)
+
+@contextmanager
+def abrir_detalle(incluir_detalle):
+    """Con Detalle('ndjson', ruta=...), un EscritorDetalle abierto mientras se procesa."""
+    if isinstance(incluir_detalle, Detalle) and incluir_detalle.modo == 'ndjson':
+        escritor = EscritorDetalle(incluir_detalle.ruta)
         try:
-            # Parsear importe
-            amount_raw = pago.get('amount', pago.get('Amount', '0'))
-            importe, moneda_detectada = parsear_importe(amount_raw)
-            
-            if importe <= 0:
-                continue
-            
-            # Moneda (puede venir en columna separada)
-            moneda = pago.get('currency', pago.get('Currency', moneda_detectada)).upper()
-            if moneda in ['EUR', 'CAD', 'USD', 'GBP']:
-                pass
-            else:
-                moneda = moneda_detectada
-            
-            # Parsear fecha
-            fecha_raw = pago.get('date', pago.get('Date', pago.get('created', pago.get('Created (UTC)', ''))))
-            fecha = parsear_fecha(fecha_raw)
-            
-            # Filtrar por trimestre
-            if fecha and not (fecha_inicio <= fecha < fecha_fin):
-                continue
-            
-            # País (billing > ip)
-            pais = obtener_pais(pago)
-            
-            # Convertir a EUR
-            importe_eur, tc = convertir_a_eur(importe, moneda)
-            
-            # Registrar conversión
-            if moneda != 'EUR':
-                if moneda not in conversiones:
-                    conversiones[moneda] = {'tc': str(tc), 'original': Decimal('0'), 'eur': Decimal('0'), 'count': 0}
-                conversiones[moneda]['original'] += importe
-                conversiones[moneda]['eur'] += importe_eur
-                conversiones[moneda]['count'] += 1
-            
-            # Fees (Substack y Stripe)
-            substack_fee_raw = pago.get('Substack fee', pago.get('substack_fee', '0'))
-            stripe_fee_raw = pago.get('Stripe fee', pago.get('stripe_fee', '0'))
-            
-            substack_fee, _ = parsear_importe(substack_fee_raw)
-            stripe_fee, _ = parsear_importe(stripe_fee_raw)
-            
-            # Convertir fees a EUR (misma moneda que el pago)
-            substack_fee_eur, _ = convertir_a_eur(substack_fee, moneda)
-            stripe_fee_eur, _ = convertir_a_eur(stripe_fee, moneda)
-            
-            total_substack_fee += substack_fee_eur
-            total_stripe_fee += stripe_fee_eur
-            
-            # Calcular desglose IVA
-            pais_es_ue = es_ue(pais) if pais else None
-            
-            # OPCIÓN CONSERVADORA: Sin país → tratar como UE (paga IVA)
-            if pais_es_ue is True or pais_es_ue is None:
-                # UE o sin país: IVA incluido → Base = Total / 1.21
-                base = redondear(importe_eur / DIVISOR_IVA)
-                iva = redondear(importe_eur - base)
-                es_ue_final = True
-            else:
-                # No-UE: Exportación exenta
-                base = importe_eur
-                iva = Decimal('0')
-                es_ue_final = False
-            
-            # Datos del pago
-            pago_proc = {
-                'fecha': str(fecha) if fecha else 'N/A',
-                'email': pago.get('email', pago.get('Customer Email', ''))[:30],
-                'importe_original': f"{importe:.2f} {moneda}",
-                'total_eur': str(importe_eur),
-                'base': str(base),
-                'iva': str(iva),
-                'pais': pais if pais else 'DESCONOCIDO',
-                'substack_fee': str(substack_fee_eur),
-                'stripe_fee': str(stripe_fee_eur),
-            }
-            
-            # Clasificar
-            if es_ue_final:
-                # UE (incluye pagos sin país por criterio conservador)
-                pagos_ue.append(pago_proc)
-                total_bruto_ue += importe_eur
-                total_base_ue += base
-                total_iva_ue += iva
-                pais_key = pais if pais else 'SIN_PAIS'
-                paises_ue[pais_key] = paises_ue.get(pais_key, {'count': 0, 'total': Decimal('0')})
-                paises_ue[pais_key]['count'] += 1
-                paises_ue[pais_key]['total'] += importe_eur
-                if not pais:
-                    pagos_sin_pais.append(pago_proc)
-                    total_sin_pais += importe_eur
-            else:
-                # No-UE (exportación)
-                pagos_no_ue.append(pago_proc)
-                total_base_no_ue += base
-                paises_no_ue[pais] = paises_no_ue.get(pais, {'count': 0, 'total': Decimal('0')})
-                paises_no_ue[pais]['count'] += 1
-                paises_no_ue[pais]['total'] += importe_eur
-                
-        except Exception as e:
-            print(f"⚠️  Error: {e}", file=sys.stderr)
+            yield escritor
+        finally:
+            escritor.cerrar()
+    else:
+        yield incluir_detalle
+
+def nuevo_acumulado(incluir_detalle=True) -> Dict:
+    """Acumuladores vacíos de un procesamiento (importes en céntimos)."""
+    return {
+        'registros': 0,
+        'cantidad_ue': 0,
+        'cantidad_no_ue': 0,
+        'cantidad_sin_pais': 0,
+        'total_bruto_ue': 0,
+        'total_base_ue': 0,
+        'total_iva_ue': 0,
+        'total_base_no_ue': 0,
+        'total_sin_pais': 0,
+        'total_substack_fee': 0,
+        'total_stripe_fee': 0,
+        'filas_rechazadas': 0,
+        'monedas_rechazadas': {},
+        'conversiones': {},
+        'paises_ue': {},
+        'paises_no_ue': {},
+        'detalle_ue': _contenedor_detalle(incluir_detalle, 'ue'),
+        'detalle_no_ue': _contenedor_detalle(incluir_detalle, 'no_ue'),
+    }
+
+def acumular_pago(acc: Dict, pago: tuple, incluir_detalle: bool = True):
+    """Suma un pago ya clasificado (ver procesar_pago) a los acumuladores."""
+    (fecha, email, importe, moneda, tc, importe_eur, base, iva,
+     pais, pago_es_ue, substack_fee_eur, stripe_fee_eur) = pago
+    
+    # Datos del pago
+    pago_proc = None
+    if incluir_detalle:
+        pago_proc = Pago(fecha, email, importe, moneda, importe_eur, base, iva,
+                         pais or None, substack_fee_eur, stripe_fee_eur)
+    
+    # Registrar conversión
+    if moneda != 'EUR':
+        conversion = acc['conversiones'].get(moneda)
+        if conversion is None:
+            conversion = acc['conversiones'][moneda] = {'tc': tc, 'original': 0, 'eur': 0, 'count': 0}
+        elif conversion['tc'] != tc:
+            conversion['tc'] = None  # tipos diarios distintos
+        conversion['original'] += importe
+        conversion['eur'] += importe_eur
+        conversion['count'] += 1
     
-    # Formatear
-    for m in conversiones:
-        conversiones[m]['original'] = str(redondear(conversiones[m]['original']))
-        conversiones[m]['eur'] = str(redondear(conversiones[m]['eur']))
-    for p in paises_ue:
-        paises_ue[p]['total'] = str(redondear(paises_ue[p]['total']))
-    for p in paises_no_ue:
-        paises_no_ue[p]['total'] = str(redondear(paises_no_ue[p]['total']))
+    acc['total_substack_fee'] += substack_fee_eur
+    acc['total_stripe_fee'] += stripe_fee_eur
+    
+    # Clasificar
+    if pago_es_ue:
+        # UE (incluye pagos sin país por criterio conservador)
+        acc['cantidad_ue'] += 1
+        acc['total_bruto_ue'] += importe_eur
+        acc['total_base_ue'] += base
+        acc['total_iva_ue'] += iva
+        pais_key = pais if pais else 'SIN_PAIS'
+        paises_ue = acc['paises_ue']
+        paises_ue[pais_key] = paises_ue.get(pais_key, {'count': 0, 'total': 0})
+        paises_ue[pais_key]['count'] += 1
+        paises_ue[pais_key]['total'] += importe_eur
+        if pago_proc is not None:
+            acc['detalle_ue'].append(pago_proc)
+        if not pais:
+            acc['cantidad_sin_pais'] += 1
+            acc['total_sin_pais'] += importe_eur
+    else:
+        # No-UE (exportación)
+        acc['cantidad_no_ue'] += 1
+        acc['total_base_no_ue'] += base
+        paises_no_ue = acc['paises_no_ue']
+        paises_no_ue[pais] = paises_no_ue.get(pais, {'count': 0, 'total': 0})
+        paises_no_ue[pais]['count'] += 1
+        paises_no_ue[pais]['total'] += importe_eur
+        if pago_proc is not None:
+            acc['detalle_no_ue'].append(pago_proc)
+
+def formatear_resultado(
+    acc: Dict,
+    trimestre: Optional[int],
+    año: int,
+    incluir_detalle: bool = True,
+    descripcion: Optional[str] = None
+) -> Dict:
+    """Convierte los acumuladores (céntimos) en el reporte final (importes como str)."""
+    conversiones = {}
+    for m, d in acc['conversiones'].items():
+        conversiones[m] = {**d, 'original': a_texto(d['original']), 'eur': a_texto(d['eur'])}
+        if d['tc'] is None:
+            # Con tipos diarios del BCE se informa el tipo medio efectivo
+            tc_medio = (Decimal(d['eur']) / Decimal(d['original'])).quantize(Decimal('0.000001'), rounding=ROUND_HALF_UP)
+            conversiones[m].update(tc=str(tc_medio), tc_diario=True)
+        else:
+            conversiones[m]['tc'] = str(d['tc'])
+    paises_ue = {p: {**d, 'total': a_texto(d['total'])} for p, d in acc['paises_ue'].items()}
+    paises_no_ue = {p: {**d, 'total': a_texto(d['total'])} for p, d in acc['paises_no_ue'].items()}
+    
+    total_bruto_ue = acc['total_bruto_ue']
+    total_base_ue = acc['total_base_ue']
+    total_iva_ue = acc['total_iva_ue']
+    total_base_no_ue = acc['total_base_no_ue']
+    total_substack_fee = acc['total_substack_fee']
+    total_stripe_fee = acc['total_stripe_fee']
     
     total_fees = total_substack_fee + total_stripe_fee
     total_ingresos = total_base_ue + total_base_no_ue
@@ -320,66 +574,905 @@ def procesar_substack_stripe(
     total_bruto = total_bruto_ue + total_base_no_ue
     
     # Total pagos = UE + no-UE (sin_pais ya está incluido en UE)
-    total_pagos = len(pagos_ue) + len(pagos_no_ue)
+    total_pagos = acc['cantidad_ue'] + acc['cantidad_no_ue']
+    
+    if _detalle_en_memoria(incluir_detalle):
+        detalle_ue, detalle_no_ue = acc['detalle_ue'], acc['detalle_no_ue']
+        if not isinstance(detalle_ue, list):
+            detalle_ue, detalle_no_ue = list(detalle_ue), list(detalle_no_ue)
+        # Los pagos sin país están en detalle_ue: no se guarda una segunda lista
+        detalle_sin_pais = [p for p in detalle_ue if p.pais is None] or None
+    else:
+        detalle_ue = detalle_no_ue = detalle_sin_pais = None
     
     return {
         'periodo': {
             'trimestre': trimestre,
             'año': año,
-            'descripcion': f'{trimestre}T {año}'
+            'descripcion': descripcion or f'{trimestre}T {año}'
         },
         'resumen': {
             'total_pagos': total_pagos,
-            'total_bruto_eur': str(redondear(total_bruto)),
+            'total_bruto_eur': a_texto(total_bruto),
             'ue': {
-                'cantidad': len(pagos_ue),
-                'total_cobrado': str(redondear(total_bruto_ue)),
-                'base_imponible': str(redondear(total_base_ue)),
-                'iva_incluido': str(redondear(total_iva_ue)),
+                'cantidad': acc['cantidad_ue'],
+                'total_cobrado': a_texto(total_bruto_ue),
+                'base_imponible': a_texto(total_base_ue),
+                'iva_incluido': a_texto(total_iva_ue),
             },
             'no_ue': {
-                'cantidad': len(pagos_no_ue),
-                'base_imponible': str(redondear(total_base_no_ue)),
+                'cantidad': acc['cantidad_no_ue'],
+                'base_imponible': a_texto(total_base_no_ue),
             },
             'sin_pais': {
-                'cantidad': len(pagos_sin_pais),
-                'total': str(redondear(total_sin_pais)),
-            }
+                'cantidad': acc['cantidad_sin_pais'],
+                'total': a_texto(acc['total_sin_pais']),
+            },
+            # Filas que no se pudieron procesar: no están en los totales
+            'filas_rechazadas': {
+                'cantidad': acc['filas_rechazadas'],
+                'monedas': dict(acc['monedas_rechazadas']),
+            },
         },
         'fees': {
-            'substack': str(redondear(total_substack_fee)),
-            'stripe': str(redondear(total_stripe_fee)),
-            'total': str(redondear(total_fees)),
+            'substack': a_texto(total_substack_fee),
+            'stripe': a_texto(total_stripe_fee),
+            'total': a_texto(total_fees),
         },
         'paises': {'ue': paises_ue, 'no_ue': paises_no_ue},
         'conversiones': conversiones,
         'modelo_303': {
-            'casilla_01_base_21': str(redondear(total_base_ue)),
-            'casilla_03_cuota_21': str(redondear(total_iva_ue)),
-            'casilla_60_exportaciones': str(redondear(total_base_no_ue)),
+            'casilla_01_base_21': a_texto(total_base_ue),
+            'casilla_03_cuota_21': a_texto(total_iva_ue),
+            'casilla_60_exportaciones': a_texto(total_base_no_ue),
         },
         'modelo_130': {
-            'ingresos': str(redondear(total_ingresos)),
-            'gastos_fees': str(redondear(total_fees)),
-            'rendimiento_neto': str(redondear(rendimiento_neto)),
+            'ingresos': a_texto(total_ingresos),
+            'gastos_fees': a_texto(total_fees),
+            'rendimiento_neto': a_texto(rendimiento_neto),
         },
-        'detalle_ue': pagos_ue,
-        'detalle_no_ue': pagos_no_ue,
-        'detalle_sin_pais': pagos_sin_pais if pagos_sin_pais else None,
+        'detalle_ue': detalle_ue,
+        'detalle_no_ue': detalle_no_ue,
+        'detalle_sin_pais': detalle_sin_pais,
     }
 
-def cargar_csv(archivo: str) -> List[Dict]:
-    pagos = []
+def _filas_normalizadas(acc: Dict, filas: Iterable[list], esquema: Esquema) -> Iterator[list]:
+    """Salta las filas vacías, las cuenta y las ajusta al esquema (ancho + cola)."""
+    ancho = esquema.ancho
+    cola = list(esquema.cola)
+    for fila in filas:
+        if not fila:
+            continue
+        acc['registros'] += 1
+        if len(fila) != ancho:
+            fila = (fila + [''] * ancho)[:ancho]
+        fila += cola
+        yield fila
+
+def _acumular_pagos(
+    acc: Dict,
+    filas: Iterable[list],
+    esquema: Esquema,
+    fecha_inicio: date,
+    fecha_fin: date,
+    incluir_detalle: bool = True,
+    almacen=None,
+    meses: Optional[Dict[int, Dict]] = None
+):
+    """
+    Motor por filas: procesar_pago + acumular_pago para cada fila normalizada.
+    Las filas que fallan se informan y se cuentan como rechazadas.
+    """
+    for fila in filas:
+        try:
+            pago = procesar_pago(fila, esquema, fecha_inicio, fecha_fin, almacen)
+            if pago is not None:
+                destino = acc
+                if meses is not None and pago[0] is not None:
+                    destino = meses[pago[0].month]
+                acumular_pago(destino, pago, incluir_detalle)
+        except Exception as e:
+            print(f"⚠️  Error: {e}", file=sys.stderr)
+            rechazar_fila(acc, fila, esquema, fecha_inicio, fecha_fin, meses)
+
+def rechazar_fila(
+    acc: Dict,
+    fila: list,
+    esquema: Esquema,
+    fecha_inicio: date,
+    fecha_fin: date,
+    meses: Optional[Dict[int, Dict]] = None
+):
+    """
+    Cuenta una fila que no se pudo procesar, con su moneda, en el acumulado
+    de su mes si la fecha se lee (fuera del periodo no cuenta, como un pago
+    válido) y si no en `acc`.
+    """
+    amount_raw, moneda_raw, fecha_raw = esquema.extraer(fila)[:3]
+    try:
+        fecha = esquema.leer_fecha(fecha_raw)
+    except Exception:
+        fecha = None
+    if fecha and not (fecha_inicio <= fecha < fecha_fin):
+        return
+    destino = meses[fecha.month] if meses is not None and fecha else acc
+    try:
+        moneda = moneda_de_columna(moneda_raw) or _separar_moneda(amount_raw)[1]
+    except Exception:
+        moneda = '?'
+    destino['filas_rechazadas'] += 1
+    destino['monedas_rechazadas'][moneda] = destino['monedas_rechazadas'].get(moneda, 0) + 1
+
+def cargar_numpy() -> bool:
+    """Importa NumPy la primera vez que hace falta. False si no está instalado."""
+    global np
+    if np is None:
+        try:
+            import numpy
+        except ImportError:
+            return False
+        np = numpy
+    return True
+
+# Filas por bloque del motor columnar; con menos, 'auto' no usa NumPy
+BLOQUE_COLUMNAR = 65536
+# Cota de los productos intermedios para operar en int64 sin desbordar
+LIMITE_INT64 = 2 ** 61
+
+def _dividir_np(numerador, denominador):
+    """dinero.dividir sobre arrays int64 (ROUND_HALF_UP, denominador > 0)."""
+    cociente = (2 * np.abs(numerador) + denominador) // (2 * denominador)
+    return np.where(numerador < 0, -cociente, cociente)
+
+def _factorizar(valores: Sequence) -> Tuple:
+    """Códigos int64 de cada valor y lista de valores distintos, en orden de aparición."""
+    distintos = list(dict.fromkeys(valores))
+    indices = {v: i for i, v in enumerate(distintos)}
+    codigos = np.fromiter(map(indices.__getitem__, valores), dtype=np.int64, count=len(valores))
+    return codigos, distintos
+
+def _agrupar(codigos, importes) -> List[Tuple[int, int, int]]:
+    """(código, nº de pagos, suma) por código, en orden de primera aparición."""
+    unicos, primeros, inverso, cuentas = np.unique(
+        codigos, return_index=True, return_inverse=True, return_counts=True
+    )
+    sumas = np.zeros(len(unicos), dtype=np.int64)
+    np.add.at(sumas, inverso, importes)
+    return [(int(unicos[i]), int(cuentas[i]), int(sumas[i])) for i in np.argsort(primeros, kind='stable')]
+
+def _acumular_bloque(
+    acc: Dict,
+    bloque: List[list],
+    esquema: Esquema,
+    fecha_inicio: date,
+    fecha_fin: date,
+    incluir_detalle: bool = True,
+    almacen=None,
+    meses: Optional[Dict[int, Dict]] = None
+) -> bool:
+    """
+    Motor columnar: acumula un bloque de filas de esquema.ancho valores (sin
+    la cola) con arrays NumPy en lugar de llamar a procesar_pago fila a fila. Cada texto distinto
+    (importe, moneda, fecha, país) se interpreta una sola vez con las mismas
+    funciones del motor por filas; el reparto UE/no-UE, la conversión, la
+    base/IVA y las agrupaciones por país y moneda son operaciones sobre
+    columnas int64 en céntimos, así que el resultado es idéntico.
+    
+    Devuelve False sin acumular nada si el bloque no se puede tratar por
+    columnas (valores que no son texto, importes que desbordarían int64,
+    monedas sin tipo de cambio); el llamador lo procesa entonces fila a fila.
+    """
+    if not bloque:
+        return True
+    ancho = esquema.ancho
+    
+    def columna(i: int) -> list:
+        if i < ancho:
+            return [fila[i] for fila in bloque]
+        return [esquema.cola[i - ancho]] * len(bloque)
+    
+    i_importe, i_moneda, i_fecha, i_substack, i_stripe, i_email = esquema.indices
+    importes_raw, fechas_raw, substack_raw, stripe_raw = map(columna, (i_importe, i_fecha, i_substack, i_stripe))
+    monedas_raw = columna(i_moneda)
+    emails = columna(i_email) if incluir_detalle else []
+    columnas_pais = [columna(i) for i in esquema.paises]
+    for valores in (importes_raw, fechas_raw, substack_raw, stripe_raw, emails, *columnas_pais):
+        if not set(map(type, valores)) <= {str}:
+            return False
+    if not set(map(type, monedas_raw)) <= {str, type(None)}:
+        return False
+    
+    monedas = []
+    indice_moneda = {}
+    def codigo_moneda(moneda: str) -> int:
+        if moneda not in indice_moneda:
+            indice_moneda[moneda] = len(monedas)
+            monedas.append(moneda)
+        return indice_moneda[moneda]
+    
+    # Importes y fees → céntimos (cada texto distinto se parsea una vez)
+    codigos, textos = _factorizar(importes_raw)
+    parseados = [parsear_centimos(t) for t in textos]
+    importe = np.array([c for c, _ in parseados], dtype=object)
+    moneda = np.array([codigo_moneda(m) for _, m in parseados], dtype=np.int64)[codigos]
+    fees = []
+    for columna in (substack_raw, stripe_raw):
+        codigos_fee, textos_fee = _factorizar(columna)
+        fees.append((np.array([parsear_centimos(t)[0] for t in textos_fee], dtype=object), codigos_fee))
+    maximo = max(int(np.abs(valores).max()) for valores in [importe] + [v for v, _ in fees])
+    if maximo >= LIMITE_INT64:
+        return False
+    importe = importe.astype(np.int64)[codigos]
+    substack_fee, stripe_fee = (valores.astype(np.int64)[codigos_fee] for valores, codigos_fee in fees)
+    
+    # Moneda de columna (si tiene valor) > moneda del símbolo
+    codigos, valores = _factorizar(monedas_raw)
+    valores = [moneda_de_columna(v) for v in valores]
+    moneda_columna = np.array([
+        codigo_moneda(v) if v is not None else -1 for v in valores
+    ], dtype=np.int64)[codigos]
+    moneda = np.where(moneda_columna >= 0, moneda_columna, moneda)
+    
+    # Fechas y filtro por periodo (ordinal 0: sin fecha)
+    codigos_fecha, textos = _factorizar(fechas_raw)
+    dias = [esquema.leer_fecha(t) for t in textos]
+    ordinal = np.array([d.toordinal() if d else 0 for d in dias], dtype=np.int64)[codigos_fecha]
+    validas = np.flatnonzero(
+        (importe > 0)
+        & ((ordinal == 0) | ((ordinal >= fecha_inicio.toordinal()) & (ordinal < fecha_fin.toordinal())))
+    )
+    if not len(validas):
+        return True
+    importe, moneda, ordinal = importe[validas], moneda[validas], ordinal[validas]
+    substack_fee, stripe_fee = substack_fee[validas], stripe_fee[validas]
+    codigos_fecha = codigos_fecha[validas]
+    
+    # País: primera columna con valor (billing > ip > otros); -1 sin país
+    paises = []
+    indice_pais = {}
+    pais = np.full(len(validas), -1, dtype=np.int64)
+    for columna in columnas_pais:
+        codigos, valores = _factorizar(columna)
+        normalizados = []
+        for v in valores:
+            v = v.strip().upper()
+            if v and v not in VALORES_NULOS:
+                if v not in indice_pais:
+                    indice_pais[v] = len(paises)
+                    paises.append(v)
+                normalizados.append(indice_pais[v])
+            else:
+                normalizados.append(-1)
+        codigo_pais = np.array(normalizados, dtype=np.int64)[codigos][validas]
+        pais = np.where(pais < 0, codigo_pais, pais)
+    # El índice -1 (sin país) cae en el último elemento: criterio conservador, UE
+    pago_es_ue = np.array([p in PAISES_UE for p in paises] + [True])[pais]
+    
+    # Conversión a EUR: una fracción por moneda (y día, con almacén del BCE)
+    clave = moneda * 4_000_000 + ordinal if almacen is not None else moneda
+    codigos_cambio, claves = _factorizar(clave.tolist())
+    cambios = []
+    try:
+        for k in claves:
+            m, o = divmod(k, 4_000_000) if almacen is not None else (k, 0)
+            cambios.append(fraccion_cambio(monedas[m], date.fromordinal(o) if o else None, almacen))
+    except ValueError:
+        # Moneda sin tipo de cambio: fila a fila, cada pago se informa como error
+        return False
+    if max(n for n, _, _ in cambios) * maximo >= LIMITE_INT64 or max(d for _, d, _ in cambios) >= LIMITE_INT64:
+        return False
+    numerador = np.array([n for n, _, _ in cambios], dtype=np.int64)[codigos_cambio]
+    denominador = np.array([d for _, d, _ in cambios], dtype=np.int64)[codigos_cambio]
+    importe_eur = _dividir_np(importe * numerador, denominador)
+    substack_fee = _dividir_np(substack_fee * numerador, denominador)
+    stripe_fee = _dividir_np(stripe_fee * numerador, denominador)
+    # Margen para la base (× 100 × 2) y para las sumas del bloque
+    mayor = max(int(np.abs(valores).max()) for valores in (importe, importe_eur, substack_fee, stripe_fee))
+    if mayor * len(validas) * 200 >= LIMITE_INT64:
+        return False
+    
+    # UE o sin país: IVA incluido → Base = Total / 1.21; no-UE: Base = Total
+    n_iva, d_iva = fraccion(DIVISOR_IVA)
+    base = np.where(pago_es_ue, _dividir_np(importe_eur * d_iva, n_iva), importe_eur)
+    iva = importe_eur - base
+    
+    # Reparto por acumulado de destino: 0 → acc; 1-12 → meses (modo año)
+    if meses is None:
+        destinos = {0: np.arange(len(validas))}
+    else:
+        mes = np.array([d.month if d else 0 for d in dias], dtype=np.int64)[codigos_fecha]
+        destinos = {int(m): np.flatnonzero(mes == m) for m in np.unique(mes)}
+    
+    codigo_eur = indice_moneda.get('EUR', -1)
+    for destino, filas in destinos.items():
+        parcial = nuevo_acumulado()
+        ue = pago_es_ue[filas]
+        eur = importe_eur[filas]
+        pais_filas = pais[filas]
+        sin_pais = pais_filas < 0
+        parcial.update(
+            cantidad_ue=int(ue.sum()),
+            cantidad_no_ue=int(len(filas) - ue.sum()),
+            cantidad_sin_pais=int(sin_pais.sum()),
+            total_bruto_ue=int(eur[ue].sum()),
+            total_base_ue=int(base[filas][ue].sum()),
+            total_iva_ue=int(iva[filas][ue].sum()),
+            total_base_no_ue=int(eur[~ue].sum()),
+            total_sin_pais=int(eur[sin_pais].sum()),
+            total_substack_fee=int(substack_fee[filas].sum()),
+            total_stripe_fee=int(stripe_fee[filas].sum()),
+        )
+        
+        convertidas = moneda[filas] != codigo_eur
+        if convertidas.any():
+            monedas_filas = moneda[filas][convertidas]
+            cambios_filas = codigos_cambio[filas][convertidas]
+            originales = importe[filas][convertidas]
+            en_eur = eur[convertidas]
+            for m, cuenta, total in _agrupar(monedas_filas, originales):
+                de_moneda = monedas_filas == m
+                cambios_moneda = cambios_filas[de_moneda]
+                tipos = {cambios[c][2] for c in np.unique(cambios_moneda).tolist()}
+                parcial['conversiones'][monedas[m]] = {
+                    'tc': cambios[int(cambios_moneda[0])][2] if len(tipos) == 1 else None,
+                    'original': total,
+                    'eur': int(en_eur[de_moneda].sum()),
+                    'count': cuenta,
+                }
+        
+        if ue.any():
+            for p, cuenta, total in _agrupar(pais_filas[ue], eur[ue]):
+                parcial['paises_ue'][paises[p] if p >= 0 else 'SIN_PAIS'] = {'count': cuenta, 'total': total}
+        if not ue.all():
+            for p, cuenta, total in _agrupar(pais_filas[~ue], eur[~ue]):
+                parcial['paises_no_ue'][paises[p]] = {'count': cuenta, 'total': total}
+        
+        if incluir_detalle:
+            columnas = zip(
+                validas[filas].tolist(), codigos_fecha[filas].tolist(), importe[filas].tolist(),
+                moneda[filas].tolist(), eur.tolist(), base[filas].tolist(), iva[filas].tolist(),
+                pais_filas.tolist(), ue.tolist(), substack_fee[filas].tolist(), stripe_fee[filas].tolist(),
+            )
+            for i, f, imp, m, e, b, v, p, es_ue_pago, sf, stf in columnas:
+                fecha = dias[f]
+                pago_proc = Pago(fecha, emails[i], imp, monedas[m], e, b, v,
+                                 paises[p] if p >= 0 else None, sf, stf)
+                if es_ue_pago:
+                    parcial['detalle_ue'].append(pago_proc)
+                else:
+                    parcial['detalle_no_ue'].append(pago_proc)
+        
+        fusionar_acumulados(meses[destino] if destino else acc, parcial)
+    return True
+
+def acumular_filas(
+    acc: Dict,
+    filas: Iterable[list],
+    esquema: Esquema,
+    fecha_inicio: date,
+    fecha_fin: date,
+    incluir_detalle: bool = True,
+    almacen=None,
+    meses: Optional[Dict[int, Dict]] = None,
+    motor: str = 'auto'
+):
+    """
+    Bucle principal: acumula filas (listas de valores) de un mismo esquema.
+    Con `meses` (mes → acumulado) cada pago con fecha va al acumulado de su
+    mes; en `acc` quedan el recuento de filas y los pagos sin fecha.
+    
+    `motor`: 'python' (fila a fila), 'numpy' (columnar, por bloques de
+    BLOQUE_COLUMNAR filas) o 'auto' (columnar si NumPy está instalado y el
+    archivo llena al menos un bloque). Todos dan el mismo resultado.
+    """
+    if motor == 'python':
+        filas = _filas_normalizadas(acc, filas, esquema)
+        _acumular_pagos(acc, filas, esquema, fecha_inicio, fecha_fin, incluir_detalle, almacen, meses)
+        return
+    if motor == 'numpy' and not cargar_numpy():
+        raise ImportError("El motor 'numpy' necesita NumPy (pip install numpy)")
+    
+    ancho = esquema.ancho
+    cola = list(esquema.cola)
+    columnar = motor == 'numpy'
+    filas = iter(filas)
+    while True:
+        leidas = list(islice(filas, BLOQUE_COLUMNAR))
+        if not leidas:
+            break
+        bloque = [fila for fila in leidas if fila]
+        acc['registros'] += len(bloque)
+        if any(len(fila) != ancho for fila in bloque):
+            bloque = [fila if len(fila) == ancho else (fila + [''] * ancho)[:ancho] for fila in bloque]
+        if not columnar and len(leidas) == BLOQUE_COLUMNAR:
+            columnar = cargar_numpy()
+        if not (columnar and _acumular_bloque(acc, bloque, esquema, fecha_inicio, fecha_fin, incluir_detalle, almacen, meses)):
+            bloque = [fila + cola for fila in bloque]
+            _acumular_pagos(acc, bloque, esquema, fecha_inicio, fecha_fin, incluir_detalle, almacen, meses)
+
+def acumular_dicts(
+    acc: Dict,
+    pagos: Iterable[Dict],
+    fecha_inicio: date,
+    fecha_fin: date,
+    incluir_detalle: bool = True,
+    almacen=None,
+    meses: Optional[Dict[int, Dict]] = None,
+    motor: str = 'auto'
+):
+    """Acumula pagos en forma de dict (JSON); los consecutivos con las mismas claves comparten esquema."""
+    esquemas = {}
+    for claves, grupo in groupby(pagos, key=tuple):
+        esquema = esquemas.get(claves)
+        if esquema is None:
+            esquema = esquemas[claves] = compilar_esquema(claves)
+        filas = (list(pago.values()) for pago in grupo)
+        acumular_filas(acc, filas, esquema, fecha_inicio, fecha_fin, incluir_detalle, almacen, meses, motor)
+
+def acumular_archivo(
+    acc: Dict,
+    archivo: str,
+    formato: str,
+    fecha_inicio: date,
+    fecha_fin: date,
+    incluir_detalle: bool = True,
+    almacen=None,
+    meses: Optional[Dict[int, Dict]] = None,
+    motor: str = 'auto',
+    omitir: Optional[Set[int]] = None
+) -> Dict:
+    """
+    Acumula un archivo de pagos; los CSV se leen sin crear un dict por fila.
+    `omitir`: posiciones (fila de datos del CSV u objeto del JSON, desde 1)
+    que no se cuentan, como los pagos repetidos de duplicados.py.
+    """
+    if formato == 'csv':
+        filas = leer_filas_csv(archivo)
+        esquema = compilar_esquema(next(filas, []))
+        if omitir:
+            filas = (fila for n, fila in enumerate(filas, 1) if n not in omitir)
+        acumular_filas(acc, filas, esquema, fecha_inicio, fecha_fin, incluir_detalle, almacen, meses, motor)
+    else:
+        lector = iterar_ndjson if formato == 'ndjson' else iterar_json
+        pagos = lector(archivo)
+        if omitir:
+            pagos = (pago for n, pago in enumerate(pagos, 1) if n not in omitir)
+        acumular_dicts(acc, pagos, fecha_inicio, fecha_fin, incluir_detalle, almacen, meses, motor)
+    return acc
+
+def fusionar_acumulados(acc: Dict, parcial: Dict) -> Dict:
+    """
+    Suma a `acc` un acumulado parcial (de otro archivo o proceso).
+    Solo hay sumas de enteros (céntimos), así que el resultado es exacto y,
+    fusionando siempre en el mismo orden, idéntico al de una sola pasada.
+    """
+    for clave, valor in parcial.items():
+        if isinstance(valor, int):
+            acc[clave] += valor
+    
+    for moneda, d in parcial['conversiones'].items():
+        conversion = acc['conversiones'].get(moneda)
+        if conversion is None:
+            acc['conversiones'][moneda] = dict(d)
+            continue
+        if conversion['tc'] != d['tc']:
+            conversion['tc'] = None
+        conversion['original'] += d['original']
+        conversion['eur'] += d['eur']
+        conversion['count'] += d['count']
+    
+    rechazadas = acc['monedas_rechazadas']
+    for moneda, cantidad in parcial['monedas_rechazadas'].items():
+        rechazadas[moneda] = rechazadas.get(moneda, 0) + cantidad
+    
+    for clave in ('paises_ue', 'paises_no_ue'):
+        paises = acc[clave]
+        for pais, d in parcial[clave].items():
+            if pais in paises:
+                paises[pais]['count'] += d['count']
+                paises[pais]['total'] += d['total']
+            else:
+                paises[pais] = dict(d)
+    
+    for clave in ('detalle_ue', 'detalle_no_ue'):
+        acc[clave].extend(parcial[clave])
+    return acc
+
+def procesar_filas(
+    filas: Iterable[list],
+    cabecera: Sequence[str],
+    trimestre: int,
+    año: int,
+    incluir_detalle: bool = True,
+    almacen=None,
+    motor: str = 'auto'
+) -> Dict:
+    """Procesa filas de un CSV (csv.reader) con su cabecera."""
+    fecha_inicio, fecha_fin = rango_trimestre(trimestre, año)
+    with abrir_detalle(incluir_detalle) as detalle:
+        acc = nuevo_acumulado(detalle)
+        acumular_filas(acc, filas, compilar_esquema(cabecera), fecha_inicio, fecha_fin, detalle, almacen, motor=motor)
+    resultado = formatear_resultado(acc, trimestre, año, incluir_detalle)
+    resultado['registros_leidos'] = acc['registros']
+    return resultado
+
+def procesar_substack_stripe(
+    pagos: Iterable[Dict],
+    trimestre: int,
+    año: int,
+    incluir_detalle: bool = True,
+    almacen=None,
+    motor: str = 'auto'
+) -> Dict:
+    """
+    Procesa pagos de Substack o Stripe.
+    
+    `pagos` puede ser cualquier iterable de dicts (lista o generador como
+    iterar_json): se recorre una sola vez y no se guarda. Con
+    incluir_detalle=False no se conserva ninguna lista por pago y la memoria
+    no crece con el archivo; con un Detalle, solo los mayores pagos, una
+    muestra o un NDJSON escrito al procesar. Con `almacen` (tipos_cambio.cargar_almacen) cada
+    pago se convierte al tipo del BCE de su fecha. `motor`: ver acumular_filas.
+    """
+    fecha_inicio, fecha_fin = rango_trimestre(trimestre, año)
+    with abrir_detalle(incluir_detalle) as detalle:
+        acc = nuevo_acumulado(detalle)
+        acumular_dicts(acc, pagos, fecha_inicio, fecha_fin, detalle, almacen, motor=motor)
+    resultado = formatear_resultado(acc, trimestre, año, incluir_detalle)
+    resultado['registros_leidos'] = acc['registros']
+    return resultado
+
+def procesar_archivo(
+    archivo: str,
+    formato: str,
+    trimestre: int,
+    año: int,
+    incluir_detalle: bool = True,
+    almacen=None,
+    motor: str = 'auto'
+) -> Dict:
+    """Procesa un archivo de pagos (ver acumular_archivo)."""
+    return procesar_archivos([archivo], formato, trimestre, año, incluir_detalle, almacen, procesos=1, motor=motor)
+
+# Almacenes de tipos de cambio abiertos en cada proceso trabajador
+_ALMACENES = {}
+
+def _acumular_parcial(
+    archivo: str,
+    formato: str,
+    trimestre: Optional[int],
+    año: int,
+    incluir_detalle: bool,
+    almacen=None,
+    motor: str = 'auto',
+    omitir: Optional[Set[int]] = None
+) -> Tuple[Dict, Optional[Dict[int, Dict]]]:
+    """Acumulados de un solo archivo (el parcial que se fusiona y se guarda en caché)."""
+    fecha_inicio, fecha_fin = rango_trimestre(trimestre, año)
+    with abrir_detalle(incluir_detalle) as detalle:
+        acc = nuevo_acumulado(detalle)
+        meses = {mes: nuevo_acumulado(detalle) for mes in range(1, 13)} if trimestre is None else None
+        acumular_archivo(acc, archivo, formato, fecha_inicio, fecha_fin, detalle, almacen, meses, motor, omitir)
+    return acc, meses
+
+def _acumular_en_proceso(
+    archivo: str,
+    formato: str,
+    trimestre: Optional[int],
+    año: int,
+    incluir_detalle: bool,
+    ruta_tipos_cambio: Optional[str],
+    motor: str = 'auto',
+    omitir: Optional[Set[int]] = None
+) -> Tuple[Dict, Optional[Dict[int, Dict]]]:
+    """Tarea de un trabajador: acumulados parciales de un archivo."""
+    almacen = None
+    if ruta_tipos_cambio:
+        almacen = _ALMACENES.get(ruta_tipos_cambio)
+        if almacen is None:
+            from tipos_cambio import AlmacenTiposCambio
+            almacen = _ALMACENES[ruta_tipos_cambio] = AlmacenTiposCambio(ruta_tipos_cambio)
+    return _acumular_parcial(archivo, formato, trimestre, año, incluir_detalle, almacen, motor, omitir)
+
+def rutas_detalle(directorio: str, archivos: List[str]) -> List[str]:
+    """NDJSON de detalle de cada archivo: 001_pagos.csv.ndjson, 002_..."""
+    return [os.path.join(directorio, f'{i:03d}_{os.path.basename(archivo)}.ndjson')
+            for i, archivo in enumerate(archivos, 1)]
+
+def acumular_archivos(
+    archivos: List[str],
+    formato: str,
+    trimestre: Optional[int],
+    año: int,
+    incluir_detalle: bool = True,
+    almacen=None,
+    procesos: Optional[int] = None,
+    motor: str = 'auto',
+    cache=None,
+    omitir: Optional[List[Set[int]]] = None
+) -> Tuple[Dict, Optional[Dict[int, Dict]]]:
+    """
+    Acumula varios archivos de pagos como si fueran uno.
+    
+    Con más de un archivo, cada uno se acumula en un proceso aparte
+    (ProcessPoolExecutor, `procesos` trabajadores; por defecto uno por CPU)
+    y los parciales se fusionan en el orden de `archivos`, así que el
+    resultado no depende de qué proceso termine antes.
+    
+    Con `cache` (ver cache.py) el parcial de cada archivo sin cambios se
+    lee de disco y solo se procesan los archivos nuevos o modificados.
+    Con Detalle('ndjson', ruta=directorio) cada archivo escribe su detalle
+    en su propio NDJSON (ver rutas_detalle) y no se usa la caché.
+    
+    Con trimestre=None se acumula el año entero repartido por meses.
+    `omitir`: posiciones que no se cuentan de cada archivo (ver
+    acumular_archivo y duplicados.marcar_duplicados).
+    Returns: (acumulado, acumulados por mes o None)
+    """
+    if omitir is None:
+        omitir = [None] * len(archivos)
+    if procesos is None:
+        procesos = os.cpu_count() or 1
+    ruta_tipos_cambio = almacen.ruta if almacen is not None else None
+    
+    # Con Detalle('ndjson', ruta=directorio), un NDJSON por archivo: siempre por parciales
+    ndjson = isinstance(incluir_detalle, Detalle) and incluir_detalle.modo == 'ndjson'
+    if ndjson:
+        os.makedirs(incluir_detalle.ruta, exist_ok=True)
+        detalles = [incluir_detalle._replace(ruta=ruta) for ruta in rutas_detalle(incluir_detalle.ruta, archivos)]
+    else:
+        detalles = [incluir_detalle] * len(archivos)
+    
+    if cache is None and min(procesos, len(archivos)) <= 1 and not ndjson:
+        fecha_inicio, fecha_fin = rango_trimestre(trimestre, año)
+        acc = nuevo_acumulado(incluir_detalle)
+        meses = {mes: nuevo_acumulado(incluir_detalle) for mes in range(1, 13)} if trimestre is None else None
+        for archivo, omitidas in zip(archivos, omitir):
+            acumular_archivo(acc, archivo, formato, fecha_inicio, fecha_fin, incluir_detalle, almacen, meses, motor,
+                             omitidas)
+        return acc, meses
+    
+    parciales = [None] * len(archivos)
+    claves = []
+    if cache is not None and not ndjson:
+        from cache import huella_archivo
+        # El motor no cambia el resultado; los tipos de cambio sí
+        tipos_cambio = huella_archivo(ruta_tipos_cambio) if ruta_tipos_cambio else None
+        for i, archivo in enumerate(archivos):
+            omitidas = tuple(sorted(omitir[i])) if omitir[i] else None
+            claves.append(cache.clave(archivo, 'procesar_stripe', formato, trimestre, año, incluir_detalle, tipos_cambio,
+                                      omitidas))
+            parciales[i] = cache.leer(claves[i])
+    pendientes = [i for i, parcial in enumerate(parciales) if parcial is None]
+    
+    if min(procesos, len(pendientes)) <= 1:
+        for i in pendientes:
+            parciales[i] = _acumular_parcial(archivos[i], formato, trimestre, año, detalles[i], almacen, motor,
+                                             omitir[i])
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=min(procesos, len(pendientes))) as pool:
+            calculados = pool.map(
+                _acumular_en_proceso,
+                [archivos[i] for i in pendientes],
+                repeat(formato), repeat(trimestre), repeat(año),
+                [detalles[i] for i in pendientes], repeat(ruta_tipos_cambio), repeat(motor),
+                [omitir[i] for i in pendientes],
+            )
+            for i, parcial in zip(pendientes, calculados):
+                parciales[i] = parcial
+    if claves:
+        for i in pendientes:
+            cache.guardar(claves[i], parciales[i])
+    
+    acc = nuevo_acumulado(incluir_detalle)
+    meses = None
+    for parcial, meses_parcial in parciales:
+        fusionar_acumulados(acc, parcial)
+        if meses_parcial is not None:
+            if meses is None:
+                meses = {mes: nuevo_acumulado(incluir_detalle) for mes in meses_parcial}
+            for mes, acc_mes in meses_parcial.items():
+                fusionar_acumulados(meses[mes], acc_mes)
+    return acc, meses
+
+def elegir_detalle(
+    sin_detalle: bool = False,
+    ndjson: Optional[str] = None,
+    mayores: Optional[int] = None,
+    muestra: Optional[int] = None
+):
+    """`incluir_detalle` de las opciones --sin-detalle, --detalle-ndjson, --detalle-mayores y --detalle-muestra."""
+    if ndjson:
+        return Detalle('ndjson', ruta=ndjson)
+    if mayores:
+        return Detalle('mayores', mayores)
+    if muestra:
+        return Detalle('muestra', muestra)
+    return not sin_detalle
+
+def anotar_detalle(resultado: Dict, incluir_detalle, archivos: List[str]):
+    """Añade al reporte qué detalle lleva (con un Detalle): modo y límite, o los NDJSON escritos."""
+    if isinstance(incluir_detalle, Detalle):
+        resultado['detalle'] = {'modo': incluir_detalle.modo}
+        if incluir_detalle.modo == 'ndjson':
+            resultado['detalle']['archivos'] = rutas_detalle(incluir_detalle.ruta, archivos)
+        else:
+            resultado['detalle']['limite'] = incluir_detalle.limite
+
+def procesar_archivos(
+    archivos: List[str],
+    formato: str,
+    trimestre: int,
+    año: int,
+    incluir_detalle: bool = True,
+    almacen=None,
+    procesos: Optional[int] = None,
+    motor: str = 'auto',
+    cache=None,
+    omitir: Optional[List[Set[int]]] = None
+) -> Dict:
+    """Procesa varios archivos de pagos como si fueran uno (ver acumular_archivos)."""
+    acc, _ = acumular_archivos(archivos, formato, trimestre, año, incluir_detalle, almacen, procesos, motor, cache,
+                               omitir)
+    resultado = formatear_resultado(acc, trimestre, año, incluir_detalle)
+    resultado['registros_leidos'] = acc['registros']
+    return resultado
+
+def formatear_año(acc: Dict, meses: Dict[int, Dict], año: int, incluir_detalle: bool = True) -> Dict:
+    """
+    Reportes de los cuatro trimestres, de cada mes y del año a partir de una
+    sola pasada. El detalle por pago solo se incluye en los trimestres.
+    
+    Los pagos sin fecha (en `acc`) se declaran en el 4T, no en cada
+    trimestre (su IVA se ingresaría varias veces): cuentan una sola vez y
+    los cuatro trimestres suman el total anual. Es la misma regla que
+    contabilidad.informe y calcular_ejercicio. Al procesar un trimestre
+    suelto entran en ese trimestre: el archivo es el del trimestre.
+    """
+    trimestres = {}
+    for trimestre in range(1, 5):
+        acc_trimestre = nuevo_acumulado(incluir_detalle)
+        if trimestre == 4:
+            fusionar_acumulados(acc_trimestre, acc)
+        for mes in range(trimestre * 3 - 2, trimestre * 3 + 1):
+            fusionar_acumulados(acc_trimestre, meses[mes])
+        trimestres[f'{trimestre}T'] = formatear_resultado(acc_trimestre, trimestre, año, incluir_detalle)
+    
+    reportes_meses = {}
+    for mes, acc_mes in meses.items():
+        reporte = formatear_resultado(acc_mes, (mes - 1) // 3 + 1, año, False, f'{mes:02d}/{año}')
+        reportes_meses[f'{mes:02d}'] = {
+            clave: reporte[clave]
+            for clave in ('periodo', 'resumen', 'fees', 'modelo_303', 'modelo_130')
+        }
+    
+    acc_anual = fusionar_acumulados(nuevo_acumulado(), acc)
+    for acc_mes in meses.values():
+        fusionar_acumulados(acc_anual, acc_mes)
+    anual = formatear_resultado(acc_anual, None, año, False, f'Año {año}')
+    for clave in ('detalle_ue', 'detalle_no_ue', 'detalle_sin_pais'):
+        del anual[clave]
+    
+    return {
+        'periodo': {'trimestre': None, 'año': año, 'descripcion': f'Año {año}'},
+        'registros_leidos': acc['registros'],
+        'sin_fecha': acc['cantidad_ue'] + acc['cantidad_no_ue'],
+        'filas_rechazadas': anual['resumen']['filas_rechazadas']['cantidad'],
+        'anual': anual,
+        'trimestres': trimestres,
+        'meses': reportes_meses,
+    }
+
+def procesar_año_completo(
+    archivos: List[str],
+    formato: str,
+    año: int,
+    incluir_detalle: bool = True,
+    almacen=None,
+    procesos: Optional[int] = None,
+    motor: str = 'auto',
+    cache=None,
+    omitir: Optional[List[Set[int]]] = None
+) -> Dict:
+    """Procesa el año entero en una pasada (ver formatear_año)."""
+    acc, meses = acumular_archivos(archivos, formato, None, año, incluir_detalle, almacen, procesos, motor, cache,
+                                   omitir)
+    return formatear_año(acc, meses, año, incluir_detalle)
+
+def expandir_archivos(patrones: List[str]) -> List[str]:
+    """Expande rutas y comodines (glob) manteniendo el orden y sin repetir."""
+    archivos = []
+    for patron in patrones:
+        coincidencias = sorted(glob.glob(patron)) if glob.has_magic(patron) else [patron]
+        for archivo in coincidencias:
+            if archivo not in archivos:
+                archivos.append(archivo)
+    return archivos
+
+def leer_filas_csv(archivo: str) -> Iterator[List[str]]:
+    """Lee un CSV fila a fila como listas (la primera es la cabecera)."""
+    with open(archivo, 'r', encoding='utf-8', newline='') as f:
+        yield from csv.reader(f)
+
+def iterar_csv(archivo: str) -> Iterator[Dict]:
+    """Lee un CSV fila a fila como dicts, sin cargarlo entero en memoria."""
     with open(archivo, 'r', encoding='utf-8') as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            pagos.append(row)
-    return pagos
+        yield from csv.DictReader(f)
 
-def cargar_json(archivo: str) -> List[Dict]:
+def iterar_json(archivo: str) -> Iterator[Dict]:
+    """Lee pagos de un JSON (lista u objeto con 'data'). Se carga entero."""
     with open(archivo, 'r', encoding='utf-8') as f:
         data = json.load(f)
-        return data if isinstance(data, list) else data.get('data', [data])
+    yield from (data if isinstance(data, list) else data.get('data', [data]))
+
+def iterar_ndjson(archivo: str) -> Iterator[Dict]:
+    """Lee pagos de un NDJSON (un objeto por línea), en streaming."""
+    with open(archivo, 'r', encoding='utf-8') as f:
+        for linea in f:
+            if linea.strip():
+                yield json.loads(linea)
+
+def cargar_csv(archivo: str) -> List[Dict]:
+    return list(iterar_csv(archivo))
+
+def cargar_json(archivo: str) -> List[Dict]:
+    return list(iterar_json(archivo))
+
+def instrumentar(perfil: perfilado.Perfil):
+    """
+    Sustituye las funciones de cada etapa por versiones cronometradas (solo
+    con --profile). El país se busca dentro de procesar_pago: su tiempo es
+    parte de los 'segundos propios' de esa etapa.
+    """
+    global leer_filas_csv, iterar_json, iterar_ndjson, parsear_centimos
+    global crear_lector_fechas, convertir_centimos, procesar_pago, acumular_pago
+    global _acumular_bloque, formatear_resultado, formatear_año
+    
+    leer_filas_csv = perfil.cronometrar_iterador('lectura_csv', leer_filas_csv)
+    iterar_json = perfil.cronometrar_iterador('lectura_json', iterar_json)
+    iterar_ndjson = perfil.cronometrar_iterador('lectura_ndjson', iterar_ndjson)
+    parsear_centimos = perfil.cronometrar('parsear_importe', parsear_centimos)
+    fechas.parsear_fecha = perfil.cronometrar('parsear_fecha', fechas.parsear_fecha)
+    convertir_centimos = perfil.cronometrar('convertir_a_eur', convertir_centimos)
+    procesar_pago = perfil.cronometrar('procesar_pago', procesar_pago, por_fila=True)
+    acumular_pago = perfil.cronometrar('acumular_pago', acumular_pago)
+    _acumular_bloque = perfil.cronometrar('motor_columnar', _acumular_bloque)
+    formatear_resultado = perfil.cronometrar('formatear_resultado', formatear_resultado)
+    formatear_año = perfil.cronometrar('formatear_año', formatear_año)
+    
+    crear_lector = crear_lector_fechas
+    crear_lector_fechas = lambda *args: perfil.cronometrar('leer_fecha', crear_lector(*args))
+
+def imprimir_año(resultado: Dict):
+    """Tabla resumen del modo año completo."""
+    print("\n" + "="*86)
+    print(f"   REPORTE FISCAL STRIPE/SUBSTACK - {resultado['periodo']['descripcion']}")
+    print("="*86)
+    print(f"\n   {'Periodo':<9}{'Pagos':>7}{'Base 21%':>13}{'Cuota 21%':>12}{'Export.':>13}{'Fees':>11}{'Rdto. neto':>14}")
+    print(f"   {'-'*79}")
+    
+    def fila(nombre: str, reporte: Dict):
+        m303 = reporte['modelo_303']
+        m130 = reporte['modelo_130']
+        print(f"   {nombre:<9}{reporte['resumen']['total_pagos']:>7}"
+              f"{float(m303['casilla_01_base_21']):>13,.2f}{float(m303['casilla_03_cuota_21']):>12,.2f}"
+              f"{float(m303['casilla_60_exportaciones']):>13,.2f}{float(m130['gastos_fees']):>11,.2f}"
+              f"{float(m130['rendimiento_neto']):>14,.2f}")
+    
+    for mes, reporte in resultado['meses'].items():
+        fila(f"  {mes}", reporte)
+        if mes in ('03', '06', '09', '12'):
+            trimestre = f"{int(mes) // 3}T"
+            fila(trimestre, resultado['trimestres'][trimestre])
+            print(f"   {'-'*79}")
+    fila('AÑO', resultado['anual'])
+    
+    if resultado['sin_fecha']:
+        print(f"\n   ⚠️  {resultado['sin_fecha']} pagos sin fecha: declarados en el 4T (una vez en el año)")
+    if resultado['filas_rechazadas']:
+        print(f"   ⚠️  {resultado['filas_rechazadas']} filas rechazadas: no están en los totales")
+    print("="*86 + "\n")
 
 def main():
     parser = argparse.ArgumentParser(
@@ -391,32 +1484,113 @@ REGLAS APLICADAS:
   3. Fees de Substack/Stripe = gastos deducibles IRPF
 
 Ejemplo: python3 procesar_stripe.py --archivo pagos.csv --trimestre 4 --año 2025
+Tipos diarios del BCE: ... --tipos-cambio eurofxref-hist.csv [--offline]
         """
     )
     
-    parser.add_argument('--archivo', required=True)
-    parser.add_argument('--trimestre', type=int, required=True, choices=[1,2,3,4])
+    parser.add_argument('--archivo', required=True, nargs='+',
+                        help='Uno o varios archivos; admite comodines (ej: "pagos/2025-*.csv")')
+    parser.add_argument('--trimestre', type=int, choices=[1,2,3,4],
+                        help='Sin --trimestre: año completo (4 trimestres, meses y total) en una pasada')
     parser.add_argument('--año', type=int, required=True)
-    parser.add_argument('--formato', choices=['csv', 'json'], default='csv')
+    parser.add_argument('--formato', choices=['csv', 'json', 'ndjson'], default='csv')
     parser.add_argument('--json', action='store_true', help='Salida JSON')
+    detalle = parser.add_mutually_exclusive_group()
+    detalle.add_argument('--sin-detalle', action='store_true',
+                         help='Solo resumen: no conservar el detalle por pago (memoria constante)')
+    detalle.add_argument('--detalle-ndjson', type=str, metavar='DIRECTORIO',
+                         help='Escribir el detalle al procesar, un NDJSON por archivo en DIRECTORIO, '
+                              'en lugar de incluirlo en el reporte')
+    detalle.add_argument('--detalle-mayores', type=int, metavar='N',
+                         help='Incluir solo los N pagos de mayor importe de cada grupo (UE / no-UE)')
+    detalle.add_argument('--detalle-muestra', type=int, metavar='N',
+                         help='Incluir una muestra uniforme (reproducible) de N pagos de cada grupo')
     parser.add_argument('--exportar', type=str)
-    parser.add_argument('--offline', action='store_true')
+    parser.add_argument('--procesos', type=int,
+                        help='Procesos en paralelo con varios archivos (default: nº de CPUs)')
+    parser.add_argument('--tipos-cambio', type=str,
+                        help='Tipos del BCE por día (CSV eurofxref-hist o binario de tipos_cambio.py)')
+    parser.add_argument('--offline', action='store_true',
+                        help='No descargar los tipos del BCE si falta el archivo de --tipos-cambio')
+    parser.add_argument('--motor', choices=['auto', 'python', 'numpy'], default='auto',
+                        help='auto: columnar con NumPy si está instalado y el archivo es grande (mismo resultado)')
+    parser.add_argument('--indice-duplicados', type=str, metavar='INDICE',
+                        help='No contar dos veces los pagos repetidos entre archivos (índice en disco, ver duplicados.py)')
+    parser.add_argument('--bloom', action='store_true',
+                        help='Con --indice-duplicados: crear el índice con filtro de Bloom (históricos muy grandes)')
+    perfilado.añadir_argumento(parser)
+    cache.añadir_argumento(parser)
     
     args = parser.parse_args()
     
+    if args.motor == 'numpy' and not cargar_numpy():
+        parser.error("--motor numpy necesita NumPy (pip install numpy)")
+    if args.bloom and not args.indice_duplicados:
+        parser.error("--bloom necesita --indice-duplicados")
+    for limite in (args.detalle_mayores, args.detalle_muestra):
+        if limite is not None and limite < 1:
+            parser.error("--detalle-mayores y --detalle-muestra necesitan N >= 1")
+    
+    incluir_detalle = elegir_detalle(args.sin_detalle, args.detalle_ndjson, args.detalle_mayores, args.detalle_muestra)
+    
+    # Con --profile todo se ejecuta en este proceso, para poder medirlo
+    perfil = perfilado.crear(args.profile)
+    procesos = args.procesos
+    if perfil is not None:
+        instrumentar(perfil)
+        procesos = 1
+    
     try:
-        pagos = cargar_json(args.archivo) if args.formato == 'json' else cargar_csv(args.archivo)
-        print(f"📥 {len(pagos)} registros cargados", file=sys.stderr)
+        almacen = None
+        if args.tipos_cambio:
+            from tipos_cambio import cargar_almacen
+            with perfilado.etapa(perfil, 'cargar_tipos_cambio'):
+                almacen = cargar_almacen(args.tipos_cambio, offline=args.offline)
+        
+        archivos = expandir_archivos(args.archivo)
+        if not archivos:
+            parser.error(f"Ningún archivo coincide con {' '.join(args.archivo)}")
         
-        resultado = procesar_substack_stripe(pagos, args.trimestre, args.año)
+        omitir = duplicados = None
+        if args.indice_duplicados:
+            from duplicados import marcar_duplicados
+            with perfilado.etapa(perfil, 'duplicados'):
+                omitir, duplicados = marcar_duplicados(archivos, args.formato, args.indice_duplicados, args.bloom)
+            print(f"🔁 {duplicados['repetidas']} pagos repetidos omitidos "
+                  f"(índice {args.indice_duplicados}: {duplicados['claves']} claves)", file=sys.stderr)
+        
+        parciales = cache.crear(args.cache and not args.no_cache)
+        with perfilado.etapa(perfil, 'total_procesamiento'):
+            if args.trimestre is None:
+                resultado = procesar_año_completo(
+                    archivos, args.formato, args.año,
+                    incluir_detalle=incluir_detalle, almacen=almacen, procesos=procesos,
+                    motor=args.motor, cache=parciales, omitir=omitir
+                )
+            else:
+                resultado = procesar_archivos(
+                    archivos, args.formato, args.trimestre, args.año,
+                    incluir_detalle=incluir_detalle, almacen=almacen, procesos=procesos,
+                    motor=args.motor, cache=parciales, omitir=omitir
+                )
+        if duplicados is not None:
+            resultado['duplicados'] = duplicados
+        print(f"📥 {resultado['registros_leidos']} registros leídos de {len(archivos)} archivo(s)"
+              f"{f' ({parciales.aciertos} desde la caché)' if parciales and parciales.aciertos else ''}", file=sys.stderr)
+        anotar_detalle(resultado, incluir_detalle, archivos)
+        if args.detalle_ndjson:
+            print(f"📝 Detalle por pago en {args.detalle_ndjson}/", file=sys.stderr)
         
         if args.exportar:
-            with open(args.exportar, 'w', encoding='utf-8') as f:
-                json.dump(resultado, f, indent=2, ensure_ascii=False)
+            with perfilado.etapa(perfil, 'exportar_json'), open(args.exportar, 'w', encoding='utf-8') as f:
+                json.dump(resultado, f, indent=2, ensure_ascii=False, default=serializar)
             print(f"✅ Exportado a {args.exportar}", file=sys.stderr)
         
         if args.json:
-            print(json.dumps(resultado, indent=2, ensure_ascii=False))
+            with perfilado.etapa(perfil, 'salida_json'):
+                print(json.dumps(resultado, indent=2, ensure_ascii=False, default=serializar))
+        elif args.trimestre is None:
+            imprimir_año(resultado)
         else:
             r = resultado['resumen']
             m303 = resultado['modelo_303']
@@ -430,6 +1604,8 @@ Ejemplo: python3 procesar_stripe.py --archivo pagos.csv --trimestre 4 --año 202
             print(f"\n📊 RESUMEN GENERAL")
             print(f"   Total pagos procesados:        {r['total_pagos']}")
             print(f"   Total cobrado (Bruto):     {float(r['total_bruto_eur']):>12,.2f} EUR")
+            if r['filas_rechazadas']['cantidad']:
+                print(f"   ⚠️  Filas rechazadas (no incluidas): {r['filas_rechazadas']['cantidad']}")
             
             print(f"\n{'-'*70}")
             print(f"1. INGRESOS SUJETOS A IVA (CLIENTES UE)")
@@ -466,7 +1642,8 @@ Ejemplo: python3 procesar_stripe.py --archivo pagos.csv --trimestre 4 --año 202
                 print(f"💱 CONVERSIONES DE MONEDA")
                 print(f"{'-'*70}")
                 for m, d in resultado['conversiones'].items():
-                    print(f"   {m}: {d['count']} pagos, TC={d['tc']}")
+                    origen = " (medio, BCE diario)" if d.get('tc_diario') else ""
+                    print(f"   {m}: {d['count']} pagos, TC={d['tc']}{origen}")
                     print(f"        {float(d['original']):,.2f} {m} → {float(d['eur']):,.2f} EUR")
             
             print(f"\n{'-'*70}")
@@ -507,7 +1684,17 @@ Ejemplo: python3 procesar_stripe.py --archivo pagos.csv --trimestre 4 --año 202
             print(f"   • Exportaciones: Clientes no-UE exentos de IVA")
             print(f"   • Fees: Gastos deducibles para IRPF (no para IVA)")
             print("="*70 + "\n")
-            
+        
+        if perfil is not None:
+            perfil.emitir(args.profile, filas=resultado['registros_leidos'])
+        
+        # Con filas rechazadas los totales están incompletos: código de salida 1
+        rechazadas = (resultado['anual'] if args.trimestre is None else resultado)['resumen']['filas_rechazadas']
+        if rechazadas['cantidad']:
+            monedas = ', '.join(f'{m}: {n}' for m, n in sorted(rechazadas['monedas'].items()))
+            print(f"❌ {rechazadas['cantidad']} filas rechazadas ({monedas}): no están en los totales", file=sys.stderr)
+            sys.exit(1)
+    
     except Exception as e:
         print(f"❌ Error: {e}", file=sys.stderr)
         import traceback
@@ -0,0 +1,181 @@
+"""
+Registros compactos compartidos por los scripts: un pago de Stripe/Substack
+y una factura.
+
+Los informes con detalle guardan una fila por pago o factura. Con un dict de
+textos ya formateados cada fila ocupa del orden de 1 KB; estas clases usan
+__slots__ (sin __dict__ por instancia), guardan los importes como números
+(céntimos) y comparten los textos repetidos: códigos de país y moneda,
+fechas y NIFs internados, y tipos de IVA/retención como un único Decimal por
+valor. Solo se convierten en dicts de textos al serializarlos:
+    
+    json.dumps(resultado, default=registros.serializar)
+"""
+
+import sys
+from abc import ABC, abstractmethod
+from datetime import date
+from decimal import Decimal
+from functools import lru_cache
+from typing import Optional
+
+from dinero import a_texto
+
+# Una sola copia de cada código (ES, EUR...), NIF o fecha en texto
+codigo = sys.intern
+
+@lru_cache(maxsize=1024)
+def tipo_decimal(texto: str) -> Decimal:
+    """'21', '10,5' → Decimal compartido (los tipos de IVA y retención se repiten)."""
+    return Decimal(texto.replace(',', '.'))
+
+class Registro(ABC):
+    """Base de los registros: serializables con a_dict()."""
+    __slots__ = ()
+    
+    @abstractmethod
+    def a_dict(self) -> dict:
+        """Dict de textos del registro (lo que se escribe en el JSON)."""
+    
+    @abstractmethod
+    def argumentos(self) -> tuple:
+        """Argumentos del constructor que reproducen el registro."""
+    
+    def __reduce__(self):
+        # pickle (caché, procesos) vía el constructor: mucho más rápido que
+        # el estado genérico de los objetos con __slots__
+        return type(self), self.argumentos()
+    
+    def __repr__(self) -> str:
+        return f'{type(self).__name__}({self.a_dict()!r})'
+
+def serializar(objeto):
+    """`default` de json.dump(s): cada registro se convierte a dict al escribirlo."""
+    if isinstance(objeto, Registro):
+        return objeto.a_dict()
+    raise TypeError(f'{type(objeto).__name__} no es serializable a JSON')
+
+class Pago(Registro):
+    """Pago clasificado de Stripe/Substack (importes en céntimos; pais None = sin país)."""
+    __slots__ = ('fecha', 'email', 'importe', 'moneda', 'total_eur', 'base', 'iva',
+                 'pais', 'substack_fee', 'stripe_fee')
+    
+    def __init__(self, fecha: Optional[date], email: str, importe: int, moneda: str, total_eur: int,
+                 base: int, iva: int, pais: Optional[str], substack_fee: int, stripe_fee: int):
+        self.fecha = fecha
+        self.email = email
+        self.importe = importe
+        self.moneda = moneda
+        self.total_eur = total_eur
+        self.base = base
+        self.iva = iva
+        self.pais = pais
+        self.substack_fee = substack_fee
+        self.stripe_fee = stripe_fee
+    
+    def argumentos(self) -> tuple:
+        return (self.fecha, self.email, self.importe, self.moneda, self.total_eur,
+                self.base, self.iva, self.pais, self.substack_fee, self.stripe_fee)
+    
+    def a_dict(self) -> dict:
+        return {
+            'fecha': str(self.fecha) if self.fecha else 'N/A',
+            'email': self.email[:30],
+            'importe_original': f"{a_texto(self.importe)} {self.moneda}",
+            'total_eur': a_texto(self.total_eur),
+            'base': a_texto(self.base),
+            'iva': a_texto(self.iva),
+            'pais': self.pais if self.pais else 'DESCONOCIDO',
+            'substack_fee': a_texto(self.substack_fee),
+            'stripe_fee': a_texto(self.stripe_fee),
+        }
+
+class Factura(Registro):
+    """
+    Factura de un CSV (numero,fecha,nif,concepto,base_imponible,tipo_iva,
+    tipo_retencion). Base y tipos en Decimal; cuotas y total en céntimos.
+    """
+    __slots__ = ('numero', 'fecha', 'nif', 'concepto', 'base_imponible', 'tipo_iva',
+                 'cuota_iva', 'tipo_retencion', 'retencion', 'total')
+    
+    def __init__(self, numero: str, fecha: str, nif: str, concepto: str, base_imponible: Decimal,
+                 tipo_iva: Decimal, cuota_iva: int, tipo_retencion: Decimal, retencion: int, total: int):
+        self.numero = numero
+        self.fecha = codigo(fecha)
+        self.nif = codigo(nif)
+        self.concepto = concepto
+        self.base_imponible = base_imponible
+        self.tipo_iva = tipo_iva
+        self.cuota_iva = cuota_iva
+        self.tipo_retencion = tipo_retencion
+        self.retencion = retencion
+        self.total = total
+    
+    def argumentos(self) -> tuple:
+        return (self.numero, self.fecha, self.nif, self.concepto, self.base_imponible,
+                self.tipo_iva, self.cuota_iva, self.tipo_retencion, self.retencion, self.total)
+    
+    def importes(self) -> dict:
+        """Importes formateados, como los devuelve procesar_facturas.calcular_factura."""
+        return {
+            'base_imponible': str(self.base_imponible),
+            'tipo_iva': str(self.tipo_iva),
+            'cuota_iva': a_texto(self.cuota_iva),
+            'tipo_retencion': str(self.tipo_retencion),
+            'retencion': a_texto(self.retencion),
+            'total': a_texto(self.total),
+        }
+    
+    def a_dict(self) -> dict:
+        return {'numero': self.numero, 'fecha': self.fecha, 'nif': self.nif,
+                'concepto': self.concepto, **self.importes()}
+
+class FacturaValidada(Factura):
+    """Factura de procesar_facturas: con su línea del CSV y la validación del NIF."""
+    __slots__ = ('linea', 'nif_valido', 'advertencia_nif')
+    
+    def __init__(self, linea: int, nif_valido: bool, advertencia_nif: Optional[str], *args):
+        super().__init__(*args)
+        self.linea = linea
+        self.nif_valido = nif_valido
+        self.advertencia_nif = advertencia_nif
+    
+    def argumentos(self) -> tuple:
+        return (self.linea, self.nif_valido, self.advertencia_nif) + super().argumentos()
+    
+    def a_dict(self) -> dict:
+        resultado = {
+            'linea': self.linea,
+            'numero': self.numero,
+            'fecha': self.fecha,
+            'nif': self.nif,
+            'nif_valido': self.nif_valido,
+            'concepto': self.concepto,
+            **self.importes(),
+        }
+        if not self.nif_valido:
+            resultado['advertencia_nif'] = self.advertencia_nif
+        return resultado
+
+class Apunte(Factura):
+    """Factura anotada en el libro de ingresos y gastos ('ingreso' o 'gasto')."""
+    __slots__ = ('tipo', 'nombre')
+    
+    def __init__(self, tipo: str, nombre: str, *args):
+        super().__init__(*args)
+        self.tipo = tipo
+        self.nombre = nombre
+    
+    def argumentos(self) -> tuple:
+        return (self.tipo, self.nombre) + super().argumentos()
+    
+    def a_dict(self) -> dict:
+        return {
+            'tipo': self.tipo,
+            'numero': self.numero,
+            'fecha': self.fecha,
+            'nif': self.nif,
+            'nombre': self.nombre,
+            'concepto': self.concepto,
+            **self.importes(),
+        }
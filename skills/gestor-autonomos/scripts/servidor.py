@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+"""
+Servidor local de cálculo: las funciones de los scripts por HTTP/JSON.
+
+Cada `python3 calcular_iva.py ...` lanzado desde la automatización arranca
+un intérprete e importa los módulos (50-100 ms) para un cálculo de
+microsegundos. El servidor los carga una vez y atiende las peticiones en
+el mismo proceso:
+    
+    POST /iva       calcular_iva_trimestral (o calcular_desde_bases)
+    POST /irpf      calcular_modelo_130
+    POST /factura   calcular_factura
+    POST /nif       validar_nif ({"nif": ...}) o validar_lote ({"nifs": [...]})
+    POST /stripe    procesar_stripe de uno o varios archivos
+    POST /libro     generar_libro
+    GET  /salud
+
+El cuerpo es un objeto JSON con los mismos nombres que las columnas del
+modo lote (ver calcular_fila de cada script) o que las opciones del CLI; la
+respuesta es el mismo JSON que da el script con --json, o {"error": ...}
+con estado 400. Los cálculos escalares se hacen en el bucle de asyncio (no
+esperan a nada); los que leen archivos se envían a un ProcessPoolExecutor,
+así un libro anual no retrasa las demás peticiones. HTTP/1.1 mínimo con
+keep-alive, sin dependencias. Sin autenticación: escucha solo en
+127.0.0.1 salvo que se indique otro --host.
+    
+    python3 servidor.py --puerto 8730
+    curl -s localhost:8730/iva -d '{"iva_repercutido": "2100", "iva_soportado": "800"}'
+"""
+
+import argparse
+import asyncio
+import json
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+from http import HTTPStatus
+from typing import Callable, Dict, Optional, Tuple
+
+import cache
+import calcular_irpf
+import calcular_iva
+import generar_libro
+import lotes
+import procesar_facturas
+import procesar_stripe
+from registros import serializar
+
+# Límite del cuerpo de una petición (las de archivos solo llevan rutas)
+MAX_CUERPO = 1 << 20
+# Errores de los datos de la petición (400); el resto son fallos del servidor (500)
+ERRORES_CLIENTE = (ValueError, KeyError, TypeError, ArithmeticError, OSError)
+
+def a_json(resultado) -> bytes:
+    return json.dumps(resultado, ensure_ascii=False, default=serializar).encode('utf-8')
+
+def calcular_factura(datos: Dict) -> Dict:
+    """POST /factura: base_imponible, tipo_iva (21) y tipo_retencion (0)."""
+    if not lotes.tiene_columnas(datos, 'base_imponible'):
+        raise ValueError("Falta base_imponible")
+    return procesar_facturas.calcular_factura(
+        lotes.decimal_columna(datos, 'base_imponible'),
+        lotes.decimal_columna(datos, 'tipo_iva', '21'),
+        lotes.decimal_columna(datos, 'tipo_retencion', '0')
+    )
+
+def validar_nif(datos: Dict):
+    """POST /nif: {"nif": "..."} o {"nifs": ["...", ...]}."""
+    if 'nifs' in datos:
+        return procesar_facturas.validar_lote(str(nif) for nif in datos['nifs'])
+    return procesar_facturas.validar_nif(str(datos['nif']))
+
+def trabajo_stripe(datos: Dict) -> bytes:
+    """
+    POST /stripe (en un proceso del pool): archivos (lista o texto, con
+    comodines), año, trimestre (sin él, año completo), formato, motor,
+    sin_detalle / detalle_ndjson / detalle_mayores / detalle_muestra,
+    tipos_cambio y cache, como las opciones del CLI.
+    """
+    archivos = datos['archivos']
+    archivos = procesar_stripe.expandir_archivos([archivos] if isinstance(archivos, str) else list(archivos))
+    if not archivos:
+        raise ValueError(f"Ningún archivo coincide con {datos['archivos']}")
+    incluir_detalle = procesar_stripe.elegir_detalle(
+        bool(datos.get('sin_detalle')), datos.get('detalle_ndjson'),
+        datos.get('detalle_mayores'), datos.get('detalle_muestra')
+    )
+    almacen = None
+    if datos.get('tipos_cambio'):
+        from tipos_cambio import cargar_almacen
+        almacen = cargar_almacen(datos['tipos_cambio'], offline=True)
+    
+    año = int(datos['año'])
+    formato = datos.get('formato', 'csv')
+    motor = datos.get('motor', 'auto')
+    parciales = cache.crear(bool(datos.get('cache')))
+    # Ya estamos en un trabajador del pool: un solo proceso por petición
+    if datos.get('trimestre') is None:
+        resultado = procesar_stripe.procesar_año_completo(
+            archivos, formato, año, incluir_detalle, almacen, procesos=1, motor=motor, cache=parciales
+        )
+    else:
+        resultado = procesar_stripe.procesar_archivos(
+            archivos, formato, int(datos['trimestre']), año, incluir_detalle, almacen,
+            procesos=1, motor=motor, cache=parciales
+        )
+    procesar_stripe.anotar_detalle(resultado, incluir_detalle, archivos)
+    # Se serializa aquí: al bucle vuelven bytes, no millones de registros por pickle
+    return a_json(resultado)
+
+def trabajo_libro(datos: Dict) -> bytes:
+    """
+    POST /libro (en un proceso del pool): facturas_emitidas y/o
+    facturas_recibidas, año y un trimestre, un mes o desde/hasta
+    (YYYY-MM-DD); sin ninguno, el año completo. cache como en el CLI.
+    """
+    if not datos.get('facturas_emitidas') and not datos.get('facturas_recibidas'):
+        raise ValueError("Falta facturas_emitidas o facturas_recibidas")
+    desde = date.fromisoformat(datos['desde']) if datos.get('desde') else None
+    hasta = date.fromisoformat(datos['hasta']) if datos.get('hasta') else None
+    año = int(datos['año']) if datos.get('año') is not None else None
+    if año is None and not (desde and hasta):
+        raise ValueError("Falta año (o un rango completo con desde y hasta)")
+    periodo = generar_libro.periodo_libro(
+        año,
+        trimestre=int(datos['trimestre']) if datos.get('trimestre') is not None else None,
+        mes=int(datos['mes']) if datos.get('mes') is not None else None,
+        desde=desde,
+        hasta=hasta
+    )
+    indice = generar_libro.cargar_indice(
+        datos.get('facturas_emitidas'), datos.get('facturas_recibidas'),
+        cache.crear(bool(datos.get('cache')))
+    )
+    return a_json(generar_libro.libro_periodo(indice, periodo))
+
+# ruta → (función, si va al pool de procesos)
+RUTAS: Dict[str, Tuple[Callable[[Dict], object], bool]] = {
+    '/iva': (calcular_iva.calcular_fila, False),
+    '/irpf': (calcular_irpf.calcular_fila, False),
+    '/factura': (calcular_factura, False),
+    '/nif': (validar_nif, False),
+    '/stripe': (trabajo_stripe, True),
+    '/libro': (trabajo_libro, True),
+}
+
+class Servidor:
+    """Atiende las conexiones HTTP y reparte las peticiones."""
+    
+    def __init__(self, procesos: Optional[int] = None, registro: bool = False):
+        self.pool = ProcessPoolExecutor(max_workers=procesos)
+        self.registro = registro
+        self.peticiones = 0
+        self.trabajos_en_curso = 0
+    
+    async def responder(self, metodo: str, ruta: str, cuerpo: bytes) -> Tuple[int, bytes]:
+        """(estado HTTP, JSON) de una petición."""
+        ruta = ruta.split('?', 1)[0].rstrip('/') or '/'
+        if ruta == '/salud':
+            return HTTPStatus.OK, a_json({
+                'estado': 'ok',
+                'peticiones': self.peticiones,
+                'trabajos_en_curso': self.trabajos_en_curso,
+                'rutas': sorted(RUTAS),
+            })
+        if ruta not in RUTAS:
+            return HTTPStatus.NOT_FOUND, a_json({'error': f'Ruta desconocida: {ruta}', 'rutas': sorted(RUTAS)})
+        if metodo != 'POST':
+            return HTTPStatus.METHOD_NOT_ALLOWED, a_json({'error': f'{ruta} solo admite POST'})
+        
+        try:
+            datos = json.loads(cuerpo or b'{}')
+        except ValueError as e:
+            return HTTPStatus.BAD_REQUEST, a_json({'error': f'JSON no válido: {e}'})
+        if not isinstance(datos, dict):
+            return HTTPStatus.BAD_REQUEST, a_json({'error': 'El cuerpo debe ser un objeto JSON'})
+        
+        funcion, en_pool = RUTAS[ruta]
+        try:
+            if not en_pool:
+                return HTTPStatus.OK, a_json(funcion(datos))
+            self.trabajos_en_curso += 1
+            try:
+                return HTTPStatus.OK, await asyncio.get_running_loop().run_in_executor(self.pool, funcion, datos)
+            finally:
+                self.trabajos_en_curso -= 1
+        except ERRORES_CLIENTE as e:
+            return HTTPStatus.BAD_REQUEST, a_json({'error': f'{type(e).__name__}: {e}'})
+        except Exception as e:
+            print(f"Error en {ruta}: {type(e).__name__}: {e}", file=sys.stderr)
+            return HTTPStatus.INTERNAL_SERVER_ERROR, a_json({'error': f'{type(e).__name__}: {e}'})
+    
+    async def atender(self, lector: asyncio.StreamReader, escritor: asyncio.StreamWriter):
+        """Una conexión: peticiones HTTP/1.x seguidas mientras el cliente la mantenga abierta."""
+        try:
+            while True:
+                linea = await lector.readline()
+                if not linea:
+                    break
+                inicio = time.perf_counter()
+                try:
+                    metodo, ruta, version = linea.decode('latin-1').split()
+                except ValueError:
+                    await self.enviar(escritor, HTTPStatus.BAD_REQUEST, a_json({'error': 'Petición mal formada'}), False)
+                    break
+                cabeceras = {}
+                while True:
+                    linea = await lector.readline()
+                    if linea in (b'\r\n', b'\n', b''):
+                        break
+                    nombre, _, valor = linea.decode('latin-1').partition(':')
+                    cabeceras[nombre.strip().lower()] = valor.strip()
+                
+                conexion = cabeceras.get('connection', '').lower()
+                mantener = conexion == 'keep-alive' if version == 'HTTP/1.0' else conexion != 'close'
+                longitud = int(cabeceras.get('content-length') or 0)
+                if longitud > MAX_CUERPO:
+                    await self.enviar(escritor, HTTPStatus.REQUEST_ENTITY_TOO_LARGE,
+                                      a_json({'error': f'Cuerpo de más de {MAX_CUERPO} bytes'}), False)
+                    break
+                cuerpo = await lector.readexactly(longitud) if longitud else b''
+                
+                self.peticiones += 1
+                estado, respuesta = await self.responder(metodo, ruta, cuerpo)
+                await self.enviar(escritor, estado, respuesta, mantener)
+                if self.registro:
+                    print(f"{metodo} {ruta} {int(estado)} {(time.perf_counter() - inicio) * 1000:.2f} ms",
+                          file=sys.stderr)
+                if not mantener:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            escritor.close()
+    
+    async def enviar(self, escritor: asyncio.StreamWriter, estado: int, cuerpo: bytes, mantener: bool):
+        estado = HTTPStatus(estado)
+        escritor.write(
+            f"HTTP/1.1 {estado.value} {estado.phrase}\r\n"
+            f"Content-Type: application/json; charset=utf-8\r\n"
+            f"Content-Length: {len(cuerpo)}\r\n"
+            f"Connection: {'keep-alive' if mantener else 'close'}\r\n\r\n".encode('latin-1') + cuerpo
+        )
+        await escritor.drain()
+    
+    async def servir(self, host: str, puerto: int):
+        servidor = await asyncio.start_server(self.atender, host, puerto)
+        direcciones = ', '.join(f'{s.getsockname()[0]}:{s.getsockname()[1]}' for s in servidor.sockets)
+        print(f"🧮 Servidor de cálculo en {direcciones} ({', '.join(sorted(RUTAS))})", file=sys.stderr)
+        async with servidor:
+            await servidor.serve_forever()
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Servidor local HTTP/JSON con los cálculos de los scripts (sin arrancar un intérprete por cálculo)',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Ejemplos de uso:
+  python3 servidor.py --puerto 8730
+  
+  curl -s localhost:8730/iva -d '{"iva_repercutido": "2100", "iva_soportado": "800", "compensacion": "0"}'
+  curl -s localhost:8730/irpf -d '{"ingresos": "12000", "gastos": "3000", "retenciones": "1800"}'
+  curl -s localhost:8730/factura -d '{"base_imponible": "1000", "tipo_retencion": "15"}'
+  curl -s localhost:8730/nif -d '{"nif": "12345678Z"}'
+  curl -s localhost:8730/stripe -d '{"archivos": "pagos/2025-*.csv", "año": 2025, "trimestre": 4, "sin_detalle": true}'
+  curl -s localhost:8730/libro -d '{"facturas_emitidas": "emitidas.csv", "año": 2025, "trimestre": 1}'
+        """
+    )
+    parser.add_argument('--host', default='127.0.0.1', help='Dirección de escucha (default: 127.0.0.1, solo local)')
+    parser.add_argument('--puerto', type=int, default=8730, help='Puerto (default: 8730)')
+    parser.add_argument('--procesos', type=int,
+                        help='Procesos para los trabajos con archivos (/stripe, /libro; default: nº de CPUs)')
+    parser.add_argument('--registro', action='store_true', help='Una línea por petición en stderr, con su duración')
+    
+    args = parser.parse_args()
+    
+    servidor = Servidor(args.procesos, args.registro)
+    try:
+        asyncio.run(servidor.servir(args.host, args.puerto))
+    except KeyboardInterrupt:
+        pass
+    except OSError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
+    finally:
+        servidor.pool.shutdown(cancel_futures=True)
+
+if __name__ == "__main__":
+    main()
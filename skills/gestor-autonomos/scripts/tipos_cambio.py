@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+"""
+Almacén local de tipos de cambio históricos del BCE.
+
+Parte de la serie histórica del Banco Central Europeo (eurofxref-hist.csv:
+una fila por día, una columna por moneda, en unidades de moneda por 1 EUR)
+y la compila a un archivo binario compacto que se abre con mmap:
+    
+    cabecera   b'BCEFX1\\0\\0', nº días (uint32), nº monedas (uint32)
+    monedas    4 bytes ASCII por moneda
+    días       int32 por día (ordinal de la fecha), ordenados
+    tipos      int64 por moneda y día (tipo × 10^6), columna a columna
+
+Los días sin cotización (fines de semana, festivos, 'N/A') usan el último
+tipo publicado, así que la consulta es una búsqueda binaria sobre los días
+más un acceso directo a la columna de la moneda.
+"""
+
+import argparse
+import bisect
+import csv
+import io
+import json
+import mmap
+import os
+import struct
+import sys
+import zipfile
+from array import array
+from datetime import date
+from decimal import Decimal
+from functools import lru_cache
+from typing import Dict, Optional
+
+MAGIA = b'BCEFX1\0\0'
+CABECERA = struct.Struct('<8sII')
+ESCALA = 6  # decimales guardados por tipo
+URL_BCE = 'https://www.ecb.europa.eu/stats/eurofxref/eurofxref-hist.zip'
+
+def compilar_csv_bce(origen: str, destino: str) -> Dict:
+    """
+    Compila un CSV del BCE al formato binario.
+    Returns: dict con nº de días, monedas y rango de fechas
+    """
+    with open(origen, 'r', encoding='utf-8-sig', newline='') as f:
+        reader = csv.reader(f)
+        cabecera = next(reader)
+        monedas = [m.strip().upper() for m in cabecera[1:] if m.strip()]
+        filas = []
+        for row in reader:
+            if not row or not row[0].strip():
+                continue
+            filas.append((date.fromisoformat(row[0].strip()).toordinal(), row[1:len(monedas) + 1]))
+    
+    # El BCE publica del más reciente al más antiguo
+    filas.sort(key=lambda x: x[0])
+    
+    dias = array('i', (ordinal for ordinal, _ in filas))
+    columnas = [array('q', bytes(8 * len(filas))) for _ in monedas]
+    ultimo = [0] * len(monedas)
+    for i, (_, valores) in enumerate(filas):
+        for j, valor in enumerate(valores):
+            valor = valor.strip()
+            if valor and valor.upper() != 'N/A':
+                escalado = Decimal(valor).scaleb(ESCALA)
+                if escalado != escalado.to_integral_value():
+                    raise ValueError(f'Tipo con más de {ESCALA} decimales: {valor}')
+                ultimo[j] = int(escalado)
+            columnas[j][i] = ultimo[j]
+    
+    if sys.byteorder != 'little':
+        dias.byteswap()
+        for columna in columnas:
+            columna.byteswap()
+    
+    tmp = destino + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(CABECERA.pack(MAGIA, len(dias), len(monedas)))
+        for moneda in monedas:
+            f.write(moneda.encode('ascii')[:4].ljust(4, b'\0'))
+        f.write(dias.tobytes())
+        if f.tell() % 8:
+            f.write(bytes(8 - f.tell() % 8))
+        for columna in columnas:
+            f.write(columna.tobytes())
+    os.replace(tmp, destino)
+    
+    return {
+        'dias': len(dias),
+        'monedas': monedas,
+        'desde': str(date.fromordinal(dias[0])) if len(dias) else None,
+        'hasta': str(date.fromordinal(dias[-1])) if len(dias) else None,
+    }
+
+class AlmacenTiposCambio:
+    """Tipos del BCE compilados, mapeados en memoria (ver compilar_csv_bce)."""
+    
+    def __init__(self, ruta: str, cache: int = 65536):
+        self.ruta = ruta
+        self._archivo = open(ruta, 'rb')
+        self._mmap = mmap.mmap(self._archivo.fileno(), 0, access=mmap.ACCESS_READ)
+        magia, num_dias, num_monedas = CABECERA.unpack_from(self._mmap, 0)
+        if magia != MAGIA:
+            raise ValueError(f'No es un almacén de tipos de cambio: {ruta}')
+        if sys.byteorder != 'little':
+            raise ValueError('El almacén compilado es little-endian')
+        
+        pos = CABECERA.size
+        self.monedas = [
+            self._mmap[pos + 4 * i:pos + 4 * i + 4].rstrip(b'\0').decode('ascii')
+            for i in range(num_monedas)
+        ]
+        pos += 4 * num_monedas
+        self._vista = vista = memoryview(self._mmap)
+        self._dias = vista[pos:pos + 4 * num_dias].cast('i')
+        pos += 4 * num_dias
+        pos += -pos % 8
+        self._columnas = {
+            moneda: vista[pos + 8 * num_dias * j:pos + 8 * num_dias * (j + 1)].cast('q')
+            for j, moneda in enumerate(self.monedas)
+        }
+        self.tipo = lru_cache(maxsize=cache)(self._tipo)
+    
+    @property
+    def primer_dia(self) -> Optional[date]:
+        return date.fromordinal(self._dias[0]) if len(self._dias) else None
+    
+    @property
+    def ultimo_dia(self) -> Optional[date]:
+        return date.fromordinal(self._dias[-1]) if len(self._dias) else None
+    
+    def _tipo(self, moneda: str, fecha: Optional[date] = None) -> Optional[Decimal]:
+        """
+        Unidades de `moneda` por 1 EUR vigentes en `fecha` (último tipo
+        publicado en o antes de esa fecha; sin fecha, el más reciente).
+        None si la moneda no está o la fecha es anterior a la serie.
+        """
+        columna = self._columnas.get(moneda)
+        if columna is None or not len(self._dias):
+            return None
+        if fecha is None:
+            i = len(self._dias) - 1
+        else:
+            i = bisect.bisect_right(self._dias, fecha.toordinal()) - 1
+            if i < 0:
+                return None
+        valor = columna[i]
+        return Decimal(valor).scaleb(-ESCALA) if valor else None
+    
+    def cerrar(self):
+        self.tipo.cache_clear()
+        self._dias.release()
+        for columna in self._columnas.values():
+            columna.release()
+        self._vista.release()
+        self._mmap.close()
+        self._archivo.close()
+
+def descargar_bce(destino: str) -> str:
+    """Descarga la serie histórica del BCE (CSV) en `destino`."""
+    import urllib.request
+    with urllib.request.urlopen(URL_BCE, timeout=30) as respuesta:
+        contenido = respuesta.read()
+    with zipfile.ZipFile(io.BytesIO(contenido)) as z:
+        nombre = next(n for n in z.namelist() if n.endswith('.csv'))
+        with open(destino, 'wb') as f:
+            f.write(z.read(nombre))
+    return destino
+
+def cargar_almacen(ruta: str, offline: bool = False) -> AlmacenTiposCambio:
+    """
+    Abre un almacén de tipos de cambio.
+    
+    `ruta` puede ser el binario compilado o el CSV del BCE; en ese caso se
+    compila a `<ruta>.bin` (y se reutiliza mientras el CSV no cambie). Si el
+    CSV no existe se descarga del BCE, salvo en modo offline.
+    """
+    if os.path.exists(ruta):
+        with open(ruta, 'rb') as f:
+            if f.read(len(MAGIA)) == MAGIA:
+                return AlmacenTiposCambio(ruta)
+    else:
+        if offline:
+            raise FileNotFoundError(f'No existe {ruta} y --offline impide descargarlo del BCE')
+        print(f"🌐 Descargando tipos de cambio del BCE en {ruta}", file=sys.stderr)
+        descargar_bce(ruta)
+    
+    compilado = ruta + '.bin'
+    if not os.path.exists(compilado) or os.path.getmtime(compilado) < os.path.getmtime(ruta):
+        compilar_csv_bce(ruta, compilado)
+    return AlmacenTiposCambio(compilado)
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Almacén local de tipos de cambio del BCE',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Ejemplos de uso:
+  # Descargar la serie histórica del BCE:
+  python3 tipos_cambio.py --descargar eurofxref-hist.csv
+  
+  # Compilar el CSV a binario:
+  python3 tipos_cambio.py --compilar eurofxref-hist.csv --salida bce.bin
+  
+  # Consultar un tipo:
+  python3 tipos_cambio.py --almacen bce.bin --moneda USD --fecha 2025-10-02
+        """
+    )
+    
+    parser.add_argument('--descargar', type=str, help='Descargar el CSV del BCE en esta ruta')
+    parser.add_argument('--compilar', type=str, help='CSV del BCE a compilar')
+    parser.add_argument('--salida', type=str, help='Binario de salida (default: <csv>.bin)')
+    parser.add_argument('--almacen', type=str, help='Almacén (CSV o binario) a consultar')
+    parser.add_argument('--moneda', type=str, help='Moneda a consultar (ej: USD)')
+    parser.add_argument('--fecha', type=str, help='Fecha a consultar (YYYY-MM-DD)')
+    parser.add_argument('--offline', action='store_true', help='No descargar nada')
+    parser.add_argument('--json', action='store_true', help='Salida en formato JSON')
+    
+    args = parser.parse_args()
+    
+    try:
+        if args.descargar:
+            if args.offline:
+                parser.error('--descargar no es compatible con --offline')
+            descargar_bce(args.descargar)
+            print(f"✅ Descargado en {args.descargar}", file=sys.stderr)
+        
+        if args.compilar:
+            salida = args.salida or args.compilar + '.bin'
+            info = compilar_csv_bce(args.compilar, salida)
+            if args.json:
+                print(json.dumps(info, indent=2, ensure_ascii=False))
+            else:
+                print(f"✅ {info['dias']} días, {len(info['monedas'])} monedas ({info['desde']} → {info['hasta']}) en {salida}")
+        
+        if args.almacen and args.moneda:
+            almacen = cargar_almacen(args.almacen, offline=args.offline)
+            fecha = date.fromisoformat(args.fecha) if args.fecha else None
+            tipo = almacen.tipo(args.moneda.upper(), fecha)
+            resultado = {
+                'moneda': args.moneda.upper(),
+                'fecha': args.fecha or str(almacen.ultimo_dia),
+                'tipo_por_eur': str(tipo) if tipo is not None else None,
+            }
+            if args.json:
+                print(json.dumps(resultado, indent=2, ensure_ascii=False))
+            elif tipo is None:
+                print(f"❌ Sin tipo para {resultado['moneda']} en {resultado['fecha']}")
+            else:
+                print(f"1 EUR = {tipo} {resultado['moneda']} ({resultado['fecha']})")
+        
+        if not (args.descargar or args.compilar or (args.almacen and args.moneda)):
+            parser.print_help()
+    
+    except Exception as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,13 @@
+"""
+Configuración común de los tests.
+
+Los scripts se importan entre ellos como módulos sueltos, así que el
+directorio scripts/ va en sys.path (igual que hace scripts/benchmark).
+"""
+
+import os
+import sys
+
+DIRECTORIO_SCRIPTS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'scripts')
+if DIRECTORIO_SCRIPTS not in sys.path:
+    sys.path.insert(0, DIRECTORIO_SCRIPTS)
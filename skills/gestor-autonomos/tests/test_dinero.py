@@ -0,0 +1,74 @@
+"""
+dinero.py frente al cálculo Decimal + quantize(Decimal('0.01')) con ROUND_HALF_UP.
+
+Cada operación en céntimos tiene que dar el mismo céntimo que la fórmula
+Decimal que sustituyó en los scripts, incluidos medios céntimos y negativos.
+"""
+
+import random
+from decimal import Decimal, InvalidOperation
+
+import pytest
+
+import dinero
+from dinero import (
+    a_centimos, a_decimal, a_texto, dividir, dividir_entre, multiplicar,
+    porcentaje, porcentaje_de, redondear, texto_a_centimos,
+)
+
+TIPOS = ['21', '10', '4', '0', '15', '7', '19', '5.5', '10.5']
+FACTORES = ['0.92', '1.17', '0.68', '1.05', '0.054', '0.00092', '0.25', '1.092100', '158.120000', '1.21']
+
+def casos(n: int, semilla: int):
+    """n importes (céntimos) aleatorios con un tipo y un factor, siempre los mismos."""
+    aleatorio = random.Random(semilla)
+    for _ in range(n):
+        centimos = aleatorio.choice([
+            aleatorio.randint(-10**4, 10**4),
+            aleatorio.randint(0, 10**7),
+            aleatorio.randint(0, 10**11),
+        ])
+        yield centimos, Decimal(aleatorio.choice(TIPOS)), Decimal(aleatorio.choice(FACTORES))
+
+@pytest.mark.parametrize('semilla', range(4))
+def test_operaciones_coinciden_con_decimal(semilla):
+    for centimos, tipo, factor in casos(5000, semilla):
+        valor = a_decimal(centimos)
+        contexto = (centimos, tipo, factor)
+        assert a_decimal(porcentaje(centimos, tipo)) == redondear(valor * tipo / Decimal('100')), contexto
+        assert porcentaje_de(valor, tipo) == porcentaje(centimos, tipo), contexto
+        assert a_decimal(multiplicar(centimos, factor)) == redondear(valor * factor), contexto
+        assert a_decimal(dividir_entre(centimos, factor)) == redondear(valor / factor), contexto
+        assert a_texto(centimos) == str(redondear(valor)), contexto
+        assert a_centimos(valor) == centimos, contexto
+
+@pytest.mark.parametrize('valor', [
+    '0.005', '0.015', '-0.005', '-0.015', '2.675', '1.125', '-1.125',
+    '208.978', '0.0049999', '-0.0050001', '123456789.995', '1E+3', '0',
+])
+def test_a_centimos_redondea_como_quantize(valor):
+    assert a_decimal(a_centimos(Decimal(valor))) == redondear(Decimal(valor))
+
+def test_a_centimos_suma_antes_de_redondear():
+    # Total de una factura con base de 3 decimales: 208.978 + 8.36 - 14.63
+    base = Decimal('208.978')
+    assert a_centimos(base, 836 - 1463) == a_centimos(base + Decimal('8.36') - Decimal('14.63'))
+    assert a_texto(a_centimos(base, 836 - 1463)) == '202.71'
+
+@pytest.mark.parametrize('numerador, denominador, esperado', [
+    (1, 2, 1), (3, 2, 2), (-1, 2, -1), (-3, 2, -2), (5, 3, 2), (-5, 3, -2), (0, 7, 0),
+])
+def test_dividir_medio_se_aleja_de_cero(numerador, denominador, esperado):
+    assert dividir(numerador, denominador) == esperado
+
+@pytest.mark.parametrize('texto', ['60', '60.5', '60.00', '0.01', '1e2', '12.345', '-3.50', '007.10'])
+def test_texto_a_centimos(texto):
+    assert texto_a_centimos(texto) == a_centimos(Decimal(texto))
+
+def test_texto_a_centimos_rechaza_no_numeros():
+    with pytest.raises(InvalidOperation):
+        texto_a_centimos('abc')
+
+def test_fraccion_exacta():
+    assert dinero.fraccion(Decimal('1.21')) == (121, 100)
+    assert dinero.fraccion(Decimal('5.5')) == (11, 2)
@@ -0,0 +1,94 @@
+"""
+Resultados de los scripts frente a los de la versión anterior a la
+aritmética en céntimos (dinero.py).
+
+datos/resultados_esperados.json se generó ejecutando los scripts originales
+(commit 2a3d34f, todo con Decimal) sobre los CSV de datos/: pagos en EUR,
+USD, GBP y CAD con y sin país, y facturas con bases de 2 y 3 decimales y
+coma decimal. Se compara solo lo que la versión original ya devolvía: las
+claves añadidas después (filas_rechazadas, num_nifs_invalidos...) y las
+fechas de cálculo no cuentan, y los apuntes del libro se ordenan por número
+porque ahora salen por fecha.
+"""
+
+import json
+import os
+from decimal import Decimal
+
+import pytest
+
+import calcular_irpf
+import calcular_iva
+import generar_libro
+import procesar_facturas
+import procesar_stripe
+from registros import serializar
+
+DATOS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'datos')
+
+with open(os.path.join(DATOS, 'resultados_esperados.json'), encoding='utf-8') as f:
+    ESPERADOS = json.load(f)
+
+def plano(resultado):
+    """Resultado tal como lo escribe --json (registros y Decimal a texto)."""
+    return json.loads(json.dumps(resultado, default=serializar))
+
+def comparar(obtenido, esperado, ruta=''):
+    """Falla en la primera diferencia, ignorando claves que el esperado no tiene."""
+    if isinstance(esperado, dict):
+        assert isinstance(obtenido, dict), ruta
+        for clave, valor in esperado.items():
+            assert clave in obtenido, f"{ruta}/{clave}: falta"
+            comparar(obtenido[clave], valor, f"{ruta}/{clave}")
+    elif isinstance(esperado, list):
+        assert isinstance(obtenido, list) and len(obtenido) == len(esperado), ruta
+        for i, (o, e) in enumerate(zip(obtenido, esperado)):
+            comparar(o, e, f"{ruta}[{i}]")
+    else:
+        assert obtenido == esperado, ruta
+
+def ruta(nombre: str) -> str:
+    return os.path.join(DATOS, nombre)
+
+@pytest.mark.parametrize('motor', ['python', 'numpy'])
+@pytest.mark.parametrize('trimestre', [3, 4])
+def test_procesar_stripe(trimestre, motor):
+    if motor == 'numpy':
+        pytest.importorskip('numpy')
+    pagos = procesar_stripe.cargar_csv(ruta('pagos_stripe.csv'))
+    resultado = procesar_stripe.procesar_substack_stripe(pagos, trimestre, 2025, motor=motor)
+    comparar(plano(resultado), ESPERADOS['procesar_stripe'][f'{trimestre}T'])
+    assert resultado['resumen']['filas_rechazadas']['cantidad'] == 0
+
+def test_procesar_stripe_varios_archivos_igual_que_uno():
+    archivo = ruta('pagos_stripe.csv')
+    resultado = procesar_stripe.procesar_archivos([archivo, archivo], 'csv', 4, 2025, procesos=1)
+    unico = plano(procesar_stripe.procesar_substack_stripe(procesar_stripe.cargar_csv(archivo), 4, 2025))
+    assert resultado['resumen']['total_pagos'] == 2 * unico['resumen']['total_pagos']
+    assert Decimal(resultado['fees']['total']) == 2 * Decimal(unico['fees']['total'])
+
+def test_generar_libro():
+    libro = plano(generar_libro.generar_libro(
+        4, 2025, ruta('facturas_emitidas.csv'), ruta('facturas_recibidas.csv')))
+    for clave in ('ingresos', 'gastos'):
+        libro[clave].sort(key=lambda apunte: apunte['numero'])
+    comparar(libro, ESPERADOS['generar_libro'])
+
+@pytest.mark.parametrize('tipo', ['emitidas', 'recibidas'])
+def test_procesar_facturas(tipo):
+    resultado = plano(procesar_facturas.procesar_csv(ruta(f'facturas_{tipo}.csv'), tipo))
+    comparar(resultado, ESPERADOS['procesar_facturas'][tipo])
+
+@pytest.mark.parametrize('caso', ESPERADOS['calcular_iva'])
+def test_calcular_iva(caso):
+    if 'trimestral' in caso:
+        resultado = calcular_iva.calcular_iva_trimestral(*map(Decimal, caso['trimestral']))
+    else:
+        resultado = calcular_iva.calcular_desde_bases(*map(Decimal, caso['desde_bases']))
+    comparar(plano(resultado), caso['resultado'])
+
+@pytest.mark.parametrize('caso', ESPERADOS['calcular_irpf'])
+def test_calcular_irpf(caso):
+    resultado = calcular_irpf.calcular_modelo_130(
+        *map(Decimal, caso['argumentos']), aplicar_reduccion_5_gastos=caso['reduccion_gastos'])
+    comparar(plano(resultado), caso['resultado'])